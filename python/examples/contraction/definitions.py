@@ -82,12 +82,7 @@ class EinsumProblem(ProblemDefinition):
                          types: Sequence[np.dtype]) -> List[np.dtype]:
     """Returns random NumPy suitable for calling the kernel."""
     shapes = [s if s else [1] for s in self.shapes_builder(sizes)]
-    tensors = [
-        realign(np.random.rand(*s).astype(t), byte_alignment=64)
-        for s, t in zip(shapes, types)
-    ]
-    tensors[-1].fill(0.)
-    return tensors
+    return tensor_pool.build(shapes, types, byte_alignment=64)
 
   def check_np(self, *args: np.dtype) -> None:
     """Checks whether the computation results correspond to the reference
@@ -98,7 +93,9 @@ class EinsumProblem(ProblemDefinition):
     with the actual result. Raises ValueError on mismatch.
     """
     output = args[-1]
-    reference_output = np.einsum(str(self.specification), *args[:-1])
+    reference_output = reference_cache.get(
+        ("einsum", str(self.specification)), args[:-1],
+        lambda: np.einsum(str(self.specification), *args[:-1], optimize=True))
     if not np.allclose(output, reference_output):
       delta = output - reference_output
       max_abs_delta = max(delta.max(), delta.min(), key=abs)
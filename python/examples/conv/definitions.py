@@ -1,4 +1,4 @@
-import os, itertools
+import os
 
 from typing import Any, List, Mapping, Optional, Sequence, Tuple, Union
 
@@ -266,19 +266,55 @@ class ConvolutionProblem(ProblemDefinition):
                          types: Sequence[np.dtype]) -> List[np.dtype]:
     """Returns random NumPy suitable for calling the kernel."""
     shapes = self.shapes_builder(sizes)
-    tensors = [
-        realign(np.random.rand(*s).astype(t), byte_alignment=64)
-        for s, t in zip(shapes, types)
-    ]
+    tensors = tensor_pool.build(shapes, types, byte_alignment=64)
     # Uncomment to simplify debugging.
     # tensors = [
     #     realign(np.arange(1, np.prod(s) + 1).reshape(s).astype(t), \
     #             byte_alignment=64) \
     #     for s, t in zip(shapes, types)
     # ]
-    tensors[-1].fill(0.)
     return tensors
 
+  def __output_format(self) -> str:
+    """Returns the output format, following the rules of the output shape."""
+    input_rank_dims_start, input_rank_dims_end = find_contiguous_rank_dims(
+        self.__input_format)
+    kernel_rank_dims_start, kernel_rank_dims_end = find_contiguous_rank_dims(
+        self.__kernel_format)
+    return (self.__input_format[:input_rank_dims_start].replace("C", "") +
+            self.__kernel_format[:kernel_rank_dims_start].replace("C", "") +
+            self.__input_format[input_rank_dims_start:input_rank_dims_end] +
+            self.__input_format[input_rank_dims_end:].replace("C", "") +
+            self.__kernel_format[kernel_rank_dims_end:].replace("C", ""))
+
+  def reference_np(self, I: np.dtype, K: np.dtype) -> np.dtype:
+    """Reference numpy implementation, returns the result.
+
+    Takes an im2col view of the input, with one extra dimension per kernel
+    rank-related dimension, and contracts it with the kernel in a single einsum.
+    For example, for the NHWC, HWCF convolution, the computation is
+      O[n, h, w, f] = sum(I[n, h * SH + kh * DH, w * SW + kw * DW, c] *
+                          K[kh, kw, c, f]) over kh, kw, c.
+    """
+    input_rank_dims_start, input_rank_dims_end = find_contiguous_rank_dims(
+        self.__input_format)
+    kernel_rank_dims_start, kernel_rank_dims_end = find_contiguous_rank_dims(
+        self.__kernel_format)
+    windows = sliding_windows(
+        I, range(input_rank_dims_start, input_rank_dims_end),
+        K.shape[kernel_rank_dims_start:kernel_rank_dims_end], self.__strides,
+        self.__dilations)
+
+    # Output rank-related dimensions are named by the uppercase characters of
+    # the formats and kernel ones by their lowercase counterparts.
+    input_rank_format = self.__input_format[
+        input_rank_dims_start:input_rank_dims_end]
+    windows_format = self.__input_format + input_rank_format.lower()
+    kernel_format = "".join(char.lower() if char in RANK_RELATED_DIMS else char
+                            for char in self.__kernel_format)
+    equation = f"{windows_format},{kernel_format}->{self.__output_format()}"
+    return np.einsum(equation, windows, K, optimize=True)
+
   def check_np(self, I: np.dtype, K: np.dtype, O: np.dtype):
     """Checks whether the computation results correspond to the reference
 
@@ -287,80 +323,10 @@ class ConvolutionProblem(ProblemDefinition):
     Given the list of NumPy arrays, computes the expected result and compares it
     with the actual result. Raises ValueError on mismatch.
     """
-    reference_O = np.zeros(O.shape)
-
-    input_rank_dims_start, input_rank_dims_end = find_contiguous_rank_dims(
-        self.__input_format)
-    kernel_rank_dims_start, kernel_rank_dims_end = find_contiguous_rank_dims(
-        self.__kernel_format)
-
-    # Compute the output rank-related dimensions by doing the computation
-    # inverse to that of shape_builder. An alternative would be to extract them
-    # from the shape of O but that requires knowing their position in the list.
-    input_rank_dims = I.shape[input_rank_dims_start:input_rank_dims_end]
-    kernel_rank_dims = K.shape[kernel_rank_dims_start:kernel_rank_dims_end]
-    # Shape relations on rank-related dimensions:
-    #      iw = [(ow - 1) * sw + 1] + [(kw - 1) * dw + 1] - 1
-    #   => iw = [(ow - 1) * sw] + [(kw - 1) * dw] + 1
-    #    => ow = [iw - (kw - 1) * dw - 1] / sw + 1
-    iw = np.array(input_rank_dims)
-    kw = np.array(kernel_rank_dims)
-    dw = np.array(self.__dilations)
-    sw = np.array(self.__strides)
-    ones = np.ones(iw.shape, dtype=int)
-    output_rank_dims = tuple((iw - (kw - ones) * dw - ones) // sw + 1)
-    input_parallel_dim = self.__input_format[::-1].index("N")
-    kernel_parallel_dim = self.__kernel_format[::-1].index("F")
-
-    # Compute the convolution by taking (overlapping) output-sized slices of the
-    # input that start at 0,1,...,KH, 0,1,...KW offsets, computing their
-    # tensordot-product with the corresponding slices of the kernel, and
-    # accumulating the result by addition. For example, for the NHWC, HWCF
-    # convolution, the computation is
-    #   O += I[:, kh:kh+H, kw:kw+W, :] . K[kh, kw, :, :] for kh in 0..KH,
-    #                                                    for kw in 0..KW.
-    # with H, W and C dimensions being reduced by tensordot and N, F remaining.
-    for ks in itertools.product(*map(range, kernel_rank_dims)):
-      input_slices = []
-      ranked_pos = 0
-      for char in self.__input_format:
-        if char in RANK_RELATED_DIMS:
-          # slice(a,b) is just a flexible form of a:b.
-          input_slices.append(
-              slice(
-                  self.__dilations[ranked_pos] * ks[ranked_pos],
-                  self.__dilations[ranked_pos] * ks[ranked_pos] +
-                  output_rank_dims[ranked_pos]))
-          ranked_pos += 1
-        else:
-          input_slices.append(slice(None))
-      slice_input = I[tuple(input_slices)]
-
-      input_strides = []
-      ranked_pos = 0
-      for i, char in enumerate(self.__input_format):
-        if char in RANK_RELATED_DIMS:
-          input_strides.append( \
-              slice_input.strides[i] * self.__strides[ranked_pos])
-          ranked_pos += 1
-        else:
-          input_strides.append(slice_input.strides[i])
-      slice_input.strides = input_strides
-
-      kernel_slices = []
-      ranked_pos = 0
-      for char in self.__kernel_format:
-        if char in RANK_RELATED_DIMS:
-          kernel_slices.append(ks[ranked_pos])
-          ranked_pos += 1
-        else:
-          kernel_slices.append(slice(None))
-      slice_kernel = K[tuple(kernel_slices)]
-
-      reference_O += np.tensordot(slice_input,
-                                  slice_kernel,
-                                  axes=([input_parallel_dim],
-                                        [kernel_parallel_dim]))
+    problem_key = ("conv", self.__input_format, self.__kernel_format,
+                   tuple(self.__strides), tuple(self.__dilations))
+    reference_O = reference_cache.get(problem_key, [I, K],
+                                      lambda: self.reference_np(I, K))
 
     if not np.allclose(O, reference_O):
       delta = O - reference_O
@@ -0,0 +1,207 @@
+"""Analytical model of the tile sizes of matmul-like problems.
+
+Random starting points of tile size searches waste many evaluations on large
+matmuls. This module describes the host from sysfs and /proc/cpuinfo and
+applies the BLIS analytical model, which derives the register tile (mr, nr)
+from the vector units and the cache blocking (mc, nc, kc) from the cache
+geometry, to seed the searches with good initial tile sizes and interchanges.
+
+The model is ported from `experimental/alp/python/alp/backend/utils.py`, see
+https://www.cs.utexas.edu/users/flame/pubs/TOMS-BLIS-Analytical.pdf.
+"""
+
+import os
+
+from collections import namedtuple
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .utils import CPU_CACHE_DIR, parse_cache_size
+
+_CPUINFO_FILE = '/proc/cpuinfo'
+
+# Latency of vector FMAs in cycles, the CPU flags do not describe it.
+_DEFAULT_FMA_LATENCY = 4
+
+# Data or unified cache of a given level.
+CacheLevel = namedtuple('CacheLevel',
+                        ['level', 'size_bytes', 'ways', 'line_bytes'])
+
+
+class HardwareDescriptor:
+  """Vector units and data caches of a CPU, innermost cache first."""
+
+  def __init__(self,
+               vector_bytes: int,
+               num_fma_units: int,
+               caches: Sequence[CacheLevel],
+               fma_latency: int = _DEFAULT_FMA_LATENCY):
+    self.vector_bytes = vector_bytes
+    self.num_fma_units = num_fma_units
+    self.fma_latency = fma_latency
+    self.caches = sorted(caches, key=lambda c: c.level)
+
+  @staticmethod
+  def from_host() -> 'HardwareDescriptor':
+    """Describe the first CPU of the host.
+
+    The caches are read from sysfs, the vector width and the number of FMA
+    units are inferred from the CPU flags. Missing information is replaced by
+    conservative defaults.
+    """
+    flags = set()
+    try:
+      with open(_CPUINFO_FILE, 'r') as f:
+        for line in f:
+          key, _, value = line.partition(':')
+          if key.strip() in ('flags', 'Features'):
+            flags = set(value.split())
+            break
+    except OSError:
+      pass
+    if 'avx512f' in flags:
+      vector_bytes = 64
+    elif 'avx' in flags or 'avx2' in flags:
+      vector_bytes = 32
+    else:
+      vector_bytes = 16
+    num_fma_units = 2 if flags & {'fma', 'avx512f', 'asimd'} else 1
+
+    caches = []
+    try:
+      for index in sorted(os.listdir(CPU_CACHE_DIR)):
+        directory = os.path.join(CPU_CACHE_DIR, index)
+        if not index.startswith('index'):
+          continue
+
+        def read(name: str) -> str:
+          with open(os.path.join(directory, name)) as f:
+            return f.read().strip()
+
+        if read('type') == 'Instruction':
+          continue
+        caches.append(
+            CacheLevel(int(read('level')), parse_cache_size(read('size')),
+                       int(read('ways_of_associativity')),
+                       int(read('coherency_line_size'))))
+    except (OSError, ValueError):
+      caches = []
+    if len(caches) < 2:
+      # Typical 32KB L1 and 1MB L2.
+      caches = [CacheLevel(1, 32 * 1024, 8, 64), CacheLevel(2, 1 << 20, 16, 64)]
+    return HardwareDescriptor(vector_bytes, num_fma_units, caches)
+
+
+def analytical_model(
+    hardware: HardwareDescriptor,
+    element_bytes: int) -> Tuple[float, float, float, float, float]:
+  """Return the (mc, nc, kc, mr, nr) GEMM blocking of `hardware` for elements of
+  `element_bytes` bytes, nc being -1 without a third level of cache."""
+  # The register tile holds enough independent FMAs to hide their latency.
+  vector_elements = max(1, hardware.vector_bytes // element_bytes)
+  num_fmas = vector_elements * hardware.num_fma_units * hardware.fma_latency
+  mr = np.ceil(np.sqrt(num_fmas) / vector_elements) * vector_elements
+  nr = np.ceil(num_fmas / mr)
+
+  caches = hardware.caches[:3]
+  ways = [c.ways for c in caches]
+  line_bytes = [c.line_bytes for c in caches]
+  num_sets = [c.size_bytes / (c.ways * c.line_bytes) for c in caches]
+
+  # The kc x nr panel of B and the mr x kc panel of A share the ways of L1.
+  l1_ways_a = np.floor((ways[0] - 1) / (1 + nr / mr))
+  kc = (l1_ways_a * num_sets[0] * line_bytes[0]) / (mr * element_bytes)
+
+  # The mc x kc block of A fills L2 but for the ways of the panel of B.
+  l2_ways_b = np.ceil(nr * kc * element_bytes / (num_sets[1] * line_bytes[1]))
+  mc = ((ways[1] - l2_ways_b - 1) * num_sets[1] *
+        line_bytes[1]) / (kc * element_bytes)
+
+  # The kc x nc panel of B fills L3 but for the ways of the block of A.
+  if len(caches) < 3:
+    return (mc, -1, kc, mr, nr)
+  l3_ways_a = np.ceil(mc * kc * element_bytes / (num_sets[2] * line_bytes[2]))
+  nc = ((ways[2] - l3_ways_a - 1) * num_sets[2] *
+        line_bytes[2]) / (kc * element_bytes)
+  return (mc, nc, kc, mr, nr)
+
+
+def blis_parameters(
+    hardware: HardwareDescriptor,
+    element_bytes: int) -> Tuple[int, Optional[int], int, int, int]:
+  """Return the (mc, nc, kc, mr, nr) blocking of `analytical_model`, nc being
+  None without a third level of cache."""
+  mc, nc, kc, mr, nr = analytical_model(hardware, element_bytes)
+  return (max(1, int(mc)), int(nc) if nc > 0 else None, max(1, int(kc)),
+          max(1, int(mr)), max(1, int(nr)))
+
+
+def _largest_divisor_at_most(size: int, bound: int) -> int:
+  """Return the largest divisor of `size` smaller than or equal to `bound`."""
+  for divisor in range(max(1, min(size, bound)), 0, -1):
+    if size % divisor == 0:
+      return divisor
+  return 1
+
+
+def register_tile_seeds(problem_sizes: Sequence[int],
+                        hardware: Optional[HardwareDescriptor] = None,
+                        element_bytes: int = 4) -> List[List[int]]:
+  """Return single-level (m, n, k) tile sizes of a matmul derived from the
+  register tile of the analytical model, snapped to divisors of the problem
+  sizes: the (mr, nr) micro-kernel with rank-1 and vector-wide k steps."""
+  hardware = hardware or HardwareDescriptor.from_host()
+  _, _, _, mr, nr = blis_parameters(hardware, element_bytes)
+  vector_elements = max(1, hardware.vector_bytes // element_bytes)
+  m, n, k = problem_sizes
+  seeds = []
+  for kr in [1, vector_elements]:
+    seed = [
+        _largest_divisor_at_most(m, mr),
+        _largest_divisor_at_most(n, nr),
+        _largest_divisor_at_most(k, kr)
+    ]
+    if seed not in seeds:
+      seeds.append(seed)
+  return seeds
+
+
+def double_tiling_seeds(problem_sizes: Sequence[int],
+                        hardware: Optional[HardwareDescriptor] = None,
+                        element_bytes: int = 4) -> List[Dict[str, Any]]:
+  """Return tile sizes and interchanges of `DoubleTilingExpert` for an (m, n, k)
+  matmul derived from the analytical model.
+
+  The outer level tiles the problem by (mc, nc, kc) in the BLIS loop order
+  (n, k, m), the inner level by the (mr, nr) micro-kernel with rank-1 updates
+  in the (n, m, k) order. The tile sizes are snapped to divisors of the sizes
+  they tile, so that no padding or peeling is needed. Variants of the base seed
+  swap the micro-kernel dimensions and keep the original loop order.
+  """
+  hardware = hardware or HardwareDescriptor.from_host()
+  mc, nc, kc, mr, nr = blis_parameters(hardware, element_bytes)
+  m, n, k = problem_sizes
+  outer = [
+      _largest_divisor_at_most(m, mc),
+      _largest_divisor_at_most(n, nc or n),
+      _largest_divisor_at_most(k, kc)
+  ]
+  seeds = []
+  for micro_kernel in [(mr, nr), (nr, mr)]:
+    inner = [
+        _largest_divisor_at_most(outer[0], micro_kernel[0]),
+        _largest_divisor_at_most(outer[1], micro_kernel[1]),
+        1,
+    ]
+    for interchange1, interchange2 in [([1, 2, 0], [1, 0, 2]),
+                                       ([0, 1, 2], [0, 1, 2])]:
+      seed = {
+          'tile_sizes1': outer,
+          'tile_interchange1': interchange1,
+          'tile_sizes2': inner,
+          'tile_interchange2': interchange2,
+      }
+      if seed not in seeds:
+        seeds.append(seed)
+  return seeds
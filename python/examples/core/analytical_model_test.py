@@ -0,0 +1,52 @@
+# RUN: %PYTHON %s 2>&1 | FileCheck %s
+
+# This file contains tests of the analytical model seeding the tile sizes.
+
+from ..core.analytical_model import *
+
+# AVX2 core with a 32KB 8-way L1, a 1MB 16-way L2 and a 32MB 16-way L3.
+hardware = HardwareDescriptor(vector_bytes=32,
+                              num_fma_units=2,
+                              caches=[
+                                  CacheLevel(1, 32 * 1024, 8, 64),
+                                  CacheLevel(2, 1024 * 1024, 16, 64),
+                                  CacheLevel(3, 32 * 1024 * 1024, 16, 64)
+                              ])
+
+
+def test_blis_parameters():
+  mc, nc, kc, mr, nr = blis_parameters(hardware, element_bytes=4)
+  print(f'mc={mc} nc={nc} kc={kc} mr={mr} nr={nr}')
+  if (mr, nr) != (8, 8):
+    print('Expected an 8x8 register tile -> FAILURE')
+  # A kc x nr panel of B and the mr x kc panel of A must fit in L1.
+  if (mr + nr) * kc * 4 > 32 * 1024:
+    print('Panels do not fit in L1 -> FAILURE')
+  if nc is None:
+    print('Expected nc with a third level of cache -> FAILURE')
+
+
+def test_seeds_divide(problem_sizes):
+  for seed in register_tile_seeds(problem_sizes, hardware):
+    if any(s % t != 0 for s, t in zip(problem_sizes, seed)):
+      print(f'Register tile {seed} does not divide {problem_sizes} -> FAILURE')
+  for seed in double_tiling_seeds(problem_sizes, hardware):
+    outer, inner = seed['tile_sizes1'], seed['tile_sizes2']
+    if any(s % t != 0 for s, t in zip(problem_sizes, outer)) or \
+        any(s % t != 0 for s, t in zip(outer, inner)):
+      print(f'Tiles {outer} and {inner} do not divide {problem_sizes} '
+            f'-> FAILURE')
+    if sorted(seed['tile_interchange1']) != [0, 1, 2]:
+      print(f'Invalid interchange {seed["tile_interchange1"]} -> FAILURE')
+
+
+# CHECK-NOT: FAILURE
+def main():
+  test_blis_parameters()
+  test_seeds_divide([1000, 1000, 1000])
+  test_seeds_divide([18, 32, 96])
+  test_seeds_divide([7, 13, 2048])
+
+
+if __name__ == '__main__':
+  main()
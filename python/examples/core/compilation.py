@@ -18,6 +18,8 @@ from mlir.execution_engine import *
 from mlir.runtime import *
 
 from .transforms import *
+from .transform import timed_compile_step
+from .compilation_cache import CompilationCache, get_pipeline_fingerprint
 
 f16 = "f16"
 f32 = "f32"
@@ -150,10 +152,14 @@ def emit_benchmarking_function(name: str,
 
 # JIT compile and return an execution engine that can be invoked.
 # Needs to be run under Context.
+# If `entry_point_name` is provided and the transform pipelines can be
+# described, the result is looked up in and stored to the persistent
+# compilation cache.
 def compile_to_execution_engine(module,
                                 transform: Callable,
-                                opt_level: int = 3):
-  transformed_module = transform(module)
+                                opt_level: int = 3,
+                                entry_point_name: Optional[str] = None,
+                                pipeline_fingerprint: Optional[str] = None):
   shared_libs = [
       os.getenv(_MLIR_RUNNER_UTILS_LIB_ENV, _MLIR_RUNNER_UTILS_LIB_DEFAULT),
       os.getenv(_MLIR_C_RUNNER_UTILS_LIB_ENV, _MLIR_C_RUNNER_UTILS_LIB_DEFAULT)
@@ -161,7 +167,26 @@ def compile_to_execution_engine(module,
   extra_libs = os.getenv(_MLIR_RUNNER_EXTRA_LIBS_ENV)
   if extra_libs is not None:
     shared_libs.append(*(str(extra_libs).split(',')))
-  execution_engine = ExecutionEngine(transformed_module,
-                                     opt_level,
-                                     shared_libs=shared_libs)
+
+  cache = CompilationCache.from_env() if entry_point_name else None
+  if pipeline_fingerprint is None:
+    pipeline_fingerprint = get_pipeline_fingerprint(transform)
+  key = None
+  if cache is not None and pipeline_fingerprint is not None:
+    key = cache.key(str(module), pipeline_fingerprint, opt_level, shared_libs)
+    with timed_compile_step('compilation_cache_load'):
+      cached = cache.load(key, shared_libs)
+    if cached is not None:
+      transformed_ir, execution_engine = cached
+      return Module.parse(transformed_ir), execution_engine
+
+  transformed_module = transform(module)
+  with timed_compile_step('execution_engine'):
+    execution_engine = ExecutionEngine(transformed_module,
+                                       opt_level,
+                                       shared_libs=shared_libs)
+  if key is not None:
+    with timed_compile_step('compilation_cache_store'):
+      cache.store(key, str(transformed_module), execution_engine,
+                  entry_point_name)
   return transformed_module, execution_engine
@@ -0,0 +1,303 @@
+"""Persistent on-disk cache of JIT-compiled kernels.
+
+Compiling a module runs the whole transformation pipeline and the LLVM JIT,
+which dominates the cost of large benchmark sweeps that repeatedly compile the
+same IR with the same pipelines. This module implements a content-addressed
+cache of the object code produced by the ExecutionEngine. Each entry is keyed
+by a hash of the pre-transform IR, the transformation pipelines, the
+optimization level, the shared libraries, the libraries implementing the
+sandbox passes, the host CPU and the LLVM version. On a hit, the object code is
+loaded as a shared library instead of compiling. Transforms with Python-side
+effects, e.g., printing the IR, are never cached.
+
+The cache is disabled by default, so that test runs do not depend on the state
+of the cache directory, and can be configured with the following environment
+variables:
+  * SANDBOX_COMPILATION_CACHE: enable the cache if set to a non-empty value
+    other than '0'.
+  * SANDBOX_COMPILATION_CACHE_DIR: cache directory (default:
+    ~/.cache/iree-llvm-sandbox/compilation).
+  * SANDBOX_COMPILATION_CACHE_MAX_BYTES: cache size bound, the least recently
+    used entries are evicted above it (default: 1GB).
+"""
+
+import ctypes
+import functools
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from typing import Any, List, Optional, Sequence, Tuple
+
+_COMPILATION_CACHE_ENV = "SANDBOX_COMPILATION_CACHE"
+_COMPILATION_CACHE_DIR_ENV = "SANDBOX_COMPILATION_CACHE_DIR"
+_COMPILATION_CACHE_DIR_DEFAULT = os.path.join("~", ".cache",
+                                              "iree-llvm-sandbox",
+                                              "compilation")
+_COMPILATION_CACHE_MAX_BYTES_ENV = "SANDBOX_COMPILATION_CACHE_MAX_BYTES"
+_COMPILATION_CACHE_MAX_BYTES_DEFAULT = 1 << 30
+# Number of stores between two evictions, which scan the whole cache.
+_EVICT_EVERY_N_STORES = 16
+
+_PINNED_LLVM_VERSION_FILE = os.path.join(os.path.dirname(__file__), "..", "..",
+                                         "..", "pinned-llvm-version")
+
+_OBJECT_FILE_NAME = "kernel.o"
+_SHARED_OBJECT_FILE_NAME = "kernel.so"
+_TRANSFORMED_IR_FILE_NAME = "module.mlir"
+
+
+def get_llvm_version() -> str:
+  """Return the pinned LLVM commit the sandbox is built against."""
+  try:
+    with open(_PINNED_LLVM_VERSION_FILE, "r") as f:
+      return f.read().strip()
+  except OSError:
+    return "unknown"
+
+
+@functools.lru_cache(maxsize=None)
+def get_sandbox_libraries() -> List[str]:
+  """Return the shared libraries of the directory of the sandbox Python
+  extension, which implement the sandbox passes and dialects."""
+  try:
+    from mlir._mlir_libs import _ireeSandbox
+    directory = os.path.dirname(_ireeSandbox.__file__)
+    return sorted(
+        os.path.join(directory, f) for f in os.listdir(directory) if ".so" in f)
+  except (ImportError, AttributeError, TypeError, OSError):
+    return []
+
+
+def get_pipeline_fingerprint(transform: Any) -> Optional[str]:
+  """Return a textual description of the pipelines applied by `transform`.
+
+  Transformation lists are described by the concatenation of the pipelines of
+  their transforms. Returns None if the transform is an opaque callable whose
+  effect cannot be described or if it has Python-side effects, e.g., printing
+  the IR, that must happen on every compilation. In either case the compilation
+  is not cacheable.
+  """
+  from .transform import Transform
+  if hasattr(transform, "transforms"):
+    fingerprints = [get_pipeline_fingerprint(t) for t in transform.transforms]
+    if any(f is None for f in fingerprints):
+      return None
+    return ";".join(fingerprints)
+  if isinstance(transform, Transform) and transform.has_python_side_effects():
+    return None
+  if hasattr(transform, "pipelines"):
+    return ",".join(transform.pipelines)
+  if hasattr(transform, "pipeline"):
+    return transform.pipeline
+  # Python-side transforms are described by their name and their IR payload.
+  if isinstance(transform, Transform):
+    return (type(transform).__qualname__ + "(" +
+            getattr(transform, "ir_to_inject", "") + ")")
+  return None
+
+
+def has_python_side_effects(transform: Any) -> bool:
+  """Return True if applying `transform`, or any transform of a transformation
+  list, has Python-side effects such as printing the IR."""
+  from .transform import Transform
+  if hasattr(transform, "transforms"):
+    return any(has_python_side_effects(t) for t in transform.transforms)
+  if not isinstance(transform, Transform):
+    return False
+  return transform.has_python_side_effects()
+
+
+class CachedExecutionEngine:
+  """ExecutionEngine replacement backed by a cached shared object.
+
+  Mirrors the subset of the ExecutionEngine API used by the harness.
+  """
+
+  def __init__(self, directory: str, shared_libs: Sequence[str]):
+    # Runtime symbols such as `nano_time` are resolved against the shared libs.
+    self._shared_libs = [
+        ctypes.CDLL(lib, mode=ctypes.RTLD_GLOBAL) for lib in shared_libs
+    ]
+    self._object_path = os.path.join(directory, _OBJECT_FILE_NAME)
+    self._library = ctypes.CDLL(
+        os.path.join(directory, _SHARED_OBJECT_FILE_NAME))
+
+  def raw_lookup(self, name: str) -> Optional[int]:
+    """Lookup the packed wrapper of function `name` and return its address."""
+    try:
+      func = getattr(self._library, "_mlir_" + name)
+    except AttributeError:
+      return None
+    return ctypes.cast(func, ctypes.c_void_p).value
+
+  def lookup(self, name: str):
+    """Lookup a function emitted with the `llvm.emit_c_interface` attribute
+    and return a ctype callable."""
+    func = self.raw_lookup("_mlir_ciface_" + name)
+    if not func:
+      raise RuntimeError("Unknown function " + name)
+    prototype = ctypes.CFUNCTYPE(None, ctypes.c_void_p)
+    return prototype(func)
+
+  def invoke(self, name: str, *ctypes_args):
+    """Invoke function `name` with the given ctypes pointers as arguments."""
+    func = self.lookup(name)
+    packed_args = (ctypes.c_void_p * len(ctypes_args))()
+    for arg_num in range(len(ctypes_args)):
+      packed_args[arg_num] = ctypes.cast(ctypes_args[arg_num], ctypes.c_void_p)
+    func(packed_args)
+
+  def dump_to_object_file(self, file_name: str):
+    """Copy the cached object code to `file_name`."""
+    shutil.copyfile(self._object_path, file_name)
+
+
+class CompilationCache:
+  """Content-addressed cache of compiled kernels with LRU eviction."""
+
+  # Caches shared by the compilations of the process, by configuration.
+  _instances = dict()
+
+  def __init__(self, directory: str, max_bytes: int):
+    self.directory = os.path.expanduser(directory)
+    self.max_bytes = max_bytes
+    self.hits = 0
+    self.misses = 0
+    self.num_stores = 0
+
+  @staticmethod
+  def from_env() -> Optional['CompilationCache']:
+    """Return the cache configured by the environment or None if disabled."""
+    if os.getenv(_COMPILATION_CACHE_ENV, "0") in ("", "0"):
+      return None
+    config = (os.getenv(_COMPILATION_CACHE_DIR_ENV,
+                        _COMPILATION_CACHE_DIR_DEFAULT),
+              int(
+                  os.getenv(_COMPILATION_CACHE_MAX_BYTES_ENV,
+                            _COMPILATION_CACHE_MAX_BYTES_DEFAULT)))
+    if config not in CompilationCache._instances:
+      CompilationCache._instances[config] = CompilationCache(*config)
+    return CompilationCache._instances[config]
+
+  def key(self, module_ir: str, pipeline_fingerprint: str, opt_level: int,
+          shared_libs: Sequence[str]) -> str:
+    """Compute the cache key of a compilation."""
+    from .tuning_database import get_hardware_fingerprint
+    h = hashlib.sha256()
+    # Rebuilding the runtime or sandbox libraries invalidates the cache.
+    for lib in list(shared_libs) + get_sandbox_libraries():
+      mtime = os.path.getmtime(lib) if os.path.exists(lib) else 0
+      h.update(f"{lib}:{mtime}\n".encode())
+    # The object code targets the host CPU.
+    h.update(f"{get_hardware_fingerprint()}\n{opt_level}\n".encode())
+    h.update(pipeline_fingerprint.encode())
+    h.update(b"\n")
+    h.update(module_ir.encode())
+    return h.hexdigest()
+
+  def _entry_directory(self, key: str) -> str:
+    return os.path.join(self.directory, key)
+
+  def load(self, key: str,
+           shared_libs: Sequence[str]) -> Optional[Tuple[str, Any]]:
+    """Return the transformed IR and an execution engine on a hit, None on a
+    miss."""
+    directory = self._entry_directory(key)
+    if not os.path.exists(os.path.join(directory, _SHARED_OBJECT_FILE_NAME)):
+      self.misses += 1
+      return None
+    try:
+      with open(os.path.join(directory, _TRANSFORMED_IR_FILE_NAME), "r") as f:
+        transformed_ir = f.read()
+      execution_engine = CachedExecutionEngine(directory, shared_libs)
+    except OSError as e:
+      print(f"Ignoring corrupted compilation cache entry {directory}: {e}",
+            file=sys.stderr)
+      shutil.rmtree(directory, ignore_errors=True)
+      self.misses += 1
+      return None
+    # Mark the entry as recently used, unless a concurrent process evicted it.
+    try:
+      os.utime(directory)
+    except OSError:
+      pass
+    self.hits += 1
+    return transformed_ir, execution_engine
+
+  def store(self, key: str, transformed_ir: str, execution_engine: Any,
+            entry_point_name: str) -> bool:
+    """Store the object code of `execution_engine` under `key`.
+
+    Returns False if the object code could not be turned into a loadable
+    shared object, e.g., without a C compiler to link it, in which case nothing
+    is cached.
+    """
+    # Force the JIT to materialize the module before dumping the object code.
+    execution_engine.lookup(entry_point_name)
+    staging = None
+    try:
+      os.makedirs(self.directory, exist_ok=True)
+      staging = tempfile.mkdtemp(dir=self.directory, prefix=".staging-")
+      object_path = os.path.join(staging, _OBJECT_FILE_NAME)
+      execution_engine.dump_to_object_file(object_path)
+      compiler = os.getenv("CC", "cc")
+      result = subprocess.run([
+          compiler, "-shared", "-o",
+          os.path.join(staging, _SHARED_OBJECT_FILE_NAME), object_path
+      ],
+                              stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE)
+      if result.returncode != 0:
+        print(
+            f"Compilation cache: cannot link {object_path}: "
+            f"{result.stderr.decode('utf-8')}",
+            file=sys.stderr)
+        return False
+      with open(os.path.join(staging, _TRANSFORMED_IR_FILE_NAME), "w") as f:
+        f.write(transformed_ir)
+      # Publish atomically, a concurrent process may have won the race.
+      try:
+        os.rename(staging, self._entry_directory(key))
+      except OSError:
+        pass
+    except (OSError, RuntimeError, subprocess.SubprocessError) as e:
+      print(f"Compilation cache: cannot store {key}: {e}", file=sys.stderr)
+      return False
+    finally:
+      if staging is not None:
+        shutil.rmtree(staging, ignore_errors=True)
+    self.num_stores += 1
+    if self.num_stores % _EVICT_EVERY_N_STORES == 1:
+      self._evict()
+    return True
+
+  def _evict(self):
+    """Evict the least recently used entries until the cache fits the bound."""
+    entries = []
+    total_bytes = 0
+    try:
+      names = os.listdir(self.directory)
+    except FileNotFoundError:
+      return
+    for name in names:
+      directory = self._entry_directory(name)
+      if name.startswith(".") or not os.path.isdir(directory):
+        continue
+      # Concurrent processes may evict the entry while it is scanned.
+      try:
+        size = sum(
+            os.path.getsize(os.path.join(directory, f))
+            for f in os.listdir(directory))
+        entries.append((os.path.getmtime(directory), size, directory))
+      except FileNotFoundError:
+        continue
+      total_bytes += size
+    for _, size, directory in sorted(entries):
+      if total_bytes <= self.max_bytes:
+        break
+      shutil.rmtree(directory, ignore_errors=True)
+      total_bytes -= size
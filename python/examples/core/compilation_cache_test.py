@@ -0,0 +1,136 @@
+# RUN: %PYTHON %s 2>&1 | FileCheck %s
+
+# This file contains tests of the persistent compilation cache.
+
+import os
+import shutil
+import subprocess
+import tempfile
+
+from ..core.compilation_cache import *
+from ..core.transform import *
+from ..core.transforms import *
+
+
+def check_equal(actual, expected):
+  if actual != expected:
+    print(f'Expected {expected} but got {actual} -> FAILURE')
+
+
+# Execution engine whose object code is compiled from C, see
+# `CompilationCache.store`.
+class CExecutionEngine:
+
+  def __init__(self, source: str):
+    self.source = source
+
+  def lookup(self, name: str):
+    pass
+
+  def dump_to_object_file(self, file_name: str):
+    subprocess.run(['cc', '-c', '-fPIC', '-x', 'c', '-', '-o', file_name],
+                   input=self.source.encode(),
+                   check=True)
+
+
+def test_key(directory: str):
+  cache = CompilationCache(directory, max_bytes=1 << 20)
+  os.makedirs(directory)
+  lib = os.path.join(directory, 'libruntime.so')
+  open(lib, 'w').close()
+  os.utime(lib, (1, 1))
+  key = cache.key('module', 'canonicalize', 3, [lib])
+  check_equal(cache.key('module', 'canonicalize', 3, [lib]), key)
+  # The IR, the pipelines, the optimization level and the libraries are keyed.
+  for other in [
+      cache.key('other module', 'canonicalize', 3, [lib]),
+      cache.key('module', 'cse', 3, [lib]),
+      cache.key('module', 'canonicalize', 2, [lib]),
+      cache.key('module', 'canonicalize', 3, []),
+  ]:
+    if other == key:
+      print(f'Key {key} not invalidated -> FAILURE')
+  os.utime(lib, (2, 2))
+  if cache.key('module', 'canonicalize', 3, [lib]) == key:
+    print('Key not invalidated by rebuilding a library -> FAILURE')
+
+
+def test_hit_and_miss(directory: str):
+  cache = CompilationCache(directory, max_bytes=1 << 20)
+  engine = CExecutionEngine('int _mlir_answer(void) { return 42; }')
+  check_equal(cache.load('a', []), None)
+  check_equal(cache.store('a', 'transformed', engine, 'answer'), True)
+  loaded = cache.load('a', [])
+  if loaded is None:
+    print('Stored entry not loaded -> FAILURE')
+  else:
+    transformed_ir, execution_engine = loaded
+    check_equal(transformed_ir, 'transformed')
+    if execution_engine.raw_lookup('answer') is None:
+      print('Cached function not found -> FAILURE')
+  check_equal((cache.hits, cache.misses), (1, 1))
+
+  # Entries that cannot be linked are not stored.
+  compiler = os.environ.get('CC')
+  os.environ['CC'] = os.path.join(directory, 'missing-cc')
+  check_equal(cache.store('b', 'transformed', engine, 'answer'), False)
+  if compiler is None:
+    del os.environ['CC']
+  else:
+    os.environ['CC'] = compiler
+  check_equal(cache.load('b', []), None)
+
+
+def test_corrupted_entry(directory: str):
+  cache = CompilationCache(directory, max_bytes=1 << 20)
+  engine = CExecutionEngine('int _mlir_answer(void) { return 42; }')
+  cache.store('c', 'transformed', engine, 'answer')
+  with open(os.path.join(directory, 'c', 'kernel.so'), 'w') as f:
+    f.write('corrupted')
+  check_equal(cache.load('c', []), None)
+  check_equal(os.path.exists(os.path.join(directory, 'c')), False)
+
+
+def test_eviction(directory: str):
+  cache = CompilationCache(directory, max_bytes=1 << 20)
+  engine = CExecutionEngine('int _mlir_answer(void) { return 42; }')
+  cache.store('d', 'transformed', engine, 'answer')
+  cache.max_bytes = 0
+  cache._evict()
+  check_equal(cache.load('d', []), None)
+  # The cache directory may be removed by a concurrent process.
+  shutil.rmtree(directory)
+  cache._evict()
+
+
+def test_pipeline_fingerprint():
+  if get_pipeline_fingerprint(Bufferize()) is None:
+    print('Bufferize not cacheable -> FAILURE')
+  # Transforms printing IR or pipelines must run on every compilation.
+  check_equal(get_pipeline_fingerprint(PrintIR()), None)
+  check_equal(get_pipeline_fingerprint(PrintPipeline(Bufferize())), None)
+  check_equal(get_pipeline_fingerprint(LowerVectors(print_after_all=True)),
+              None)
+  check_equal(
+      get_pipeline_fingerprint(
+          TransformationList(transforms=[Bufferize(), PrintIR()])), None)
+  check_equal(
+      has_python_side_effects(
+          TransformationList(transforms=[Bufferize(), PrintIR()])), True)
+  check_equal(
+      has_python_side_effects(TransformationList(transforms=[Bufferize()])),
+      False)
+
+
+# CHECK-NOT: FAILURE
+def main():
+  for test in [
+      test_key, test_hit_and_miss, test_corrupted_entry, test_eviction
+  ]:
+    with tempfile.TemporaryDirectory() as directory:
+      test(os.path.join(directory, 'cache'))
+  test_pipeline_fingerprint()
+
+
+if __name__ == '__main__':
+  main()
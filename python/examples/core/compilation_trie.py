@@ -0,0 +1,113 @@
+"""In-memory trie of module snapshots taken between transforms.
+
+Experts often share a prefix of transforms (e.g., the same tiling and
+vectorization) and only differ in their last transforms (e.g., vector lowering
+options). The trie stores the serialized module after each transform of a
+transformation list, so that a later list with the same prefix resumes from
+the deepest snapshot instead of applying the whole list again.
+
+Each node is keyed by a hash of its parent key and of the pipelines of its
+transform, the root being keyed by the input IR and the entry point name. The
+keys stop at the first transform with Python-side effects, e.g., printing the
+IR, so that such transforms and the following ones always run. The snapshots
+are bounded in size and evicted in least recently used order.
+
+The trie of the harness is disabled by default and enabled by setting
+`SANDBOX_COMPILATION_TRIE_MAX_BYTES` to a positive size.
+"""
+
+import contextlib
+import hashlib
+import os
+
+from collections import OrderedDict
+from typing import Any, List, Optional, Sequence, Tuple
+
+from .compilation_cache import get_pipeline_fingerprint
+
+_COMPILATION_TRIE_MAX_BYTES_ENV = "SANDBOX_COMPILATION_TRIE_MAX_BYTES"
+_COMPILATION_TRIE_MAX_BYTES_DEFAULT = 256 * 1024 * 1024
+
+
+class CompilationTrie:
+  """Snapshots of the IR after each transform, with LRU eviction."""
+
+  def __init__(self, max_bytes: int = _COMPILATION_TRIE_MAX_BYTES_DEFAULT):
+    self.max_bytes = max_bytes
+    self.total_bytes = 0
+    self.snapshots = OrderedDict()
+    self.hits = 0
+    self.misses = 0
+    # Number of transforms skipped thanks to the snapshots.
+    self.skipped_transforms = 0
+
+  @staticmethod
+  def from_env() -> Optional['CompilationTrie']:
+    """Return the trie configured by the environment or None if disabled,
+    which is the default."""
+    max_bytes = int(os.getenv(_COMPILATION_TRIE_MAX_BYTES_ENV, "0") or "0")
+    return CompilationTrie(max_bytes) if max_bytes > 0 else None
+
+  def prefix_keys(self, module_ir: str, entry_point_name: str,
+                  transforms: Sequence[Any]) -> List[str]:
+    """Return the keys of the snapshots after each transform.
+
+    The keys stop at the first transform whose pipelines cannot be described
+    or that has Python-side effects, see `get_pipeline_fingerprint`: the
+    snapshots after it cannot be shared and resuming past it would skip its
+    effects.
+    """
+    h = hashlib.sha256(f"{entry_point_name}\n{module_ir}".encode())
+    keys = []
+    for transform in transforms:
+      fingerprint = get_pipeline_fingerprint(transform)
+      if fingerprint is None:
+        break
+      h = hashlib.sha256(f"{h.hexdigest()}\n{fingerprint}".encode())
+      keys.append(h.hexdigest())
+    return keys
+
+  def longest_prefix(self, keys: Sequence[str]) -> Tuple[int, Optional[str]]:
+    """Return the number of transforms covered by the deepest snapshot among
+    `keys` and its IR, or 0 and None if there is none."""
+    for depth in range(len(keys), 0, -1):
+      snapshot = self.snapshots.get(keys[depth - 1])
+      if snapshot is not None:
+        self.snapshots.move_to_end(keys[depth - 1])
+        self.hits += 1
+        self.skipped_transforms += depth
+        return depth, snapshot
+    self.misses += 1
+    return 0, None
+
+  def insert(self, key: str, module_ir: str):
+    """Insert the snapshot of a node and evict the least recently used ones
+    above the budget."""
+    if key in self.snapshots or len(module_ir) > self.max_bytes:
+      return
+    self.snapshots[key] = module_ir
+    self.total_bytes += len(module_ir)
+    while self.total_bytes > self.max_bytes:
+      _, evicted = self.snapshots.popitem(last=False)
+      self.total_bytes -= len(evicted)
+
+
+# Stack of the tries used by the transformation lists, innermost last.
+_active_tries: List[CompilationTrie] = []
+
+
+@contextlib.contextmanager
+def use_compilation_trie(trie: Optional[CompilationTrie]):
+  """Context manager making the transformation lists applied in its scope
+  resume from and store snapshots into `trie`. A None trie disables
+  snapshots."""
+  _active_tries.append(trie)
+  try:
+    yield trie
+  finally:
+    _active_tries.pop()
+
+
+def active_compilation_trie() -> Optional[CompilationTrie]:
+  """Return the trie of the innermost `use_compilation_trie` scope, if any."""
+  return _active_tries[-1] if _active_tries else None
@@ -0,0 +1,70 @@
+# RUN: %PYTHON %s 2>&1 | FileCheck %s
+
+# This file contains tests of the trie of module snapshots.
+
+import os
+
+from ..core.compilation_trie import *
+from ..core.transform import *
+from ..core.transforms import *
+
+
+def check_equal(actual, expected):
+  if actual != expected:
+    print(f'Expected {expected} but got {actual} -> FAILURE')
+
+
+def test_from_env():
+  max_bytes = os.environ.pop('SANDBOX_COMPILATION_TRIE_MAX_BYTES', None)
+  # The trie is opt-in.
+  check_equal(CompilationTrie.from_env(), None)
+  os.environ['SANDBOX_COMPILATION_TRIE_MAX_BYTES'] = '1024'
+  trie = CompilationTrie.from_env()
+  check_equal(trie.max_bytes if trie is not None else None, 1024)
+  if max_bytes is None:
+    del os.environ['SANDBOX_COMPILATION_TRIE_MAX_BYTES']
+  else:
+    os.environ['SANDBOX_COMPILATION_TRIE_MAX_BYTES'] = max_bytes
+
+
+def test_prefix_keys():
+  trie = CompilationTrie()
+  keys = trie.prefix_keys('module', 'main', [Bufferize(), LowerToLLVM()])
+  check_equal(len(keys), 2)
+  check_equal(trie.prefix_keys('module', 'main', [Bufferize()]), keys[:1])
+  if trie.prefix_keys('other module', 'main', [Bufferize()]) == keys[:1]:
+    print('Key not invalidated by the input IR -> FAILURE')
+  # Keys stop at transforms with Python-side effects, which must always run.
+  for transform in [
+      PrintIR(),
+      PrintPipeline(Bufferize()),
+      LowerVectors(print_after_all=True)
+  ]:
+    transforms = [Bufferize(), transform, LowerToLLVM()]
+    check_equal(trie.prefix_keys('module', 'main', transforms), keys[:1])
+
+
+def test_longest_prefix():
+  trie = CompilationTrie(max_bytes=20)
+  keys = trie.prefix_keys('module', 'main', [Bufferize(), LowerToLLVM()])
+  check_equal(trie.longest_prefix(keys), (0, None))
+  trie.insert(keys[0], 'bufferized')
+  check_equal(trie.longest_prefix(keys), (1, 'bufferized'))
+  trie.insert(keys[1], 'lowered')
+  check_equal(trie.longest_prefix(keys), (2, 'lowered'))
+  check_equal((trie.hits, trie.misses, trie.skipped_transforms), (2, 1, 3))
+  # The least recently used snapshot is evicted above the budget.
+  trie.insert('other', 'snapshot')
+  check_equal(trie.longest_prefix(keys[:1]), (0, None))
+  check_equal(trie.longest_prefix(keys), (2, 'lowered'))
+
+
+# CHECK-NOT: FAILURE
+def main():
+  test_from_env()
+  test_prefix_keys()
+  test_longest_prefix()
+
+
+if __name__ == '__main__':
+  main()
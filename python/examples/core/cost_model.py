@@ -0,0 +1,253 @@
+"""Cost models predicting the throughput of tuning candidates.
+
+Compiling and running a tuning candidate takes seconds. A cost model learns the
+throughput of the already measured candidates from cheap features of their
+configuration, so that the tuner can rank a batch of proposals and only compile
+the most promising ones.
+
+Models implement the `CostModel` interface. `RidgeCostModel` is a ridge
+regression of the logarithm of the throughput over standardized features,
+implemented in NumPy. `ProposalRanker` asks proposals to a tuning optimizer and
+only returns the best predicted of every batch.
+"""
+
+import math
+
+from typing import Optional, Sequence
+
+import numpy as np
+
+from .tuning_database import TuningDatabase
+
+# Register width assumed by the vector alignment feature.
+_VECTOR_BYTES = 32
+
+
+def matmul_features(problem_sizes: Sequence[int],
+                    tile_sizes: Sequence[int],
+                    element_bytes: int = 4) -> np.ndarray:
+  """Return the features of tiling a matmul of `problem_sizes` (m, n, k) by
+  `tile_sizes`, a tile size of 0 meaning that the loop is not tiled.
+
+  The features are the logarithms of the problem and tile sizes, the fractions
+  of the loops covered by the tiles, the unroll volume of the tile, its register
+  footprint and arithmetic intensity, the number of tiled loops and whether the
+  innermost tile fills whole vectors.
+  """
+  m, n, k = problem_sizes
+  tm, tn, tk = [t if t != 0 else s for s, t in zip(problem_sizes, tile_sizes)]
+  volume = tm * tn * tk
+  footprint_bytes = (tm * tk + tk * tn + tm * tn) * element_bytes
+  intensity = 2 * volume / footprint_bytes
+  return np.array([
+      math.log2(m),
+      math.log2(n),
+      math.log2(k),
+      math.log2(tm),
+      math.log2(tn),
+      math.log2(tk),
+      tm / m,
+      tn / n,
+      tk / k,
+      math.log2(volume),
+      math.log2(volume)**2,
+      math.log2(footprint_bytes),
+      math.log2(footprint_bytes)**2,
+      intensity,
+      np.count_nonzero(tile_sizes),
+      float((tn * element_bytes) % _VECTOR_BYTES == 0),
+  ])
+
+
+def spearman_correlation(x: Sequence[float], y: Sequence[float]) -> float:
+  """Return the Spearman rank correlation of `x` and `y`, ties getting their
+  average rank, or NaN if either is constant."""
+
+  def ranks(values: np.ndarray) -> np.ndarray:
+    order = np.argsort(values, kind='stable')
+    result = np.empty(len(values))
+    result[order] = np.arange(len(values))
+    # Average the ranks of ties.
+    for value in np.unique(values):
+      tied = values == value
+      result[tied] = result[tied].mean()
+    return result
+
+  x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+  if len(x) < 2:
+    return math.nan
+  rx, ry = ranks(x), ranks(y)
+  if rx.std() == 0 or ry.std() == 0:
+    return math.nan
+  return float(np.corrcoef(rx, ry)[0, 1])
+
+
+class CostModel:
+  """Interface of the models predicting throughputs from feature vectors."""
+
+  def fit(self, features: np.ndarray, throughputs: np.ndarray):
+    """Train on a 2-D array of features, one row per measured candidate."""
+    raise NotImplementedError()
+
+  def predict(self, features: np.ndarray) -> np.ndarray:
+    """Return the predicted throughput of each row of `features`."""
+    raise NotImplementedError()
+
+  def is_trained(self) -> bool:
+    raise NotImplementedError()
+
+
+class RidgeCostModel(CostModel):
+  """Ridge regression of the log throughput, trained once `min_samples`
+  candidates were measured."""
+
+  def __init__(self, l2: float = 1.0, min_samples: int = 8):
+    self.l2 = l2
+    self.min_samples = min_samples
+    self.weights = None
+    self.mean = None
+    self.scale = None
+
+  def fit(self, features: np.ndarray, throughputs: np.ndarray):
+    features = np.asarray(features, dtype=np.float64)
+    throughputs = np.asarray(throughputs, dtype=np.float64)
+    valid = throughputs > 0
+    features, throughputs = features[valid], throughputs[valid]
+    if len(throughputs) < self.min_samples:
+      return
+    self.mean = features.mean(axis=0)
+    std = features.std(axis=0)
+    self.scale = np.where(std > 0, std, 1.0)
+    x = self._design_matrix(features)
+    # The intercept is not regularized.
+    regularization = self.l2 * np.eye(x.shape[1])
+    regularization[0, 0] = 0
+    self.weights = np.linalg.solve(x.T @ x + regularization,
+                                   x.T @ np.log(throughputs))
+
+  def predict(self, features: np.ndarray) -> np.ndarray:
+    assert self.is_trained(), 'Cost model is not trained'
+    return np.exp(
+        self._design_matrix(np.asarray(features, dtype=np.float64))
+        @ self.weights)
+
+  def is_trained(self) -> bool:
+    return self.weights is not None
+
+  def _design_matrix(self, features: np.ndarray) -> np.ndarray:
+    features = np.atleast_2d(features)
+    return np.hstack(
+        [np.ones([features.shape[0], 1]), (features - self.mean) / self.scale])
+
+
+def cost_model_from_name(name: str) -> Optional[CostModel]:
+  """Return the cost model called `name`, None for 'none'."""
+  if name == 'none':
+    return None
+  if name == 'ridge':
+    return RidgeCostModel()
+  raise ValueError(f'Unknown cost model {name}')
+
+
+class ProposalRanker:
+  """Asks proposals to the optimizer of a tuning scheduler, ranked by a cost
+  model trained on the measured proposals and on the measurements of the tuning
+  database, and tracks the rank correlation of the predictions with the
+  measurements.
+
+  The scheduler provides the nevergrad `optimizer`, the `problem_name`,
+  `types_name` and `problem_sizes`, the `num_pending_suggestions` and the
+  `validate_proposal` and `extract_search_sizes_from_proposal` methods of the
+  matmul tuner. Suggested configurations are returned first, without ranking.
+  Without trained cost model, proposals are asked one at a time. Once trained,
+  every returned proposal is the best predicted of `num_candidates` asked
+  proposals and the others are dropped, so the optimizer budget must allow
+  `num_candidates` asks per compilation.
+  """
+
+  def __init__(self, scheduler, cost_model: Optional[CostModel],
+               database: Optional[TuningDatabase]):
+    self.scheduler = scheduler
+    self.cost_model = cost_model
+    # Training set of the cost model.
+    self.features = []
+    self.throughputs = []
+    # Predicted throughputs of the ranked proposals, by proposal uid, and the
+    # pairs of predicted and measured throughputs.
+    self.predictions = dict()
+    self.predicted = []
+    self.measured = []
+    self.num_dropped = 0
+    if cost_model is not None and database is not None:
+      for sizes, configuration, throughput in database.measurements(
+          scheduler.problem_name, scheduler.types_name):
+        self.features.append(matmul_features(sizes, configuration))
+        self.throughputs.append(throughput)
+      self.cost_model.fit(np.array(self.features), np.array(self.throughputs))
+
+  def is_trained(self) -> bool:
+    return self.cost_model is not None and self.cost_model.is_trained()
+
+  def is_exhausted(self) -> bool:
+    """Return True if the optimizer budget is spent."""
+    optimizer = self.scheduler.optimizer
+    return optimizer.budget is not None and \
+        optimizer.num_ask >= optimizer.budget
+
+  def _ask_valid(self):
+    """Ask a valid proposal to the optimizer, or return None if the proposal is
+    invalid or the budget is spent. The optimizer may chose to ignore our
+    constraints: invalid proposals are given max cost."""
+    if self.is_exhausted():
+      return None
+    optimizer = self.scheduler.optimizer
+    proposal = optimizer.ask()
+    if not self.scheduler.validate_proposal(proposal):
+      optimizer.tell(proposal, 1e9)
+      return None
+    return proposal
+
+  def _features(self, proposal) -> np.ndarray:
+    return matmul_features(
+        self.scheduler.problem_sizes,
+        self.scheduler.extract_search_sizes_from_proposal(proposal))
+
+  def ask(self, num_candidates: int):
+    """Return the valid proposal with the best predicted throughput among up to
+    `num_candidates` newly asked ones, or None if there is none."""
+    if self.scheduler.num_pending_suggestions > 0:
+      self.scheduler.num_pending_suggestions -= 1
+      return self._ask_valid()
+    if not self.is_trained():
+      return self._ask_valid()
+    candidates = [self._ask_valid() for _ in range(num_candidates)]
+    candidates = [proposal for proposal in candidates if proposal is not None]
+    if not candidates:
+      return None
+    predictions = self.cost_model.predict(
+        np.array([self._features(proposal) for proposal in candidates]))
+    best = int(np.argmax(predictions))
+    self.predictions[candidates[best].uid] = predictions[best]
+    self.num_dropped += len(candidates) - 1
+    return candidates[best]
+
+  def add_measurement(self, proposal, throughput: float):
+    """Add the measured `throughput` of `proposal` to the training set."""
+    if self.cost_model is None:
+      return
+    self.features.append(self._features(proposal))
+    self.throughputs.append(throughput)
+    predicted = self.predictions.pop(proposal.uid, None)
+    if predicted is not None:
+      self.predicted.append(predicted)
+      self.measured.append(throughput)
+    self.cost_model.fit(np.array(self.features), np.array(self.throughputs))
+
+  def report(self):
+    if self.cost_model is None:
+      return
+    print(f'Cost model: Spearman rank correlation '
+          f'{spearman_correlation(self.predicted, self.measured):.2f} between '
+          f'predicted and measured throughputs of {len(self.measured)} '
+          f'ranked proposals, {self.num_dropped} proposals dropped without '
+          f'compilation')
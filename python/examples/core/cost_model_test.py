@@ -0,0 +1,102 @@
+# RUN: %PYTHON %s 2>&1 | FileCheck %s
+
+# This file contains tests of the cost models ranking tuning candidates.
+
+import nevergrad as ng
+import numpy as np
+
+from ..core.cost_model import *
+
+
+def check_equal(actual, expected):
+  if actual != expected:
+    print(f'Expected {expected} but got {actual} -> FAILURE')
+
+
+def test_spearman_correlation():
+  rho = spearman_correlation([1, 2, 3, 4], [10, 20, 30, 40])
+  if abs(rho - 1) > 1e-9:
+    print(f'Expected a correlation of 1 but got {rho} -> FAILURE')
+  rho = spearman_correlation([1, 2, 3, 4], [4, 3, 2, 1])
+  if abs(rho + 1) > 1e-9:
+    print(f'Expected a correlation of -1 but got {rho} -> FAILURE')
+
+
+def test_ridge_ranking(problem_sizes):
+  # Synthetic throughputs growing with the register tile up to 64 elements.
+  rng = np.random.default_rng(0)
+  features, throughputs = [], []
+  for _ in range(64):
+    tile_sizes = [int(rng.choice([0, 1, 2, 4, 8, 16])) for _ in range(3)]
+    tm, tn, _ = [t or s for s, t in zip(problem_sizes, tile_sizes)]
+    features.append(matmul_features(problem_sizes, tile_sizes))
+    throughputs.append(1 + min(tm * tn, 64) * rng.uniform(0.9, 1.1))
+  features, throughputs = np.array(features), np.array(throughputs)
+
+  model = RidgeCostModel()
+  model.fit(features[:4], throughputs[:4])
+  if model.is_trained():
+    print(f'Trained on fewer than {model.min_samples} samples -> FAILURE')
+  model.fit(features[:48], throughputs[:48])
+  rho = spearman_correlation(model.predict(features[48:]), throughputs[48:])
+  print(f'Spearman rank correlation on held-out samples: {rho:.2f}')
+  if not rho > 0.5:
+    print('Poor ranking of held-out samples -> FAILURE')
+
+
+# Scheduler searching the register tile sizes of a matmul, see the
+# `NGScheduler` of the matmul tuner.
+class TileScheduler:
+
+  def __init__(self, problem_sizes, budget: int):
+    self.problem_sizes = problem_sizes
+    self.problem_name = 'matmul'
+    self.types_name = 'f32'
+    tile_sizes = [(tm, tn, 0) for tm in [1, 2, 4, 8, 16] for tn in [1, 2, 4]]
+    self.optimizer = ng.optimizers.registry['LHSSearch'](
+        parametrization=ng.p.Instrumentation(
+            tile_sizes=ng.p.Choice(tile_sizes)),
+        budget=budget)
+    self.num_pending_suggestions = 0
+
+  def extract_search_sizes_from_proposal(self, proposal):
+    return list(proposal.kwargs['tile_sizes'])
+
+  def validate_proposal(self, proposal):
+    return True
+
+
+def test_proposal_ranker(problem_sizes):
+  num_compilations, num_candidates = 32, 4
+  scheduler = TileScheduler(problem_sizes, num_compilations * num_candidates)
+  scheduler.optimizer.suggest(tile_sizes=(4, 4, 0))
+  scheduler.num_pending_suggestions = 1
+  ranker = ProposalRanker(scheduler, RidgeCostModel(), None)
+  # Suggestions are returned first, without ranking.
+  proposal = ranker.ask(num_candidates)
+  check_equal(scheduler.extract_search_sizes_from_proposal(proposal), [4, 4, 0])
+  compiled = [proposal]
+  while len(compiled) < num_compilations and not ranker.is_exhausted():
+    proposal = ranker.ask(num_candidates)
+    compiled.append(proposal)
+    tm, tn, _ = scheduler.extract_search_sizes_from_proposal(proposal)
+    ranker.add_measurement(proposal, 1 + min(tm * tn, 64))
+  num_asked = scheduler.optimizer.num_ask
+  # Once trained, only the best predicted of every batch of proposals compiles.
+  if not len(compiled) < num_asked:
+    print(f'Compiled {len(compiled)} of {num_asked} proposals -> FAILURE')
+  check_equal(ranker.num_dropped, num_asked - len(compiled))
+  check_equal(len(compiled), num_compilations)
+  if num_asked > num_compilations * num_candidates:
+    print(f'Asked {num_asked} proposals beyond the budget -> FAILURE')
+
+
+# CHECK-NOT: FAILURE
+def main():
+  test_spearman_correlation()
+  test_ridge_ranking([64, 64, 64])
+  test_proposal_ranker([64, 64, 64])
+
+
+if __name__ == '__main__':
+  main()
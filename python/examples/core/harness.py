@@ -1,13 +1,15 @@
 # Make dict a generic (type-subscriptable) type for Python <3.9.
 from __future__ import annotations
 import argparse
+import fcntl
+import multiprocessing as mp
 import re
 import sys
 import os
 import time
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 
-from typing import AbstractSet, Any, Callable, List, Mapping, Optional, Sequence, Union
+from typing import AbstractSet, Any, Callable, List, Mapping, Optional, Sequence, Tuple, Union
 
 import numpy
 import pandas
@@ -19,8 +21,15 @@ from mlir.iree_sandbox import register_sandbox_passes_and_dialects
 
 from ..core.compilation import compile_to_execution_engine, \
     emit_benchmarking_function
+from ..core.compilation_cache import CompilationCache, \
+    get_pipeline_fingerprint, has_python_side_effects
+from ..core.compilation_trie import CompilationTrie, use_compilation_trie
 from ..core.experts import TransformationList
+from ..core.transform import profile_compile_time
+from ..core.perf_counters import EVENTS, PerfCounters, column_name, \
+    perf_counters_from_env
 from ..core.problem_definition import *
+from ..core.result_memo import ResultMemo, canonical_module_hash
 from ..core.transforms import ApplySchedule
 from ..core.utils import *
 
@@ -47,7 +56,12 @@ ProblemSizes = Sequence[Union[int, Sequence[int]]]
 
 
 class Measurements:
-  """Class storing measurement configuration and results in data frame."""
+  """Class storing measurement configuration and results.
+
+  Results are accumulated in preallocated NumPy arrays, one per data key, and
+  every row refers to an interned configuration tuple. Appending costs constant
+  time per row, the data frame is only materialized on demand.
+  """
   config_keys = [ \
     "function_name",
     "expert",
@@ -56,84 +70,189 @@ class Measurements:
     "runtime_problem_sizes_dict",
     "total_gflops",
     "total_gbytes",
+    "compile_time_s",
+    "n_iters",
+    "ci_relative_width",
+    "cache_mode",
+    "duplicate_of",
                 ]
+  # Hardware event counts per iteration, NaN unless counters are enabled.
+  counter_keys = [column_name(event_name) for event_name in EVENTS]
+  config_keys += counter_keys
   data_keys = [ \
       "elapsed_s_per_iter",
       "gbyte_per_s_per_iter",
       "gflop_per_s_per_iter",
               ]
 
-  def __init__(self):
-    self.data = pandas.DataFrame(
-        dict([(col, []) for col in self.config_keys + self.data_keys]))
+  # Columns dumped along with the function name by the raw dump methods.
+  raw_value_column_names = [
+      'runtime_problem_sizes_dict',
+      'total_gbytes',
+      'total_gflops',
+      'compile_time_s',
+      'n_iters',
+      'ci_relative_width',
+      'cache_mode',
+      *counter_keys,
+      'elapsed_s_per_iter',
+      'gbyte_per_s_per_iter',
+      'gflop_per_s_per_iter',
+  ]
+
+  _initial_capacity = 1024
 
-  def append(self, function_name: str, expert_name: str,
+  def __init__(self):
+    # Interned configuration tuples and their index.
+    self.configs = []
+    self.config_indices = dict()
+    # Columnar storage, only the first `num_rows` entries are valid.
+    self.num_rows = 0
+    self.row_config_indices = np.empty([self._initial_capacity], dtype=np.int64)
+    self.columns = {
+        k: np.empty([self._initial_capacity], dtype=np.float64)
+        for k in self.data_keys
+    }
+
+  def _reserve(self, num_rows: int):
+    """Grow the storage geometrically to hold at least `num_rows` rows."""
+    capacity = len(self.row_config_indices)
+    if num_rows <= capacity:
+      return
+    while capacity < num_rows:
+      capacity *= 2
+    self.row_config_indices = np.resize(self.row_config_indices, [capacity])
+    for k in self.data_keys:
+      self.columns[k] = np.resize(self.columns[k], [capacity])
+
+  def append(self,
+             function_name: str,
+             expert_name: str,
              np_types: Sequence[np.dtype],
              dynamic_at_compile_time_sizes: AbstractSet[str],
              runtime_problem_sizes_dict: Mapping[str, ProblemSizes],
-             gflops: int, gbytes: int, timing_results_dict: TimingResults):
-    """Append measurement results."""
-    config = pandas.DataFrame(
-        dict(
-            zip(self.config_keys,
-                [[function_name], [expert_name],
-                 [self._stringify_types(np_types)],
-                 [self._stringify_set(dynamic_at_compile_time_sizes)],
-                 [self._stringify_dict(runtime_problem_sizes_dict)], [gflops],
-                 [gbytes]])))
-    results = pandas.DataFrame(
-        dict([(k, timing_results_dict[k]) for k in self.data_keys]))
-    # Cross-product: add an identical fake key to both data frames,
-    # merge on that key, and delete it.
-    config['_fake_key'] = 1
-    results['_fake_key'] = 1
-    product = config.merge(results, on='_fake_key') \
-      .drop(labels='_fake_key', axis=1)
-    self.data = self.data.append(product)
+             gflops: int,
+             gbytes: int,
+             timing_results_dict: TimingResults,
+             compile_time_s: float = 0.0,
+             cache_mode: str = 'hot',
+             compile_profile: Mapping[str, float] = {},
+             duplicate_of: str = ''):
+    """Append measurement results.
+
+    `compile_profile` maps `compile_s_*` column names to the time spent in the
+    corresponding compilation steps, see `CompileTimeProfile.columns`.
+    `duplicate_of` names the expert whose measurements are reused because both
+    lower to the same code, it is empty for measured experts.
+    """
+    num_new_rows = len(timing_results_dict[self.data_keys[0]])
+    # Timing results of adaptive runs carry the achieved confidence interval.
+    ci_relative_width = timing_results_dict.get('ci_relative_width', np.nan)
+    config = (function_name, expert_name, self._stringify_types(np_types),
+              self._stringify_set(dynamic_at_compile_time_sizes),
+              self._stringify_dict(runtime_problem_sizes_dict), gflops, gbytes,
+              compile_time_s, num_new_rows, ci_relative_width, cache_mode,
+              duplicate_of,
+              *(timing_results_dict.get(k, np.nan) for k in self.counter_keys),
+              tuple(compile_profile.items()))
+    config_index = self.config_indices.get(config)
+    if config_index is None:
+      config_index = len(self.configs)
+      self.config_indices[config] = config_index
+      self.configs.append(config)
+
+    begin, end = self.num_rows, self.num_rows + num_new_rows
+    self._reserve(end)
+    self.row_config_indices[begin:end] = config_index
+    for k in self.data_keys:
+      self.columns[k][begin:end] = timing_results_dict[k]
+    self.num_rows = end
+
+  @property
+  def data(self) -> pandas.DataFrame:
+    return self.to_data_frame()
 
   def to_dict(self) -> dict[str, Any]:
     """Return a dictionary containing the aggregated data."""
-    return self.data.to_dict()
+    return self.to_data_frame().to_dict()
 
   def to_data_frame(self) -> pandas.DataFrame:
     """Return a data frame containing the aggregated data."""
-    return self.data
+    row_config_indices = self.row_config_indices[:self.num_rows]
+    columns = dict()
+    for i, k in enumerate(self.config_keys):
+      values = np.empty([len(self.configs)], dtype=object)
+      values[:] = [config[i] for config in self.configs]
+      columns[k] = values[row_config_indices]
+    # Compilation profiles have one column per step, absent steps are NaN.
+    profile_columns = OrderedDict()
+    for config_index, config in enumerate(self.configs):
+      for k, seconds in config[len(self.config_keys)]:
+        if k not in profile_columns:
+          profile_columns[k] = np.full([len(self.configs)], np.nan)
+        profile_columns[k][config_index] = seconds
+    for k, values in profile_columns.items():
+      columns[k] = values[row_config_indices]
+    for k in self.data_keys:
+      columns[k] = self.columns[k][:self.num_rows]
+    data = pandas.DataFrame(columns)
+    return data.infer_objects()
 
   def dump_to_file(self, file_name: str):
     """Dump the measurements to a json file."""
+    data = self.to_data_frame()
     # Load existing data.
     if os.path.exists(file_name):
       existing_data = pandas.read_json(file_name)
-      self.data = existing_data.append(self.data)
+      data = pandas.concat([existing_data, data])
     # Create the path if needed.
     directory = os.path.dirname(file_name)
     if not os.path.exists(directory):
       os.makedirs(directory)
-    self.data.reset_index(drop=True, inplace=True)
-    self.data.to_json(file_name)
+    data.reset_index(drop=True, inplace=True)
+    data.to_json(file_name)
 
   def dump_raw_to_file(self, file_name: str):
     """Dump the measurements to a raw file by appending."""
     all_data = None
-    value_column_names = [
-        'runtime_problem_sizes_dict',
-        'total_gbytes',
-        'total_gflops',
-        'elapsed_s_per_iter',
-        'gbyte_per_s_per_iter',
-        'gflop_per_s_per_iter',
-    ]
+    value_column_names = Measurements.raw_value_column_names
     # Filter the slowest to isolate the compulsory miss effects.
     # Drop the first index matching every key_value (i.e. the first measurement)
-    self.data = self.data.iloc[1:, :]
+    data = self.to_data_frame().iloc[1:, :]
     if os.path.exists(file_name):
       all_data = pandas.read_json(file_name)
       all_data = pandas.concat(
-          [all_data, self.data[['function_name', *value_column_names]]])
+          [all_data, data[['function_name', *value_column_names]]])
     else:
-      all_data = self.data[['function_name', *value_column_names]]
+      all_data = data[['function_name', *value_column_names]]
     all_data.to_json(file_name, orient='records')
 
+  def dump_jsonl_to_file(self, file_name: str):
+    """Append the measurements to a JSON Lines file, one record per row.
+
+    Unlike `dump_raw_to_file`, the existing file is never read: concurrent
+    harness processes append their records under an exclusive file lock.
+    """
+    # Filter the slowest to isolate the compulsory miss effects.
+    # Drop the first index matching every key_value (i.e. the first measurement)
+    data = self.to_data_frame().iloc[1:, :]
+    # Keep the function name and the problem sizes as leading columns.
+    column_names = ['function_name', *Measurements.raw_value_column_names]
+    column_names += [k for k in data.keys() if k not in column_names]
+    records = data[column_names].to_json(orient='records', lines=True)
+    if not records.endswith('\n'):
+      records += '\n'
+    directory = os.path.dirname(file_name)
+    if directory and not os.path.exists(directory):
+      os.makedirs(directory, exist_ok=True)
+    with open(file_name, 'a') as f:
+      fcntl.flock(f, fcntl.LOCK_EX)
+      try:
+        f.write(records)
+        f.flush()
+      finally:
+        fcntl.flock(f, fcntl.LOCK_UN)
+
   def _stringify_types(self, value: Sequence[np.dtype]) -> str:
     return ",".join(
         [repr(dt).lstrip("<class 'numpy.").rstrip("'>") for dt in value])
@@ -145,9 +264,93 @@ class Measurements:
     return ",".join([str.format(f"{k}={v}") for k, v in value.items()])
 
 
-def timed_invoke(run_for_n_iters: Callable, gflop_count: float,
-                 gbyte_count: float, n_iters: int) -> TimingResults:
-  elapsed_ns = run_for_n_iters(n_iters)
+class AdaptiveIterations:
+  """Configuration of the adaptive iteration count of `timed_invoke`.
+
+  Iterations run in batches of geometrically increasing size until the
+  bootstrap confidence interval of the `quantile` of the elapsed times is
+  narrower than `relative_tolerance` times the quantile, or until
+  `time_budget_s` or `max_iters` is exhausted.
+  """
+
+  def __init__(self,
+               relative_tolerance: float = 0.01,
+               quantile: float = 0.5,
+               confidence: float = 0.95,
+               time_budget_s: float = 10.0,
+               min_iters: int = 10,
+               max_iters: int = 100000):
+    self.relative_tolerance = relative_tolerance
+    self.quantile = quantile
+    self.confidence = confidence
+    self.time_budget_s = time_budget_s
+    self.min_iters = min_iters
+    self.max_iters = max_iters
+
+  @staticmethod
+  def from_env() -> Optional[AdaptiveIterations]:
+    """Return the configuration set by the environment or None if the iteration
+    count is fixed."""
+    if 'SANDBOX_ADAPTIVE_RELATIVE_TOLERANCE' not in os.environ:
+      return None
+    return AdaptiveIterations(
+        relative_tolerance=float(
+            os.getenv('SANDBOX_ADAPTIVE_RELATIVE_TOLERANCE')),
+        quantile=float(os.getenv('SANDBOX_ADAPTIVE_QUANTILE', 0.5)),
+        time_budget_s=float(os.getenv('SANDBOX_ADAPTIVE_TIME_BUDGET_S', 10.0)))
+
+  def ci_relative_width(self, elapsed_ns: np.ndarray) -> float:
+    """Return the width of the confidence interval relative to the quantile."""
+    low, high = bootstrap_quantile_ci(elapsed_ns, self.quantile,
+                                      self.confidence)
+    return (high - low) / np.quantile(elapsed_ns, self.quantile)
+
+  def run(self, run_for_n_iters: Callable,
+          n_iters: int) -> Tuple[np.ndarray, float]:
+    """Run batches until the stopping criterion holds and return the elapsed
+    times and the relative width of the achieved confidence interval."""
+    start = time.monotonic()
+    batches = [run_for_n_iters(max(n_iters, self.min_iters))]
+    total_iters = len(batches[0])
+    while True:
+      elapsed_ns = np.concatenate(batches)
+      ci_relative_width = self.ci_relative_width(elapsed_ns)
+      if ci_relative_width <= self.relative_tolerance:
+        break
+      # Double the iteration count within the remaining budget.
+      elapsed_s = time.monotonic() - start
+      s_per_iter = elapsed_s / total_iters
+      remaining_iters = min(self.max_iters - total_iters,
+                            int((self.time_budget_s - elapsed_s) / s_per_iter))
+      batch_size = min(total_iters, remaining_iters)
+      if batch_size < 1:
+        break
+      batches.append(run_for_n_iters(batch_size))
+      total_iters += batch_size
+    return elapsed_ns, ci_relative_width
+
+
+def timed_invoke(run_for_n_iters: Callable,
+                 gflop_count: float,
+                 gbyte_count: float,
+                 n_iters: int,
+                 adaptive: Optional[AdaptiveIterations] = None,
+                 perf_counters: Optional[PerfCounters] = None) -> TimingResults:
+  """Run `n_iters` iterations and return the timing results.
+
+  With an `adaptive` configuration, `n_iters` is the size of the first batch
+  and iterations run until the configured stopping criterion holds. With
+  `perf_counters`, the hardware events counted around the batches are also
+  returned, normalized per iteration.
+  """
+  ci_relative_width = np.nan
+  if perf_counters is not None:
+    perf_counters.reset()
+    run_for_n_iters = perf_counters.wrap(run_for_n_iters)
+  if adaptive is not None:
+    elapsed_ns, ci_relative_width = adaptive.run(run_for_n_iters, n_iters)
+  else:
+    elapsed_ns = run_for_n_iters(n_iters)
   elapsed_s_per_iter = [sec for sec in np.flip(np.sort(elapsed_ns / 1.e9))]
 
   # AVX512 throttling needs a lot of iteration, chance to only report the last n
@@ -158,6 +361,9 @@ def timed_invoke(run_for_n_iters: Callable, gflop_count: float,
   gbyte_per_s_per_iter = [(gbyte_count / sec) for sec in elapsed_s_per_iter]
   gflop_per_s_per_iter = [(gflop_count / sec) for sec in elapsed_s_per_iter]
   print(f'xxxxxxxxxx : {n_iters} iters time on {1} threads')
+  if adaptive is not None:
+    print(f'Adaptive iterations: p{int(100 * adaptive.quantile)} confidence '
+          f'interval width {100 * ci_relative_width:.2f}%')
   line = '-' * 120
   header_data = \
       ['slowest', 'p1', 'p10', 'p25', 'p50', 'p75', 'p90', 'p99', 'fastest']
@@ -176,11 +382,17 @@ def timed_invoke(run_for_n_iters: Callable, gflop_count: float,
   for i in range(2, len(data)):
     format_str = '{:>12.2f}' * (len(data[0]) - 1) + '{:>12s}'
     print(format_str.format(*data[i]))
+  if perf_counters is not None:
+    counts = perf_counters.per_iteration()
+    print('Per iteration: ' + ', '.join(
+        f'{k[:-len("_per_iter")]} {v:.3e}' for k, v in counts.items()))
 
   return {
       "elapsed_s_per_iter": elapsed_s_per_iter,
       "gbyte_per_s_per_iter": gbyte_per_s_per_iter,
       "gflop_per_s_per_iter": gflop_per_s_per_iter,
+      "ci_relative_width": ci_relative_width,
+      **(perf_counters.per_iteration() if perf_counters is not None else {}),
   }
 
 
@@ -204,6 +416,20 @@ def compiled_function_element_types_mlir_builder(
   return [np_type_to_mlir_type(t) for t in np_types]
 
 
+# Return a new context with the sandbox passes and dialects registered. The
+# `compile` methods of ProblemInstance create one unless they are given a
+# context, which long-lived processes reuse across compilations to register
+# once.
+def sandbox_context() -> Context:
+  ctx = Context()
+  register_sandbox_passes_and_dialects(ctx)
+  # TODO: this is necessary to force-load the dialect, otherwise op creation
+  # complains about "unregistered dialect" despite the registration call just
+  # above.
+  ctx.dialects["linalg_transform"]
+  return ctx
+
+
 class ProblemInstance:
   problem_definition: ProblemDefinition
 
@@ -229,6 +455,7 @@ class ProblemInstance:
     self.mlir_context = None
     self.mlir_module = None
     self.mlir_execution_engine = None
+    self.module_hash = None
 
   def __assert_matching_mapping_keys(self, mapping: Mapping[str, Any]):
     if not hasattr(self.problem_definition, 'keys'):
@@ -240,8 +467,6 @@ class ProblemInstance:
                                           fun_to_benchmark_name: str,
                                           module,
                                           zero_at_each_iteration: bool = False):
-    ctx = module.context
-    register_sandbox_passes_and_dialects(ctx)
     with InsertionPoint(module.body):
       types = self.problem_definition.types_mlir_builder(
           self.compile_time_problem_sizes_dict,
@@ -257,9 +482,14 @@ class ProblemInstance:
       module,
       # TODO: Better type than Callable.
       transform: Callable[[ModuleOp], None],
-      dump_ir_to_file: str = ''):
+      dump_ir_to_file: str = '',
+      entry_point_name: Optional[str] = None,
+      pipeline_fingerprint: Optional[str] = None):
     transformed_module, self.mlir_execution_engine = compile_to_execution_engine(
-        module, transform)
+        module,
+        transform,
+        entry_point_name=entry_point_name,
+        pipeline_fingerprint=pipeline_fingerprint)
     if (len(dump_ir_to_file) > 0):
       f = open(dump_ir_to_file, 'w')
       f.write(str(transformed_module))
@@ -274,20 +504,20 @@ class ProblemInstance:
       # TODO: Better type than Callable.
       schedule_builder: Callable,
       dump_ir_to_file: str = '',
-      zero_at_each_iteration: bool = False):
-    with ir.Context() as ctx, ir.Location.unknown() as loc:
+      zero_at_each_iteration: bool = False,
+      context: Optional[Context] = None):
+    with context or sandbox_context() as ctx, ir.Location.unknown() as loc:
       module = Module.create()
       self.compile_time_problem_sizes_dict = compile_time_problem_sizes_dict
       self.build_problem_under_context_manager(entry_point_name,
                                                fun_to_benchmark_name, module)
-      # TODO: this is necessary to force-load the dialect, otherwise op creation
-      # complains about "unregistered dialect" despite the registration call just
-      # above.
-      ctx.dialects["linalg_transform"]
       schedule_builder(module)
-      return self._compile_to_execution_engine(module,
-                                               ApplySchedule(),
-                                               dump_ir_to_file=dump_ir_to_file)
+      self.mlir_module, _ = self._compile_to_execution_engine(
+          module,
+          ApplySchedule(),
+          dump_ir_to_file=dump_ir_to_file,
+          entry_point_name=entry_point_name)
+      return self.mlir_module, self.mlir_execution_engine
 
   def compile(
       self,
@@ -297,14 +527,15 @@ class ProblemInstance:
       # TODO: Better type than Callable.
       transform: Callable,
       dump_ir_to_file: str = '',
-      zero_at_each_iteration: bool = False):
+      zero_at_each_iteration: bool = False,
+      context: Optional[Context] = None):
     assert self.compile_time_problem_sizes_dict is None, \
         f'Problem already compiled, please instantiate a new problem'
     self.__assert_matching_mapping_keys(compile_time_problem_sizes_dict)
 
     self.compile_time_problem_sizes_dict = compile_time_problem_sizes_dict
 
-    with Context() as ctx, Location.unknown() as loc:
+    with context or sandbox_context() as ctx, Location.unknown() as loc:
       self.mlir_context = ctx
       self.mlir_module = Module.create()
       self.build_problem_under_context_manager(entry_point_name,
@@ -315,16 +546,85 @@ class ProblemInstance:
       def apply_transform_to_entry_point_name(module):
         return transform(entry_point_name, module)
 
-      self._compile_to_execution_engine(self.mlir_module,
-                                        apply_transform_to_entry_point_name,
-                                        dump_ir_to_file)
+      self.mlir_module, _ = self._compile_to_execution_engine(
+          self.mlir_module,
+          apply_transform_to_entry_point_name,
+          dump_ir_to_file,
+          entry_point_name=entry_point_name,
+          pipeline_fingerprint=get_pipeline_fingerprint(transform))
+
+  def reuse_compilation(self, other: ProblemInstance):
+    """Share the compilation results of `other` instead of compiling.
+
+    `other` must have been compiled for the same function, expert, types and
+    compile-time problem sizes.
+    """
+    assert self.compile_time_problem_sizes_dict is None, \
+        f'Problem already compiled, please instantiate a new problem'
+    self.compile_time_problem_sizes_dict = other.compile_time_problem_sizes_dict
+    self.mlir_context = other.mlir_context
+    self.mlir_module = other.mlir_module
+    self.mlir_execution_engine = other.mlir_execution_engine
+    self.module_hash = other.module_hash
+
+  def lowered_module_hash(self) -> str:
+    """Return the canonical hash of the lowered module, see
+    `canonical_module_hash`."""
+    if self.module_hash is None:
+      self.module_hash = canonical_module_hash(self.mlir_module)
+    return self.module_hash
+
+  def _rotating_run_for_n_iters(self, entry_point_name: str,
+                                np_input_and_outputs: Sequence[np.ndarray],
+                                cold_cache_bytes: int) -> Callable:
+    """Return a `run_for_n_iters` function that runs each iteration on the next
+    of a set of copies of `np_input_and_outputs` exceeding `cold_cache_bytes`.
+
+    Every iteration invokes the benchmarking function once, the time spent
+    switching buffers is not part of the measured kernel time.
+    """
+    footprint = sum(t.nbytes for t in np_input_and_outputs)
+    num_copies = max(2, -(-2 * cold_cache_bytes // footprint))
+    buffer_sets = [np_input_and_outputs] + [[
+        realign(t, byte_alignment=64) for t in np_input_and_outputs
+    ] for _ in range(num_copies - 1)]
+    print(f'Cold cache: rotating through {num_copies} copies of '
+          f'{footprint} bytes')
+    # The buffer sets need to remain live as long as their pointers are used.
+    buffer_and_pointer_sets = [
+        (b, get_mlir_abi_compatible_types(b)) for b in buffer_sets
+    ]
+    np_timer = np.zeros([1], dtype=np.int64)
+    np_timer_pointer = get_mlir_abi_compatible_types([np_timer]).pop()
+    next_set = [0]
+
+    def run_for_n_iters(n_iters: int):
+      np_timers = np.zeros([n_iters], dtype=np.int64)
+      for i in range(n_iters):
+        _, pointers = buffer_and_pointer_sets[next_set[0]]
+        next_set[0] = (next_set[0] + 1) % num_copies
+        self.mlir_execution_engine.invoke(entry_point_name, *pointers,
+                                          np_timer_pointer)
+        np_timers[i] = np_timer[0]
+      return np_timers
+
+    return run_for_n_iters
 
   def run(self,
           n_iters: int,
           entry_point_name: str,
           runtime_problem_sizes_dict: dict,
           dump_obj_to_file: str = None,
-          skip_setup_and_dump_and_check: bool = False):
+          skip_setup_and_dump_and_check: bool = False,
+          adaptive: Optional[AdaptiveIterations] = None,
+          cold_cache_bytes: Optional[int] = None,
+          perf_counters: Optional[PerfCounters] = None):
+    """Run the compiled problem and return its timing results.
+
+    If `cold_cache_bytes` is set, the iterations rotate through enough copies of
+    the inputs and outputs to exceed that many bytes, so that every iteration
+    starts with operands evicted from caches of that size.
+    """
     self.__assert_matching_mapping_keys(runtime_problem_sizes_dict)
     assert_runtime_sizes_compatible_with_compile_time_sizes(
         runtime_problem_sizes_dict, self.compile_time_problem_sizes_dict)
@@ -346,6 +646,11 @@ class ProblemInstance:
                                         np_timers_pointer)
       return np_timers
 
+    if cold_cache_bytes is not None:
+      run_for_n_iters = self._rotating_run_for_n_iters(entry_point_name,
+                                                       np_input_and_outputs,
+                                                       cold_cache_bytes)
+
     if not skip_setup_and_dump_and_check:
       # 3. Pre-run to ensure JIT compilation actually happened to the end.
       run_for_n_iters(1)
@@ -367,7 +672,154 @@ class ProblemInstance:
                             runtime_problem_sizes_dict),
                         gbyte_count=self.problem_definition.gbyte_count_builder(
                             runtime_problem_sizes_dict, self.np_types),
-                        n_iters=n_iters)
+                        n_iters=n_iters,
+                        adaptive=adaptive,
+                        perf_counters=perf_counters)
+
+
+_ENGINE_CACHE_MAX_BYTES_ENV = 'SANDBOX_ENGINE_CACHE_MAX_BYTES'
+_ENGINE_CACHE_MAX_BYTES_DEFAULT = 256 * 1024 * 1024
+
+
+class ExecutionEngineCache:
+  """In-memory LRU cache of compiled problem instances.
+
+  Keeps the MLIR context, module and ExecutionEngine of compiled problems alive
+  so that repeated (function name, expert, compile-time sizes, types)
+  configurations within one process reuse the JIT'd code. The memory footprint
+  of an entry is approximated by the size of its transformed IR; the least
+  recently used entries are dropped once the total exceeds `max_bytes`.
+  """
+
+  def __init__(self, max_bytes: int = _ENGINE_CACHE_MAX_BYTES_DEFAULT):
+    self.max_bytes = max_bytes
+    self.entries = OrderedDict()
+    self.total_bytes = 0
+    self.hits = 0
+    self.misses = 0
+
+  @staticmethod
+  def key(problem_factory: Callable, function_name: str,
+          expert: TransformationList, compile_time_problem_sizes_dict: dict,
+          np_types: Sequence[np.dtype], zero_at_each_iteration: bool):
+    """Compute the cache key of a compilation, None if the expert has
+    Python-side effects that must happen on every compilation.
+
+    Experts are identified by their pipelines when these can be described and
+    by their identity otherwise. The problem factory is part of the key to
+    distinguish problems sharing a function name.
+    """
+    if has_python_side_effects(expert):
+      return None
+    expert_fingerprint = get_pipeline_fingerprint(expert)
+    return (id(problem_factory), function_name, expert_fingerprint
+            if expert_fingerprint is not None else id(expert),
+            repr(sorted(compile_time_problem_sizes_dict.items())),
+            tuple(np.dtype(t).name for t in np_types), zero_at_each_iteration)
+
+  def lookup(self, key) -> Optional[ProblemInstance]:
+    if key is None or key not in self.entries:
+      self.misses += 1
+      return None
+    self.hits += 1
+    self.entries.move_to_end(key)
+    return self.entries[key][0]
+
+  def insert(self, key, problem: ProblemInstance, *keep_alive: Any):
+    """Insert a compiled problem, `keep_alive` objects are referenced by the
+    entry to keep identities used in the key valid."""
+    if key is None:
+      return
+    size = len(str(problem.mlir_module))
+    if size > self.max_bytes:
+      return
+    self.entries[key] = (problem, size, keep_alive)
+    self.total_bytes += size
+    while self.total_bytes > self.max_bytes:
+      _, (_, evicted_size, _) = self.entries.popitem(last=False)
+      self.total_bytes -= evicted_size
+
+
+# Snapshots of the IR between transforms shared by all harness invocations in
+# the process.
+_compilation_trie = CompilationTrie.from_env()
+
+# Engine cache shared by all harness invocations in the process.
+_engine_cache = ExecutionEngineCache(
+    int(os.getenv(_ENGINE_CACHE_MAX_BYTES_ENV,
+                  _ENGINE_CACHE_MAX_BYTES_DEFAULT)))
+
+# State inherited by the forked ahead-of-time compilation workers. Problem
+# factories and experts are often lambdas that do not pickle, workers only
+# receive the index of their task.
+_aot_compilation_state = None
+
+
+def _aot_compile(task_index: int) -> Optional[str]:
+  """Compile one task of the ahead-of-time compilation and return an error
+  message on failure."""
+  problem_factory, function_name, zero_at_each_iteration, tasks = \
+      _aot_compilation_state
+  np_types, problem_sizes_dict, compile_time_problem_sizes_dict, expert = \
+      tasks[task_index]
+  try:
+    problem = ProblemInstance(problem_factory(problem_sizes_dict, np_types),
+                              np_types)
+    problem.compile(
+        entry_point_name='main',
+        fun_to_benchmark_name=function_name,
+        compile_time_problem_sizes_dict=compile_time_problem_sizes_dict,
+        transform=expert,
+        zero_at_each_iteration=zero_at_each_iteration)
+  except Exception as e:
+    return f'{e}'
+  return None
+
+
+def _compile_ahead_of_time(problem_factory: Callable, function_name: str,
+                           tasks: Sequence[tuple], zero_at_each_iteration: bool,
+                           num_workers: int, excluded_cpu: Optional[int]):
+  """Compile all `tasks` in a pool of `num_workers` processes.
+
+  The object code is materialized in the persistent compilation cache, the
+  subsequent compilations of the same configurations load it instead of
+  compiling.
+  """
+  global _aot_compilation_state
+  if CompilationCache.from_env() is None:
+    log('Ahead-of-time compilation requires the compilation cache, skipping')
+    return
+  start = time.time()
+  # Sizes sharing compile-time sizes compile to the same code.
+  unique_tasks = OrderedDict()
+  for task in tasks:
+    np_types, _, compile_time_problem_sizes_dict, expert = task
+    unique_tasks.setdefault(
+        (tuple(np.dtype(t).name for t in np_types),
+         repr(sorted(compile_time_problem_sizes_dict.items())), id(expert)),
+        task)
+  tasks = list(unique_tasks.values())
+  _aot_compilation_state = (problem_factory, function_name,
+                            zero_at_each_iteration, tasks)
+  cpus = os.sched_getaffinity(0) - {excluded_cpu}
+
+  def pin_worker():
+    # Keep the compilation workers off the benchmarking core.
+    if cpus:
+      os.sched_setaffinity(0, cpus)
+
+  try:
+    with mp.get_context('fork').Pool(num_workers,
+                                     initializer=pin_worker) as pool:
+      errors = pool.map(_aot_compile, range(len(tasks)))
+  finally:
+    _aot_compilation_state = None
+  for task, error in zip(tasks, errors):
+    if error is not None:
+      log(f'Ahead-of-time compilation for compile-time sizes {task[2]} '
+          f'failed: {error}')
+  print(f'Ahead-of-time compilation of {len(tasks)} configurations with '
+        f'{num_workers} workers in {time.time() - start}s')
 
 
 def _pytimed(callback: Callable[..., None], *args: Any, **kwargs: Any):
@@ -478,7 +930,8 @@ def add_argparser_arguments(
   parser.add_argument('--dump_data',
                       type=str,
                       nargs='?',
-                      help='dump file (e.g., --dump_data /tmp/data.json)',
+                      help='dump file (e.g., --dump_data /tmp/data.json), '
+                      'files with the .jsonl extension are appended to',
                       default='')
 
 def test_argparser(benchmark_name: str, \
@@ -567,6 +1020,39 @@ def test_harness(problem_factory: Callable[
     argument is provided, it will be called `n_iters` times for the purpose of
     measuring baseline performance.
   plot_path: A path to an existing directory to dump the performance plots.
+  group_by_compile_time_sizes: Compile each expert once per group of problem
+    sizes sharing the same compile-time sizes and run all runtime sizes of the
+    group against the same ExecutionEngine. Sizes still run in the order of
+    `problem_sizes_list`. For example, a fully dynamic sweep compiles each
+    expert once.
+  num_compile_workers: Number of processes compiling all (types, sizes,
+    expert) combinations ahead of time, before the measurements run serially.
+    Requires the persistent compilation cache.
+  benchmark_cpu: CPU the measurements are pinned to, the ahead-of-time
+    compilation workers avoid it.
+  engine_cache: An ExecutionEngineCache used to reuse compiled problems across
+    sizes and experts, defaults to a cache shared by the whole process.
+  adaptive_iterations: An AdaptiveIterations configuration to run each
+    measurement until the confidence interval of its quantile is tight enough
+    instead of exactly `n_iters` times. Defaults to the configuration set by the
+    SANDBOX_ADAPTIVE_* environment variables, if any.
+  compilation_trie: A CompilationTrie used to resume the compilation of experts
+    sharing a prefix of transforms from a snapshot of the IR, defaults to a trie
+    shared by the whole process. None disables the snapshots.
+  result_memo: A ResultMemo used to measure experts lowering to the same code
+    once, the others reuse and are flagged as duplicates of the first one.
+    Defaults to a new memo per invocation unless the
+    SANDBOX_DISABLE_RESULT_MEMO environment variable is set. None measures
+    every expert.
+  cold_cache: Also measure each expert with cold operands, rotating through
+    copies of the inputs and outputs that exceed the cache size. Defaults to
+    the SANDBOX_COLD_CACHE environment variable.
+  cold_cache_bytes: Cache size to exceed in cold cache measurements, defaults
+    to the SANDBOX_COLD_CACHE_BYTES environment variable or the detected last
+    level cache size.
+  perf_counters: A PerfCounters object counting hardware events around the
+    measurements, defaults to counters enabled by the SANDBOX_PERF_COUNTERS
+    environment variable if they are available.
 
   Returns: A dictionary of all collected benchmark results.
   """
@@ -575,92 +1061,227 @@ def test_harness(problem_factory: Callable[
     experts = {str(value): value for value in experts}
 
   measurements = Measurements()
-
-  for np_types in np_types_list:
+  engine_cache = kwargs.get('engine_cache', _engine_cache)
+  engine_cache_hits, engine_cache_misses = engine_cache.hits, engine_cache.misses
+  adaptive = kwargs.get('adaptive_iterations', AdaptiveIterations.from_env())
+  compilation_trie = kwargs.get('compilation_trie', _compilation_trie)
+  if compilation_trie is not None:
+    trie_stats = (compilation_trie.hits, compilation_trie.misses,
+                  compilation_trie.skipped_transforms)
+  result_memo = kwargs.get('result_memo', ResultMemo.from_env())
+  if result_memo is not None:
+    result_memo_hits = result_memo.hits
+  cold_cache = kwargs.get('cold_cache',
+                          os.getenv('SANDBOX_COLD_CACHE', '0') not in ('', '0'))
+  cold_cache_bytes = None
+  if cold_cache:
+    cold_cache_bytes = kwargs.get(
+        'cold_cache_bytes',
+        int(os.getenv('SANDBOX_COLD_CACHE_BYTES',
+                      get_last_level_cache_bytes())))
+  cache_modes = ['hot', 'cold'] if cold_cache else ['hot']
+  perf_counters = kwargs.get('perf_counters', None) or perf_counters_from_env()
+
+  def get_compile_time_problem_sizes_dict(problem_sizes_dict):
+    return {
+        key: (value if key not in dynamic_at_compile_time_sizes else -1)
+        for key, value in problem_sizes_dict.items()
+    }
+
+  # With grouping, each expert is compiled once for the first problem sizes of
+  # every compile-time signature.
+  group_by_compile_time_sizes = kwargs.get('group_by_compile_time_sizes', False)
+  compiled_sizes_list = problem_sizes_list
+  if group_by_compile_time_sizes:
+    signature_to_sizes = OrderedDict()
     for problem_sizes_dict in problem_sizes_list:
-      compile_time_problem_sizes_dict = {
-          key: (value if key not in dynamic_at_compile_time_sizes else -1)
-          for key, value in problem_sizes_dict.items()
-      }
-      runtime_problem_sizes_dict = problem_sizes_dict
-
-      # Init printing.
-      print(
-          f'\n###############################################################\n'
-          f'Compile-time problem size {compile_time_problem_sizes_dict}\n'
-          f'Runtime problem size {runtime_problem_sizes_dict}\n'
-          f'Problem types {np_types}')
-      problem_definition = problem_factory(problem_sizes_dict, np_types)
-      gflops = problem_definition.gflop_count_builder(problem_sizes_dict)
-      gbytes = problem_definition.gbyte_count_builder(problem_sizes_dict,
-                                                      np_types)
-      for expert_name, expert in experts.items():
-        print(f'\nCompilation expert {expert_name}')
-        problem = ProblemInstance(problem_definition, np_types)
-
-        start = time.time()
-        problem.compile(
-            entry_point_name='main',
-            fun_to_benchmark_name=function_name,
-            compile_time_problem_sizes_dict=compile_time_problem_sizes_dict,
-            transform=expert,
-            dump_ir_to_file=kwargs.get('dump_ir_to_file', ''),
-            zero_at_each_iteration=kwargs.get('zero_at_each_iteration', False))
-        print(f'Compile time {time.time() - start}')
-
-        start = time.time()
-        timing_results = problem.run(
-            n_iters=n_iters,
-            entry_point_name='main',
-            runtime_problem_sizes_dict=runtime_problem_sizes_dict,
-            dump_obj_to_file=kwargs.get('dump_obj_to_file', ''))
-        print(f'Run time {time.time() - start}')
-
-        measurements.append(
-            function_name,
-            expert_name,
-            np_types,
-            dynamic_at_compile_time_sizes,
-            runtime_problem_sizes_dict,
-            gflops,
-            gbytes,
-            timing_results,
-        )
-
-      if 'numpy_benchmark' in kwargs and os.environ.get('BENCHMARK_NUMPY'):
-        print('\nNumPy reference\n')
-        args = problem_definition.tensors_np_builder(problem_sizes_dict,
-                                                     np_types)
-        timing_results = timed_invoke(
-            lambda n: _run_benchmark_n_iters(kwargs['numpy_benchmark'], n, args,
-                                             problem_sizes_dict, np_types),
-            gflops, gbytes, n_iters)
-
-        measurements.append(function_name, 'numpy', np_types,
-                            dynamic_at_compile_time_sizes,
-                            runtime_problem_sizes_dict, gflops, gbytes,
-                            timing_results)
-
-      if 'pytorch_benchmark' in kwargs and os.environ.get('BENCHMARK_TORCH'):
-        print('\nPyTorch reference\n')
-        import torch
-        torch.set_num_threads(1)
-        numpy_args = problem_definition.tensors_np_builder(
-            problem_sizes_dict, np_types)
-        args = list(map(torch.from_numpy, numpy_args))
-        timing_results = timed_invoke(
-            lambda n: _run_benchmark_n_iters(kwargs[
-                'pytorch_benchmark'], n, args, problem_sizes_dict, np_types),
-            gflops, gbytes, n_iters)
-
-        measurements.append(function_name, 'pytorch', np_types,
-                            dynamic_at_compile_time_sizes,
-                            runtime_problem_sizes_dict, gflops, gbytes,
-                            timing_results)
-
-    file_name = kwargs.get('dump_data_to_file', '')
-    if file_name != '':
-      # measurements.dump_to_file(file_name)
-      measurements.dump_raw_to_file(file_name)
-
-    return measurements
+      signature = repr(
+          sorted(
+              get_compile_time_problem_sizes_dict(problem_sizes_dict).items()))
+      signature_to_sizes.setdefault(signature, problem_sizes_dict)
+    compiled_sizes_list = list(signature_to_sizes.values())
+
+  num_compile_workers = kwargs.get('num_compile_workers', 1)
+  benchmark_cpu = kwargs.get('benchmark_cpu', None)
+  zero_at_each_iteration = kwargs.get('zero_at_each_iteration', False)
+  if num_compile_workers > 1:
+    compile_tasks = [(np_types, problem_sizes_dict,
+                      get_compile_time_problem_sizes_dict(problem_sizes_dict),
+                      expert)
+                     for np_types in np_types_list
+                     for problem_sizes_dict in compiled_sizes_list
+                     for expert in experts.values()]
+    _compile_ahead_of_time(problem_factory, function_name, compile_tasks,
+                           zero_at_each_iteration, num_compile_workers,
+                           benchmark_cpu)
+  previous_affinity = os.sched_getaffinity(0)
+  if benchmark_cpu is not None:
+    os.sched_setaffinity(0, {benchmark_cpu})
+
+  try:
+    # With grouping, problems compiled for the first problem sizes of a
+    # compile-time signature are reused by the following ones, by engine cache
+    # key. Unlike the engine cache, which may be disabled or too small, this
+    # reuse is guaranteed within the call.
+    compiled_problems = dict()
+    for np_types in np_types_list:
+      for problem_sizes_dict in problem_sizes_list:
+        compile_time_problem_sizes_dict = get_compile_time_problem_sizes_dict(
+            problem_sizes_dict)
+        runtime_problem_sizes_dict = problem_sizes_dict
+
+        # Init printing.
+        print(
+            f'\n###############################################################\n'
+            f'Compile-time problem size {compile_time_problem_sizes_dict}\n'
+            f'Runtime problem size {runtime_problem_sizes_dict}\n'
+            f'Problem types {np_types}')
+        problem_definition = problem_factory(problem_sizes_dict, np_types)
+        gflops = problem_definition.gflop_count_builder(problem_sizes_dict)
+        gbytes = problem_definition.gbyte_count_builder(problem_sizes_dict,
+                                                        np_types)
+        for expert_name, expert in experts.items():
+          print(f'\nCompilation expert {expert_name}')
+          problem = ProblemInstance(problem_definition, np_types)
+
+          start = time.time()
+          engine_cache_key = ExecutionEngineCache.key(
+              problem_factory, function_name, expert,
+              compile_time_problem_sizes_dict, np_types, zero_at_each_iteration)
+          cached_problem = compiled_problems.get(engine_cache_key)
+          if cached_problem is None:
+            cached_problem = engine_cache.lookup(engine_cache_key)
+          compile_profile = {}
+          if cached_problem is not None:
+            problem.reuse_compilation(cached_problem)
+          else:
+            with profile_compile_time() as profile, \
+                use_compilation_trie(compilation_trie):
+              problem.compile('main',
+                              function_name,
+                              compile_time_problem_sizes_dict,
+                              transform=expert,
+                              dump_ir_to_file=kwargs.get('dump_ir_to_file', ''),
+                              zero_at_each_iteration=zero_at_each_iteration)
+            compile_profile = profile.columns()
+            engine_cache.insert(engine_cache_key, problem, problem_factory,
+                                expert)
+          if group_by_compile_time_sizes and engine_cache_key is not None:
+            compiled_problems[engine_cache_key] = problem
+          compile_time_s = time.time() - start
+          print(f'Compile time {compile_time_s}' +
+                (' (reused)' if cached_problem is not None else ''))
+          if compile_profile:
+            print(f'Compile time breakdown: {profile}')
+            if profile.pipelines:
+              print(f'Slowest pipelines: {profile.slowest_pipelines()}')
+
+          median_gbyte_per_s = dict()
+          for cache_mode in cache_modes:
+            memoized = None
+            if result_memo is not None:
+              memo_key = (problem.lowered_module_hash(),
+                          repr(sorted(runtime_problem_sizes_dict.items())),
+                          cache_mode)
+              memoized = result_memo.lookup(memo_key)
+            if memoized is not None:
+              duplicate_of, timing_results = memoized
+              print(f'Duplicate of expert {duplicate_of}: same lowered module, '
+                    f'reusing its {cache_mode} measurements')
+            else:
+              duplicate_of = ''
+              start = time.time()
+              timing_results = problem.run(
+                  n_iters=n_iters,
+                  entry_point_name='main',
+                  runtime_problem_sizes_dict=runtime_problem_sizes_dict,
+                  dump_obj_to_file=kwargs.get('dump_obj_to_file', ''),
+                  # The hot run already checked the results.
+                  skip_setup_and_dump_and_check=cache_mode == 'cold',
+                  adaptive=adaptive,
+                  cold_cache_bytes=cold_cache_bytes
+                  if cache_mode == 'cold' else None,
+                  perf_counters=perf_counters)
+              print(f'Run time {time.time() - start}')
+              if result_memo is not None:
+                result_memo.insert(memo_key, expert_name, timing_results)
+            median_gbyte_per_s[cache_mode] = np.median(
+                timing_results['gbyte_per_s_per_iter'])
+
+            measurements.append(
+                function_name,
+                expert_name,
+                np_types,
+                dynamic_at_compile_time_sizes,
+                runtime_problem_sizes_dict,
+                gflops,
+                gbytes,
+                timing_results,
+                compile_time_s=compile_time_s,
+                cache_mode=cache_mode,
+                compile_profile=compile_profile,
+                duplicate_of=duplicate_of,
+            )
+          if cold_cache:
+            # Not formatted as a quantile table line, log parsers rely on those.
+            print(f'Hot vs cold p50: {median_gbyte_per_s["hot"]:.2f} vs '
+                  f'{median_gbyte_per_s["cold"]:.2f} GB/s')
+
+        if 'numpy_benchmark' in kwargs and os.environ.get('BENCHMARK_NUMPY'):
+          print('\nNumPy reference\n')
+          args = problem_definition.tensors_np_builder(problem_sizes_dict,
+                                                       np_types)
+          timing_results = timed_invoke(
+              lambda n: _run_benchmark_n_iters(kwargs[
+                  'numpy_benchmark'], n, args, problem_sizes_dict, np_types),
+              gflops, gbytes, n_iters, adaptive)
+
+          measurements.append(function_name, 'numpy', np_types,
+                              dynamic_at_compile_time_sizes,
+                              runtime_problem_sizes_dict, gflops, gbytes,
+                              timing_results)
+
+        if 'pytorch_benchmark' in kwargs and os.environ.get('BENCHMARK_TORCH'):
+          print('\nPyTorch reference\n')
+          import torch
+          torch.set_num_threads(1)
+          numpy_args = problem_definition.tensors_np_builder(
+              problem_sizes_dict, np_types)
+          # Pooled inputs are read-only, which PyTorch tensors cannot be.
+          args = [
+              torch.from_numpy(a if a.flags.writeable else a.copy())
+              for a in numpy_args
+          ]
+          timing_results = timed_invoke(
+              lambda n: _run_benchmark_n_iters(kwargs[
+                  'pytorch_benchmark'], n, args, problem_sizes_dict, np_types),
+              gflops, gbytes, n_iters, adaptive)
+
+          measurements.append(function_name, 'pytorch', np_types,
+                              dynamic_at_compile_time_sizes,
+                              runtime_problem_sizes_dict, gflops, gbytes,
+                              timing_results)
+
+      print(f'\nEngine cache: {engine_cache.hits - engine_cache_hits} hits, '
+            f'{engine_cache.misses - engine_cache_misses} misses')
+      if compilation_trie is not None:
+        print(
+            f'Compilation trie: {compilation_trie.hits - trie_stats[0]} hits, '
+            f'{compilation_trie.misses - trie_stats[1]} misses, '
+            f'{compilation_trie.skipped_transforms - trie_stats[2]} '
+            f'transforms skipped')
+      if result_memo is not None:
+        print(f'Result memo: {result_memo.hits - result_memo_hits} duplicate '
+              f'measurements reused')
+
+      file_name = kwargs.get('dump_data_to_file', '')
+      if file_name.endswith('.jsonl'):
+        measurements.dump_jsonl_to_file(file_name)
+      elif file_name != '':
+        # measurements.dump_to_file(file_name)
+        measurements.dump_raw_to_file(file_name)
+
+      return measurements
+  finally:
+    # Do not leave the caller pinned to the benchmarking core.
+    os.sched_setaffinity(0, previous_affinity)
@@ -0,0 +1,46 @@
+# RUN: %PYTHON %s 2>&1 | FileCheck %s
+
+# This file contains a microbenchmark of the harness bookkeeping: appending to
+# Measurements must cost constant time per row regardless of the number of rows
+# already stored.
+
+import time
+
+from ..core.harness import *
+
+
+def append_cost_per_row(measurements: Measurements, n_appends: int,
+                        n_iters: int) -> float:
+  """Append `n_appends` measurements of `n_iters` rows and return the average
+  time per row in seconds."""
+  timing_results = {k: np.random.rand(n_iters) for k in Measurements.data_keys}
+  start = time.perf_counter()
+  for i in range(n_appends):
+    sizes = {'m': i % 16, 'n': 32}
+    measurements.append('bench', f'expert{i % 4}', [np.float32] * 3, set(),
+                        sizes, 1.0, 1.0, timing_results)
+  return (time.perf_counter() - start) / (n_appends * n_iters)
+
+
+# CHECK-NOT: FAILURE
+def main():
+  n_iters = 1000
+  measurements = Measurements()
+  costs = []
+  for batch in range(8):
+    cost = append_cost_per_row(measurements, 100, n_iters)
+    costs.append(cost)
+    print(f'{measurements.num_rows:>10d} rows: {1.e9 * cost:>8.2f} ns/row')
+
+  start = time.perf_counter()
+  measurements.to_data_frame()
+  print(f'Materialized {measurements.num_rows} rows in '
+        f'{time.perf_counter() - start:.3f}s')
+
+  # The per-row cost must not grow with the number of stored rows.
+  if costs[-1] > 10 * costs[0]:
+    print(f'Append cost grows with the number of rows -> FAILURE')
+
+
+if __name__ == '__main__':
+  main()
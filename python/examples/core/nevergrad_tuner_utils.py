@@ -1,9 +1,21 @@
 from typing import Sequence
 
 from argparse import ArgumentParser
+from collections import namedtuple
+import functools
+import itertools
+import math
+import multiprocessing as mp
+import multiprocessing.connection
 import nevergrad as ng
 import numpy as np
-from typing import Callable, Sequence
+import os
+import time
+from typing import AbstractSet, Any, Callable, Hashable, List, Mapping, Optional, Sequence, Set, Tuple
+
+from .transform import get_name_remapping
+from .tuning_database import size_distance
+from .variables import *
 
 debug_constraints = False
 
@@ -93,80 +105,587 @@ def dispatch_size_constraints_conjunction_satisfied(
                                                 proposed_search_sizes)
 
 
+################################################################################
+### Search spaces derived from the variables of experts.
+################################################################################
+
+
+# Return independent choices for every element of a vector.
+def elementwise_choice(candidates_per_element: Sequence[Sequence]):
+  return ng.p.Tuple(*[ng.p.Choice(list(c)) for c in candidates_per_element])
+
+
+# Return the nevergrad parameter of a variable of type `variable_type` for a
+# problem with the given loop sizes, or None if the variable has no natural
+# bounds and keeps its default value:
+#   - choices and bools: one of their options,
+#   - tile sizes: 0 (not tiled) up to the problem size of every loop,
+#   - interchanges: permutations of the loops,
+#   - peeling: subsets of the loops,
+#   - pack and hoist paddings: a flag and a loop depth per operand.
+def get_variable_parameter(variable_type: type, problem_sizes: Sequence[int],
+                           max_tile_size: Optional[int],
+                           num_operands: Optional[int]):
+  num_loops = len(problem_sizes)
+  if issubclass(variable_type, ChoiceVariableBase):
+    return ng.p.Choice(list(variable_type.options))
+  if issubclass(variable_type, BoolVariable):
+    return ng.p.Choice([False, True])
+  if issubclass(variable_type, TilingSizesVariable):
+    return elementwise_choice(
+        [range(min(size, max_tile_size or size) + 1) for size in problem_sizes])
+  if issubclass(variable_type, TransposePaddingVariable):
+    # Depends on the operand ranks, which are unknown here.
+    return None
+  if issubclass(variable_type, InterchangeVariable):
+    return ng.p.Choice(list(itertools.permutations(range(num_loops))))
+  if issubclass(variable_type, PeelingVariable):
+    return ng.p.Choice([
+        loops for n in range(num_loops + 1)
+        for loops in itertools.combinations(range(num_loops), n)
+    ])
+  if num_operands is not None and issubclass(variable_type,
+                                             PackPaddingVariable):
+    return elementwise_choice([[0, 1]] * num_operands)
+  if num_operands is not None and issubclass(variable_type,
+                                             HoistPaddingVariable):
+    return elementwise_choice([range(num_loops + 1)] * num_operands)
+  return None
+
+
+# Convert a value chosen by nevergrad to the plain Python value expected by
+# transforms, e.g. tuples of numpy integers become lists of ints.
+def to_variable_value(value):
+  if isinstance(value, (tuple, list, np.ndarray)):
+    return [to_variable_value(v) for v in value]
+  if isinstance(value, np.generic):
+    return value.item()
+  return value
+
+
+# Return True if no transform of a proposal both pads and peels, given the
+# (pad, peel) variable names of every transform and the values of the variables
+# that are not tuned.
+def constraint_pad_peel_exclusive(pad_peel_names: Sequence[Tuple[str, str]],
+                                  fixed_values: Mapping[str, Any], proposal):
+  kwargs = dict(proposal[1])
+  kwargs.update(fixed_values)
+  for pad, peel in pad_peel_names:
+    if kwargs.get(pad, False) and len(kwargs.get(peel, [])) > 0:
+      return False
+  return True
+
+
+# Search space of the keyword arguments of an expert class created with
+# `TransformListMetaclass` (e.g. DoubleTilingExpert), derived from the types of
+# its `variables` and the loop sizes of the problem.
+#
+# Every variable maps to a nevergrad parameter, see `get_variable_parameter`,
+# except:
+#   - the variables in `fixed_values`, passed as is to the expert,
+#   - the `untuned_variable_names` and the variables without natural bounds
+#     (e.g. IntVariable), which keep their default values.
+# `parameters` overrides the parameters of variables by name, with either
+# nevergrad parameters or lists of candidate values.
+# Like in `search.SearchSpace`, a transform may not both pad and peel: the
+# instrumentation rejects these proposals with a cheap constraint.
+class ExpertSearchSpace:
+
+  def __init__(self,
+               expert_class: type,
+               problem_sizes: Sequence[int],
+               fixed_values: Mapping[str, Any] = {},
+               parameters: Mapping[str, Any] = {},
+               max_tile_size: Optional[int] = None,
+               num_operands: Optional[int] = None):
+    self.expert_class = expert_class
+    self.problem_sizes = list(problem_sizes)
+    self.fixed_values = dict(fixed_values)
+    self.parameters = dict()
+    for name, variable in expert_class.variables.items():
+      if name in self.fixed_values:
+        continue
+      variable_type, has_default = (variable[0], True) \
+        if isinstance(variable, tuple) else (variable, False)
+      parameter = parameters.get(name)
+      if parameter is not None and not isinstance(parameter, ng.p.Parameter):
+        parameter = ng.p.Choice(list(parameter))
+      # Variables of chained transforms are suffixed with their index.
+      untuned = name.rstrip('0123456789') in untuned_variable_names
+      if parameter is None and not untuned and isinstance(
+          variable_type, type) and issubclass(variable_type, Variable):
+        parameter = get_variable_parameter(variable_type, self.problem_sizes,
+                                           max_tile_size, num_operands)
+      if parameter is None:
+        if not has_default:
+          raise ValueError(f'Variable {name} of {expert_class.__name__} has '
+                           f'no default value, it must be given a fixed value '
+                           f'or a parameter')
+        continue
+      self.parameters[name] = parameter
+    # Names in the expert of the pad and peel variables of every transform.
+    self.pad_peel_names = []
+    for remapping in get_name_remapping(expert_class._transform_classes):
+      names = {local: name for name, local in remapping.items()}
+      if 'pad' in names and 'peel' in names:
+        self.pad_peel_names.append((names['pad'], names['peel']))
+    self.instrumentation = ng.p.Instrumentation(**self.parameters)
+    # The constraint must pickle for the optimizer to be checkpointed.
+    self.instrumentation.register_cheap_constraint(
+        functools.partial(constraint_pad_peel_exclusive, self.pad_peel_names,
+                          self.fixed_values))
+
+  # Return True if the expert keyword arguments `kwargs` satisfy the
+  # constraints of the search space.
+  def is_valid(self, kwargs: Mapping[str, Any]) -> bool:
+    return constraint_pad_peel_exclusive(self.pad_peel_names, self.fixed_values,
+                                         ((), kwargs))
+
+  # Return the keyword arguments of the expert for a proposal of nevergrad.
+  def expert_kwargs(self, proposal) -> dict:
+    kwargs = {k: to_variable_value(v) for k, v in proposal.kwargs.items()}
+    kwargs.update(self.fixed_values)
+    return kwargs
+
+  # Suggest the expert keyword arguments `kwargs` (e.g. a seed of
+  # `analytical_model.double_tiling_seeds`) as the next candidate of
+  # `optimizer`. Parameters missing from `kwargs` take the default value of
+  # their variable if it is in the search space, and keep their current value
+  # otherwise. Return False if a value is out of the search space or if the
+  # values violate its constraints.
+  def suggest(self, optimizer, kwargs: Mapping[str, Any]) -> bool:
+
+    def to_choice_value(value):
+      if isinstance(value, (tuple, list)):
+        return tuple(to_choice_value(v) for v in value)
+      return value
+
+    def default_value(name: str, param):
+      variable = self.expert_class.variables[name]
+      if not isinstance(variable, tuple):
+        return param.value
+      try:
+        param.spawn_child(new_value=to_choice_value(variable[1]))
+      except ValueError:
+        return param.value
+      return to_choice_value(variable[1])
+
+    values = dict()
+    for name, param in self.parameters.items():
+      values[name] = to_choice_value(kwargs[name]) \
+          if name in kwargs else default_value(name, param)
+    if not self.is_valid(values):
+      return False
+    try:
+      optimizer.suggest(**values)
+    except ValueError:
+      return False
+    return True
+
+  # Instantiate the expert for a proposal of nevergrad.
+  def make_expert(self, proposal, fun_name: str, op_name: str):
+    return self.expert_class(fun_name, op_name, **self.expert_kwargs(proposal))
+
+
 # State that is shared across parent and children processes in a MP run.
 # All information within this state must "pickle".
+# `module_hash` is the canonical hash of the lowered module, `throughputs` are
+# None when the module was already measured.
 class IPCState:
 
-  def __init__(self, success: bool, throughputs: Sequence, problem=None):
+  def __init__(self,
+               success: bool,
+               throughputs: Sequence,
+               problem=None,
+               module_hash: str = None):
     self.success = success
     self.throughputs = throughputs
     self.problem = problem
-
-
-class NGExecution:
-
-  def __init__(self, proposal, problem_instance):
-    self.proposal = proposal
-    self.problem_instance = problem_instance
-
-
-class NGMPExecution(NGExecution):
-
-  def __init__(self, proposal, problem_instance, process, ipc_dict):
-    super().__init__(proposal, problem_instance)
-    self.process = process
-    self.ipc_dict = ipc_dict
-
-  def future_ipc_state(self):
-    return self.ipc_dict['result']
-
-
-# Root process sleeps and synchronizes all forked bulk_synchronous processes.
-# Additionally, this updates the NGMPExecutions accordingly for further
-# processing across the single/multi process boundary:
-#   1. on a timeout or an exception, the corresponding entry in processes and
-#      problem_instances is set to None to avoid touching them again in the
-#      future.
-#   2. on a successful finish, the corresponding entry in problem_instances is
-#      set to the corresponding ipc_dict['problem']. This is used to
-#      communicated back the compiled state of the problem across the single/multi
-#      process boundary.
-def join_bulk_synchronous_processes(ng_mp_executions: Sequence[NGMPExecution],
-                                    timeout: float):
-  import time
-  remaining_time = timeout
-  found_alive = True
-  joined_with_root = [False for p in ng_mp_executions]
-  # Busy-wait to implement a simple polling mechanism.
-  while found_alive and remaining_time > 0:
-    found_alive = False
-    remaining_time = remaining_time - 0.1
-    time.sleep(0.1)
-    for idx in range(len(ng_mp_executions)):
-      # This process was already joined, skip.
-      if joined_with_root[idx] is True:
-        continue
-
-      process = ng_mp_executions[idx].process
-      # This process finished by itself, join with it and mark it joined.
-      if not process.is_alive():
+    self.module_hash = module_hash
+
+
+# Outcome of a task of a WorkerPool, `status` is one of:
+#   - 'success': `value` is the result of the task,
+#   - 'error': the task raised, `value` describes the exception,
+#   - 'timeout': the task did not complete in time and its worker was killed,
+#   - 'crash': the worker died while running the task.
+TaskResult = namedtuple('TaskResult',
+                        ['task_id', 'status', 'value', 'elapsed_s'])
+
+
+# Resident set size of the current process in MB.
+def _resident_set_size_mb() -> float:
+  with open('/proc/self/statm') as f:
+    return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+
+
+# Entry point of the processes of a WorkerPool: apply `function` to the
+# arguments received on `connection` and send back the results, until None is
+# received. The process is first pinned to `cpus`, if any, and runs
+# `initializer`, if any.
+# After `max_tasks` tasks or once its resident set exceeds `max_rss_mb`, the
+# worker flags its last result as retiring and exits.
+def _worker_main(function: Callable, connection, cpus: Optional[Set[int]],
+                 initializer: Optional[Callable], max_tasks: Optional[int],
+                 max_rss_mb: Optional[float]):
+  if cpus:
+    os.sched_setaffinity(0, cpus)
+  if initializer is not None:
+    initializer()
+  num_tasks = 0
+  while True:
+    try:
+      task = connection.recv()
+    except EOFError:
+      return
+    if task is None:
+      return
+    task_id, args = task
+    try:
+      result = ('success', function(*args))
+    except Exception as e:
+      result = ('error', f'{type(e).__name__}: {e}')
+    num_tasks += 1
+    retiring = (max_tasks is not None and num_tasks >= max_tasks) or \
+        (max_rss_mb is not None and _resident_set_size_mb() > max_rss_mb)
+    try:
+      connection.send((task_id, result, retiring))
+    except Exception as e:
+      connection.send(
+          (task_id, ('error', f'cannot send result: {e}'), retiring))
+    if retiring:
+      return
+
+
+# Persistent pool of forked processes applying `function` to the arguments of
+# the submitted tasks, one task per worker at a time.
+#
+# Unlike bulk-synchronous rounds, tasks are submitted as soon as a worker is
+# idle and their results are collected as soon as they arrive. `wait` blocks on
+# the worker pipes until a result arrives or the earliest deadline expires,
+# without polling. Workers running a task for more than `timeout` seconds are
+# killed and replaced, as are workers that died.
+#
+# The workers are forked, so `function` and the state it refers to are
+# inherited rather than pickled. Only the task arguments and results go through
+# the pipes and must pickle. Workers are pinned to `cpus` if it is not empty.
+#
+# Workers are warm: `initializer` runs once per worker before its first task
+# (e.g. to register the MLIR dialects and passes), and a worker runs tasks until
+# it is recycled. To bound the memory leaked by JIT-compiled engines, workers
+# are recycled after `max_tasks_per_worker` tasks or once their resident set
+# exceeds `max_rss_mb` MB. The replacement is forked right away and the retired
+# worker is reaped later, off the critical path of the next task. A task that
+# crashes its worker (e.g. a segfault in the JIT) is reported with the 'crash'
+# status and the worker is replaced.
+class WorkerPool:
+
+  def __init__(self,
+               num_workers: int,
+               function: Callable,
+               timeout: float,
+               cpus: Optional[Set[int]] = None,
+               initializer: Optional[Callable] = None,
+               max_tasks_per_worker: Optional[int] = None,
+               max_rss_mb: Optional[float] = None):
+    self.context = mp.get_context('fork')
+    self.function = function
+    self.timeout = timeout
+    self.cpus = cpus
+    self.initializer = initializer
+    self.max_tasks_per_worker = max_tasks_per_worker
+    self.max_rss_mb = max_rss_mb
+    self.workers = [self._start_worker() for _ in range(num_workers)]
+    # Running task of every busy worker as (task_id, start time).
+    self.running = dict()
+    self.next_task_id = 0
+    # Processes of the recycled workers that were not joined yet.
+    self.retired = []
+    self.num_recycled = 0
+    self.num_crashes = 0
+    self.num_timeouts = 0
+
+  def _start_worker(self):
+    connection, child_connection = self.context.Pipe()
+    process = self.context.Process(
+        target=_worker_main,
+        args=(self.function, child_connection, self.cpus, self.initializer,
+              self.max_tasks_per_worker, self.max_rss_mb),
+        daemon=True)
+    process.start()
+    child_connection.close()
+    return process, connection
+
+  def _restart_worker(self, index: int):
+    process, connection = self.workers[index]
+    if process.is_alive():
+      process.kill()
+    process.join()
+    connection.close()
+    self.workers[index] = self._start_worker()
+
+  # Replace a worker that is exiting by itself without waiting for it.
+  def _recycle_worker(self, index: int):
+    process, connection = self.workers[index]
+    connection.close()
+    self.retired.append(process)
+    self.workers[index] = self._start_worker()
+    self.num_recycled += 1
+
+  # Join the retired workers that exited.
+  def _reap_retired(self):
+    for process in [p for p in self.retired if not p.is_alive()]:
+      process.join()
+      self.retired.remove(process)
+
+  def num_idle(self) -> int:
+    return len(self.workers) - len(self.running)
+
+  def num_running(self) -> int:
+    return len(self.running)
+
+  # Run `function(*args)` on an idle worker and return the task id.
+  def submit(self, *args) -> int:
+    index = next(i for i in range(len(self.workers)) if i not in self.running)
+    task_id = self.next_task_id
+    self.next_task_id += 1
+    try:
+      self.workers[index][1].send((task_id, args))
+    except OSError:
+      # The worker died before its task (e.g. in `initializer`), `wait` reports
+      # the task as a crash.
+      pass
+    self.running[index] = (task_id, time.monotonic())
+    return task_id
+
+  # Block until at least one running task completes or times out and return
+  # the results of all the tasks that did.
+  def wait(self) -> List[TaskResult]:
+    return wait_any([self])[0]
+
+  # Earliest deadline of the running tasks.
+  def _deadline(self) -> float:
+    return min(start for _, start in self.running.values()) + self.timeout
+
+  # Return the results of the tasks whose connection is in `ready` or whose
+  # deadline expired at time `now`.
+  def _collect(self, ready: AbstractSet, now: float) -> List[TaskResult]:
+    results = []
+    for index in [i for i in self.running if self.workers[i][1] in ready]:
+      connection = self.workers[index][1]
+      task_id, start = self.running.pop(index)
+      try:
+        _, (status, value), retiring = connection.recv()
+        if retiring:
+          self._recycle_worker(index)
+      except (EOFError, OSError):
+        process = self.workers[index][0]
+        process.join(timeout=1)
+        status = 'crash'
+        value = f'worker exited with code {process.exitcode}'
+        self._restart_worker(index)
+        self.num_crashes += 1
+      results.append(TaskResult(task_id, status, value, now - start))
+    for index, (task_id, start) in list(self.running.items()):
+      if now - start >= self.timeout:
+        del self.running[index]
+        self._restart_worker(index)
+        self.num_timeouts += 1
+        results.append(
+            TaskResult(task_id, 'timeout',
+                       f'did not complete within {self.timeout}s', now - start))
+    self._reap_retired()
+    return results
+
+  # Counters of the replaced workers, for reporting.
+  def stats(self) -> dict:
+    return {
+        'recycled': self.num_recycled,
+        'crashes': self.num_crashes,
+        'timeouts': self.num_timeouts
+    }
+
+  def close(self):
+    for process, connection in self.workers:
+      try:
+        connection.send(None)
+      except OSError:
+        pass
+    for process, connection in self.workers:
+      process.join(timeout=1)
+      if process.is_alive():
+        process.kill()
         process.join()
-        joined_with_root[idx] = True
-        continue
-
-      # Otherwise, we found an alive process, continue until timer expires.
-      found_alive = True
-
-  # Timer is up, any alive processes now need to be terminated.
-  for joined, execution in zip(joined_with_root, ng_mp_executions):
-    if joined:
-      continue
-    print(f'timeout: {execution.proposal} did not complete within {timeout}s')
-    execution.process.terminate()
-    execution.process.join()
-    # Override to return a failed IPCState and signify infinite relative_error.
-    execution.future_ipc_state = lambda: IPCState(success=False,
-                                                  throughputs=None)
+      connection.close()
+    for process in self.retired:
+      process.join()
+    self.workers = []
+    self.running = dict()
+    self.retired = []
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+
+# Block until at least one running task of `pools` completes or times out and
+# return the results of the tasks that did, one list per pool.
+def wait_any(pools: Sequence[WorkerPool]) -> List[List[TaskResult]]:
+  running_pools = [pool for pool in pools if pool.running]
+  assert running_pools, 'No running task to wait for'
+  deadline = min(pool._deadline() for pool in running_pools)
+  connections = [
+      pool.workers[i][1] for pool in running_pools for i in pool.running
+  ]
+  ready = set(
+      mp.connection.wait(connections,
+                         timeout=max(0.0, deadline - time.monotonic())))
+  now = time.monotonic()
+  return [pool._collect(ready, now) if pool.running else [] for pool in pools]
+
+
+# Asynchronous successive halving over measurement rungs of increasing
+# iteration counts: candidates are first measured with at least `min_iters`
+# iterations and the best `1 / eta` of the candidates measured at a rung are
+# promoted to the next rung, which runs `eta` times more iterations, up to
+# `max_iters`.
+# Promotions do not wait for a rung to fill up: a candidate is promotable as
+# soon as it ranks in the top `1 / eta` of the results of its rung so far.
+class SuccessiveHalving:
+
+  def __init__(self, min_iters: int, max_iters: int, eta: int = 3):
+    assert eta >= 2, 'Halving rate must be at least 2'
+    self.eta = eta
+    # Rungs are built down from `max_iters` so that the last one is full.
+    self.rung_iters = [max_iters]
+    while self.rung_iters[0] // eta >= max(min_iters, 1):
+      self.rung_iters.insert(0, self.rung_iters[0] // eta)
+    # Values of the candidates measured at every rung, higher is better, and
+    # candidates that cannot be promoted from every rung.
+    self.results = [dict() for _ in self.rung_iters]
+    self.not_promotable = [set() for _ in self.rung_iters]
+
+  def num_rungs(self) -> int:
+    return len(self.rung_iters)
+
+  # Record the `value` of candidate `key` at `rung`.
+  def report(self,
+             key: Hashable,
+             rung: int,
+             value: float,
+             promotable: bool = True):
+    self.results[rung][key] = value
+    if not promotable:
+      self.not_promotable[rung].add(key)
+
+  # Return a candidate to promote and its next rung, highest rungs first, or
+  # None if no candidate is promotable.
+  def promotion(self) -> Optional[Tuple[Hashable, int]]:
+    for rung in reversed(range(self.num_rungs() - 1)):
+      results = self.results[rung]
+      best = sorted(results, key=results.get, reverse=True)
+      for key in best[:len(results) // self.eta]:
+        if key not in self.not_promotable[rung]:
+          self.not_promotable[rung].add(key)
+          return key, rung + 1
+    return None
+
+  # Return the iterations of the probe preceding a measurement at `rung` and
+  # the incumbent value the probe must beat, (0, None) without probe. The first
+  # rung is the cheapest measurement and is not probed: only promoted candidates
+  # are abandoned.
+  def probe(self, rung: int) -> Tuple[int, Optional[float]]:
+    incumbent = self.incumbent()
+    if rung == 0 or incumbent is None:
+      return 0, None
+    return self.rung_iters[0], incumbent
+
+  # Best value of the highest rung measured so far, None if none is.
+  def incumbent(self) -> Optional[float]:
+    for results in reversed(self.results):
+      if results:
+        return max(results.values())
+    return None
+
+  # Return the best candidate of the highest rung measured so far and its
+  # value, None if none is.
+  def best(self) -> Optional[Tuple[Hashable, float]]:
+    for results in reversed(self.results):
+      if results:
+        key = max(results, key=results.get)
+        return key, results[key]
+    return None
+
+
+# Return True if a candidate whose probe measured `probe_values`, higher is
+# better, cannot beat the `incumbent` value.
+def abandon_after_probe(probe_values: Sequence[float],
+                        incumbent: Optional[float]) -> bool:
+  return incumbent is not None and max(probe_values) < incumbent
+
+
+################################################################################
+### Tuning several problem sizes.
+################################################################################
+
+
+# Split a budget of `budget * sqrt(num_sizes)` evaluations across the sizes of a
+# multi-size run, sizes tuned after their neighbours start from their best
+# configurations and need fewer evaluations than a size tuned alone. Every size
+# gets at least one evaluation.
+def multi_size_budgets(budget: int, num_sizes: int) -> List[int]:
+  total = max(num_sizes, round(budget * math.sqrt(num_sizes)))
+  return [
+      total // num_sizes + (1 if i < total % num_sizes else 0)
+      for i in range(num_sizes)
+  ]
+
+
+# Order `problem_sizes_list` so that every size follows its nearest size in log
+# space, starting from the smallest problem.
+def multi_size_order(
+    problem_sizes_list: Sequence[Sequence[int]]) -> List[List[int]]:
+  remaining = [list(sizes) for sizes in problem_sizes_list]
+  ordered = [min(remaining, key=lambda sizes: (np.prod(sizes), sizes))]
+  remaining.remove(ordered[0])
+  while remaining:
+    nearest = min(remaining,
+                  key=lambda sizes: (size_distance(ordered[-1], sizes), sizes))
+    remaining.remove(nearest)
+    ordered.append(nearest)
+  return ordered
+
+
+# Return up to `limit` search sizes transferred from the best configurations of
+# the `tuned` sizes nearest to `problem_sizes`, best first. `tuned` maps tuples
+# of problem sizes to their (search sizes, throughput) results, best first.
+# Transferred tile sizes are reduced to the largest divisor of the new problem
+# size, 0 (not tiled) is kept.
+def transfer_configurations(problem_sizes: Sequence[int],
+                            tuned: Mapping[Tuple[int, ...],
+                                           Sequence[Tuple[Sequence[int],
+                                                          float]]],
+                            limit: int) -> List[List[int]]:
+
+  def snap(size: int, tile_size: int) -> int:
+    if tile_size == 0:
+      return 0
+    return max(d for d in range(1, min(size, tile_size) + 1) if size % d == 0)
+
+  candidates = sorted(
+      (size_distance(problem_sizes, tuned_sizes), rank, search_sizes)
+      for tuned_sizes, results in tuned.items()
+      for rank, (search_sizes, _) in enumerate(results))
+  transferred = []
+  for distance, _, search_sizes in candidates:
+    if distance == math.inf or len(transferred) == limit:
+      break
+    snapped = [snap(s, t) for s, t in zip(problem_sizes, search_sizes)]
+    if snapped not in transferred:
+      transferred.append(snapped)
+  return transferred
 
 
 # Add tuning-specific arguments to the parser.
@@ -186,19 +705,67 @@ def add_argparser_tuning_arguments(parser: ArgumentParser):
                       nargs='?',
                       default=1)
   parser.add_argument('--random-seed', type=int, nargs='?', default=42)
+  # Number of best known configurations of the tuning database seeding a new
+  # run, and number of evaluations between optimizer checkpoints.
+  parser.add_argument('--warm-start', type=int, nargs='?', default=4)
+  parser.add_argument('--checkpoint-every', type=int, nargs='?', default=10)
+  # Number of configurations transferred from the nearest tuned sizes when
+  # tuning several problem sizes.
+  parser.add_argument('--transfer', type=int, nargs='?', default=4)
+  # Do not seed new runs with the tile sizes of the analytical model of the
+  # host, see `analytical_model.py`.
+  parser.add_argument('--no-analytical-seeding',
+                      dest='analytical_seeding',
+                      action='store_false')
+  # Cost model ranking the proposals of the asynchronous loop: once trained,
+  # only the best predicted of `cost-model-candidates` proposals is compiled.
+  parser.add_argument('--cost-model',
+                      type=str,
+                      nargs='?',
+                      choices=['none', 'ridge'],
+                      default='none')
+  parser.add_argument('--cost-model-candidates',
+                      type=int,
+                      nargs='?',
+                      default=16)
+  # Successive halving: candidates are first measured with `min-iters`
+  # iterations, only the best `1 / halving-rate` are measured with
+  # `halving-rate` times more iterations, up to `n_iters`. Disabled by default,
+  # and only supported by the asynchronous loop, like the cost model.
+  parser.add_argument('--min-iters', type=int, nargs='?', default=None)
+  parser.add_argument('--halving-rate', type=int, nargs='?', default=3)
   parser.add_argument('--search-budget', type=int, nargs='?', default=100)
+  # Expert of `core/experts.py` whose variables are tuned instead of the
+  # register tile sizes, e.g. DoubleTilingExpert. Single problem size and no
+  # cost model.
+  parser.add_argument('--expert', type=str, nargs='?', default=None)
   parser.add_argument(
       '--search-strategy',
       type=str,
       nargs='+',
       default=['RandomSearch'],
   )
+  parser.add_argument(
+      '--tuning-loop',
+      type=str,
+      nargs='?',
+      choices=['async', 'bulk_synchronous'],
+      default='async',
+  )
   parser.add_argument('--timeout-per-compilation',
                       type=int,
                       nargs='?',
                       default=5)
-  # Until ExecutionEngine pickles, we are both compiling and evaluating.
+  # The bulk synchronous loop both compiles and evaluates in the same process,
+  # the asynchronous loop measures the compiled kernels in a separate worker.
   parser.add_argument('--timeout-per-evaluation',
                       type=int,
                       nargs='?',
                       default=5)
+  # Workers evaluating candidates are recycled after this many evaluations or
+  # once their resident set exceeds this many MB, 0 disables either limit.
+  parser.add_argument('--worker-max-tasks', type=int, nargs='?', default=100)
+  parser.add_argument('--worker-max-rss-mb', type=int, nargs='?', default=4096)
+  # CPU the measurement worker of the asynchronous loop is pinned to, the
+  # compilation workers run on the other CPUs. Defaults to the last CPU.
+  parser.add_argument('--benchmark-cpu', type=int, nargs='?', default=None)
@@ -0,0 +1,218 @@
+# RUN: %PYTHON %s 2>&1 | FileCheck %s
+
+# This file contains tests of the nevergrad tuner utilities.
+
+import os
+import time
+
+import nevergrad as ng
+
+from ..core.experts import *
+from ..core.nevergrad_tuner_utils import *
+
+
+def check_equal(actual, expected):
+  if actual != expected:
+    print(f'Expected {expected} but got {actual} -> FAILURE')
+
+
+def test_expert_search_space():
+  space = ExpertSearchSpace(DoubleTilingExpert, [64, 96, 32],
+                            max_tile_size=32,
+                            num_operands=3)
+  if space.pad_peel_names != [('pad1', 'peel1'), ('pad2', 'peel2')]:
+    print(f'Unexpected pad and peel variables {space.pad_peel_names} '
+          f'-> FAILURE')
+  optimizer = ng.optimizers.registry['RandomSearch'](
+      parametrization=space.instrumentation, budget=50)
+  for _ in range(50):
+    proposal = optimizer.ask()
+    kwargs = space.expert_kwargs(proposal)
+    for pad, peel in space.pad_peel_names:
+      if kwargs[pad] and kwargs[peel]:
+        print(f'{pad} and {peel} proposed together -> FAILURE')
+    if any(t > 32 for t in kwargs['tile_sizes1'] + kwargs['tile_sizes2']):
+      print(f'Tile sizes above the maximum in {kwargs} -> FAILURE')
+    space.make_expert(proposal, 'matmul', 'linalg.generic')
+    optimizer.tell(proposal, 1.0)
+
+
+def test_expert_search_space_suggest():
+  space = ExpertSearchSpace(DoubleTilingExpert, [64, 96, 32],
+                            fixed_values={'pad1': True},
+                            max_tile_size=32)
+  if space.is_valid({'pad1': False, 'peel1': [0]}):
+    print('Fixed pad1 ignored -> FAILURE')
+  optimizer = ng.optimizers.registry['RandomSearch'](
+      parametrization=space.instrumentation, budget=10)
+  if space.suggest(optimizer, {'peel1': [0, 1]}):
+    print('Suggested peel1 along with the fixed pad1 -> FAILURE')
+  if space.suggest(optimizer, {'tile_sizes2': [64, 0, 0]}):
+    print('Suggested tile sizes above the maximum -> FAILURE')
+  seed = {'tile_sizes1': [32, 32, 16], 'tile_interchange1': [1, 2, 0]}
+  if not space.suggest(optimizer, seed):
+    print(f'Could not suggest {seed} -> FAILURE')
+  kwargs = space.expert_kwargs(optimizer.ask())
+  if any(kwargs[name] != value for name, value in seed.items()) or \
+      not kwargs['pad1']:
+    print(f'Asked {kwargs} instead of the suggested {seed} -> FAILURE')
+
+
+def test_successive_halving():
+  halving = SuccessiveHalving(min_iters=10, max_iters=1000, eta=3)
+  check_equal(halving.rung_iters, [12, 37, 111, 333, 1000])
+  check_equal(SuccessiveHalving(1000, 1000).rung_iters, [1000])
+  check_equal(halving.promotion(), None)
+  check_equal(halving.probe(0), (0, None))
+
+  # The best third of a rung is promoted, once.
+  for key, value in [('a', 1.0), ('b', 3.0), ('c', 2.0)]:
+    halving.report(key, 0, value)
+  check_equal(halving.promotion(), ('b', 1))
+  check_equal(halving.promotion(), None)
+  check_equal(halving.incumbent(), 3.0)
+  # The first rung is not probed, promotions are probed with the iterations of
+  # the first rung against the incumbent.
+  check_equal(halving.probe(0), (0, None))
+  check_equal(halving.probe(1), (12, 3.0))
+
+  # Higher rungs are promoted first and define the incumbent.
+  halving.report('b', 1, 2.5)
+  for key, value in [('d', 4.0), ('e', 0.5), ('f', 0.1)]:
+    halving.report(key, 0, value)
+  check_equal(halving.incumbent(), 2.5)
+  check_equal(halving.best(), ('b', 2.5))
+  check_equal(halving.promotion(), ('d', 1))
+  # Abandoned candidates are not promoted.
+  halving.report('d', 1, 2.0, promotable=False)
+  halving.report('g', 1, 1.0)
+  check_equal(halving.promotion(), ('b', 2))
+  check_equal(halving.promotion(), None)
+
+
+def test_abandon_after_probe():
+  check_equal(abandon_after_probe([1.0, 2.0], None), False)
+  check_equal(abandon_after_probe([1.0, 2.0], 1.5), False)
+  check_equal(abandon_after_probe([1.0, 2.0], 2.5), True)
+
+
+def test_multi_size_budgets():
+  # Every size gets a share of budget * sqrt(num_sizes), at least one.
+  check_equal(multi_size_budgets(100, 1), [100])
+  check_equal(multi_size_budgets(100, 4), [50, 50, 50, 50])
+  check_equal(multi_size_budgets(100, 3), [58, 58, 57])
+  check_equal(multi_size_budgets(1, 3), [1, 1, 1])
+
+
+def test_multi_size_order():
+  # The smallest problem first, then the nearest remaining size in log space.
+  check_equal(
+      multi_size_order([[256, 256, 256], [16, 16, 16], [128, 128, 128],
+                        [32, 32, 32]]),
+      [[16, 16, 16], [32, 32, 32], [128, 128, 128], [256, 256, 256]])
+  # Ties are broken by the sizes.
+  check_equal(multi_size_order([[64, 16, 16], [16, 16, 64], [16, 16, 16]]),
+              [[16, 16, 16], [16, 16, 64], [64, 16, 16]])
+
+
+def test_transfer_configurations():
+  tuned = {
+      (16, 16, 16): [([8, 8, 1], 30.0), ([6, 6, 1], 20.0)],
+      (128, 128, 128): [([32, 0, 16], 90.0)],
+      (16, 16): [([1, 1], 99.0)],
+  }
+  # The nearest sizes first, snapped to divisors of the new sizes, 0 is kept.
+  check_equal(transfer_configurations([96, 96, 96], tuned, 4),
+              [[32, 0, 16], [8, 8, 1], [6, 6, 1]])
+  check_equal(transfer_configurations([24, 24, 24], tuned, 4),
+              [[8, 8, 1], [6, 6, 1], [24, 0, 12]])
+  check_equal(transfer_configurations([24, 24, 24], tuned, 1), [[8, 8, 1]])
+  # Snapped duplicates are transferred once.
+  check_equal(transfer_configurations([12, 12, 12], tuned, 4),
+              [[6, 6, 1], [12, 0, 12]])
+  # Sizes of another rank are never transferred.
+  check_equal(transfer_configurations([24, 24, 24, 24], tuned, 4), [])
+
+
+# Process id of the worker whose initializer ran, see `initialize_worker`.
+initialized_pid = None
+
+
+def initialize_worker():
+  global initialized_pid
+  initialized_pid = os.getpid()
+
+
+def worker_task(action: str):
+  if action == 'crash':
+    os._exit(3)
+  if action == 'raise':
+    raise ValueError(action)
+  if action == 'sleep':
+    time.sleep(60)
+  return os.getpid(), initialized_pid
+
+
+def run_task(pool: WorkerPool, *args) -> TaskResult:
+  task_id = pool.submit(*args)
+  results = pool.wait()
+  if len(results) != 1 or results[0].task_id != task_id:
+    print(f'Unexpected results {results} of task {task_id} -> FAILURE')
+  return results[0]
+
+
+def test_worker_pool_recycling():
+  with WorkerPool(1,
+                  worker_task,
+                  timeout=10,
+                  initializer=initialize_worker,
+                  max_tasks_per_worker=2) as pool:
+    pids = []
+    for _ in range(5):
+      result = run_task(pool, 'run')
+      check_equal(result.status, 'success')
+      pid, initialized = result.value
+      # The initializer runs in every worker, recycled ones included.
+      check_equal(initialized, pid)
+      pids.append(pid)
+    # Workers are replaced after every second task.
+    check_equal([pid == pids[0] for pid in pids],
+                [True, True, False, False, False])
+    check_equal(pids[2] == pids[3] and pids[3] != pids[4], True)
+    check_equal(pool.stats(), {'recycled': 2, 'crashes': 0, 'timeouts': 0})
+
+
+def test_worker_pool_failures():
+  with WorkerPool(1, worker_task, timeout=1) as pool:
+    result = run_task(pool, 'raise')
+    check_equal((result.status, result.value), ('error', 'ValueError: raise'))
+    result = run_task(pool, 'crash')
+    check_equal((result.status, result.value),
+                ('crash', 'worker exited with code 3'))
+    result = run_task(pool, 'sleep')
+    check_equal(result.status, 'timeout')
+    # Crashed and timed out workers are replaced.
+    check_equal(run_task(pool, 'run').status, 'success')
+    check_equal(pool.stats(), {'recycled': 0, 'crashes': 1, 'timeouts': 1})
+  # A worker dying in its initializer crashes its first task.
+  with WorkerPool(1, worker_task, timeout=10,
+                  initializer=lambda: os._exit(1)) as pool:
+    time.sleep(0.1)
+    check_equal(run_task(pool, 'run').status, 'crash')
+
+
+# CHECK-NOT: FAILURE
+def main():
+  test_expert_search_space()
+  test_expert_search_space_suggest()
+  test_successive_halving()
+  test_abandon_after_probe()
+  test_multi_size_budgets()
+  test_multi_size_order()
+  test_transfer_configurations()
+  test_worker_pool_recycling()
+  test_worker_pool_failures()
+
+
+if __name__ == '__main__':
+  main()
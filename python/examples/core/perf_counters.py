@@ -0,0 +1,222 @@
+"""Hardware performance counters based on Linux `perf_event_open`.
+
+Wall-clock times do not tell whether a slowdown comes from cache misses, branch
+mispredictions or a lower IPC. This module counts hardware events of the
+calling thread around benchmark batches through the `perf_event_open` system
+call, accessed via ctypes. Only user-space events are counted, which is allowed
+by the default `perf_event_paranoid` setting. When the counters cannot be
+opened (e.g., in containers or with a stricter `perf_event_paranoid`), the
+counters are reported as unavailable and measurements proceed without them.
+"""
+
+import ctypes
+import os
+import platform
+import struct
+import sys
+
+from typing import Callable, Mapping, Optional, Sequence
+
+import numpy as np
+
+_SYS_PERF_EVENT_OPEN = {
+    'x86_64': 298,
+    'aarch64': 241,
+    'ppc64le': 319,
+}
+
+_PERF_TYPE_HARDWARE = 0
+_PERF_TYPE_HW_CACHE = 3
+
+_PERF_COUNT_HW_CPU_CYCLES = 0
+_PERF_COUNT_HW_INSTRUCTIONS = 1
+_PERF_COUNT_HW_BRANCH_MISSES = 5
+
+_PERF_COUNT_HW_CACHE_L1D = 0
+_PERF_COUNT_HW_CACHE_LL = 2
+_PERF_COUNT_HW_CACHE_OP_READ = 0
+_PERF_COUNT_HW_CACHE_RESULT_MISS = 1
+
+_PERF_FORMAT_TOTAL_TIME_ENABLED = 1 << 0
+_PERF_FORMAT_TOTAL_TIME_RUNNING = 1 << 1
+
+# Bits of the flags bitfield of perf_event_attr.
+_ATTR_FLAG_DISABLED = 1 << 0
+_ATTR_FLAG_EXCLUDE_KERNEL = 1 << 5
+_ATTR_FLAG_EXCLUDE_HV = 1 << 6
+
+_PERF_EVENT_IOC_ENABLE = 0x2400
+_PERF_EVENT_IOC_DISABLE = 0x2401
+_PERF_EVENT_IOC_RESET = 0x2403
+
+
+def _hw_cache_config(cache: int) -> int:
+  return (cache | (_PERF_COUNT_HW_CACHE_OP_READ << 8) |
+          (_PERF_COUNT_HW_CACHE_RESULT_MISS << 16))
+
+
+# Counted events by name, as (type, config) pairs.
+EVENTS = {
+    'cycles': (_PERF_TYPE_HARDWARE, _PERF_COUNT_HW_CPU_CYCLES),
+    'instructions': (_PERF_TYPE_HARDWARE, _PERF_COUNT_HW_INSTRUCTIONS),
+    'l1d_read_misses': (_PERF_TYPE_HW_CACHE,
+                        _hw_cache_config(_PERF_COUNT_HW_CACHE_L1D)),
+    'llc_read_misses': (_PERF_TYPE_HW_CACHE,
+                        _hw_cache_config(_PERF_COUNT_HW_CACHE_LL)),
+    'branch_misses': (_PERF_TYPE_HARDWARE, _PERF_COUNT_HW_BRANCH_MISSES),
+}
+
+
+def column_name(event_name: str) -> str:
+  """Return the name of the Measurements column of an event."""
+  return f'{event_name}_per_iter'
+
+
+class _PerfEventAttr(ctypes.Structure):
+  """Prefix of `struct perf_event_attr` (PERF_ATTR_SIZE_VER5)."""
+  _fields_ = [
+      ('type', ctypes.c_uint32),
+      ('size', ctypes.c_uint32),
+      ('config', ctypes.c_uint64),
+      ('sample_period', ctypes.c_uint64),
+      ('sample_type', ctypes.c_uint64),
+      ('read_format', ctypes.c_uint64),
+      ('flags', ctypes.c_uint64),
+      ('wakeup_events', ctypes.c_uint32),
+      ('bp_type', ctypes.c_uint32),
+      ('config1', ctypes.c_uint64),
+      ('config2', ctypes.c_uint64),
+      ('branch_sample_type', ctypes.c_uint64),
+      ('sample_regs_user', ctypes.c_uint64),
+      ('sample_stack_user', ctypes.c_uint32),
+      ('clockid', ctypes.c_int32),
+      ('sample_regs_intr', ctypes.c_uint64),
+      ('aux_watermark', ctypes.c_uint32),
+      ('sample_max_stack', ctypes.c_uint16),
+      ('reserved', ctypes.c_uint16),
+  ]
+
+
+def get_perf_event_paranoid() -> Optional[int]:
+  """Return the `perf_event_paranoid` level or None if unknown."""
+  try:
+    with open('/proc/sys/kernel/perf_event_paranoid', 'r') as f:
+      return int(f.read())
+  except (OSError, ValueError):
+    return None
+
+
+class PerfCounters:
+  """Counters of hardware events of the calling thread.
+
+  Counts are accumulated around the batches run by the functions returned by
+  `wrap`, and reported normalized by the number of iterations. The events that
+  cannot be opened are reported as NaN, `available` is False if none can.
+  """
+
+  def __init__(self, event_names: Sequence[str] = tuple(EVENTS.keys())):
+    self.event_names = list(event_names)
+    self.fds = dict()
+    self.errors = dict()
+    self.libc = ctypes.CDLL(None, use_errno=True)
+    syscall_number = _SYS_PERF_EVENT_OPEN.get(platform.machine())
+    for name in self.event_names:
+      if syscall_number is None:
+        self.errors[name] = f'unsupported architecture {platform.machine()}'
+        continue
+      event_type, config = EVENTS[name]
+      attr = _PerfEventAttr()
+      attr.type = event_type
+      attr.size = ctypes.sizeof(_PerfEventAttr)
+      attr.config = config
+      attr.read_format = (_PERF_FORMAT_TOTAL_TIME_ENABLED |
+                          _PERF_FORMAT_TOTAL_TIME_RUNNING)
+      attr.flags = (_ATTR_FLAG_DISABLED | _ATTR_FLAG_EXCLUDE_KERNEL |
+                    _ATTR_FLAG_EXCLUDE_HV)
+      # Count the calling thread on any CPU.
+      fd = self.libc.syscall(syscall_number, ctypes.byref(attr), 0, -1, -1, 0)
+      if fd < 0:
+        self.errors[name] = os.strerror(ctypes.get_errno())
+      else:
+        self.fds[name] = fd
+    self.reset()
+
+  @property
+  def available(self) -> bool:
+    return len(self.fds) > 0
+
+  def describe_errors(self) -> str:
+    """Return a description of the events that could not be opened."""
+    description = ', '.join(f'{k}: {v}' for k, v in self.errors.items())
+    paranoid = get_perf_event_paranoid()
+    if paranoid is not None:
+      description += f' (perf_event_paranoid={paranoid})'
+    return description
+
+  def reset(self):
+    """Reset the accumulated counts."""
+    self.counts = {name: 0.0 for name in self.event_names}
+    self.n_iters = 0
+
+  def _read(self, fd: int) -> float:
+    """Return the count of `fd`, scaled up if the event was multiplexed."""
+    value, time_enabled, time_running = struct.unpack('QQQ', os.read(fd, 24))
+    if time_running == 0:
+      return 0.0
+    return value * time_enabled / time_running
+
+  def _ioctl(self, request: int):
+    for fd in self.fds.values():
+      self.libc.ioctl(fd, request, 0)
+
+  def wrap(self, run_for_n_iters: Callable) -> Callable:
+    """Return a `run_for_n_iters` function counting events around each
+    batch."""
+
+    def counted_run_for_n_iters(n_iters: int):
+      self._ioctl(_PERF_EVENT_IOC_RESET)
+      self._ioctl(_PERF_EVENT_IOC_ENABLE)
+      result = run_for_n_iters(n_iters)
+      self._ioctl(_PERF_EVENT_IOC_DISABLE)
+      for name, fd in self.fds.items():
+        self.counts[name] += self._read(fd)
+      self.n_iters += n_iters
+      return result
+
+    return counted_run_for_n_iters
+
+  def per_iteration(self) -> Mapping[str, float]:
+    """Return the accumulated counts per iteration by column name."""
+    counts = dict()
+    for name in self.event_names:
+      measured = name in self.fds and self.n_iters > 0
+      counts[column_name(name)] = \
+          self.counts[name] / self.n_iters if measured else np.nan
+    return counts
+
+  def close(self):
+    for fd in self.fds.values():
+      os.close(fd)
+    self.fds = dict()
+
+  def __del__(self):
+    self.close()
+
+
+def perf_counters_from_env() -> Optional[PerfCounters]:
+  """Return counters if enabled by SANDBOX_PERF_COUNTERS and available."""
+  if os.getenv('SANDBOX_PERF_COUNTERS', '0') in ('', '0'):
+    return None
+  counters = PerfCounters()
+  if not counters.available:
+    print(
+        f'Hardware performance counters unavailable: '
+        f'{counters.describe_errors()}',
+        file=sys.stderr)
+    return None
+  if counters.errors:
+    print(
+        f'Some hardware performance counters unavailable: '
+        f'{counters.describe_errors()}',
+        file=sys.stderr)
+  return counters
@@ -0,0 +1,101 @@
+"""Memoization of measurements by the canonical hash of the lowered module.
+
+Different tile sizes or interchanges often lower to the same code, e.g., when a
+tile size equals the problem size or when peeling has nothing to peel. This
+module hashes the final lowered module, with the location information and
+comments stripped, so that configurations lowering to identical code are
+measured once and the later ones reuse the measurement of the first.
+"""
+
+import hashlib
+import os
+import re
+
+from typing import Any, Hashable, Optional, Tuple
+
+_DISABLE_RESULT_MEMO_ENV = "SANDBOX_DISABLE_RESULT_MEMO"
+
+# Location aliases, e.g. `#loc0 = loc("file.py":12:3)`, and comments.
+_LOC_ALIAS_OR_COMMENT_LINE = re.compile(r"^\s*(#loc\w*\s*=.*|//.*)$")
+
+
+def _strip_locations(module_ir: str) -> str:
+  """Remove the `loc(...)` attributes, with nested parentheses and strings."""
+  pieces = []
+  begin = 0
+  while True:
+    start = module_ir.find("loc(", begin)
+    if start < 0:
+      break
+    # Only strip whole `loc(` tokens, not suffixes of longer identifiers.
+    if start > 0 and (module_ir[start - 1].isalnum() or
+                      module_ir[start - 1] in "_.$"):
+      pieces.append(module_ir[begin:start + 4])
+      begin = start + 4
+      continue
+    pieces.append(module_ir[begin:start].rstrip(" "))
+    depth, in_string, i = 0, False, start + 3
+    while i < len(module_ir):
+      c = module_ir[i]
+      if in_string:
+        if c == "\\":
+          i += 1
+        elif c == '"':
+          in_string = False
+      elif c == '"':
+        in_string = True
+      elif c == "(":
+        depth += 1
+      elif c == ")":
+        depth -= 1
+        if depth == 0:
+          break
+      i += 1
+    begin = i + 1
+  pieces.append(module_ir[begin:])
+  return "".join(pieces)
+
+
+def canonical_module_hash(module: Any) -> str:
+  """Return a hash of `module`, or of its textual IR, ignoring locations,
+  comments and blank lines."""
+  if not isinstance(module, str):
+    module = module.operation.get_asm(enable_debug_info=False)
+  lines = [
+      line.rstrip()
+      for line in _strip_locations(module).splitlines()
+      if line.strip() and not _LOC_ALIAS_OR_COMMENT_LINE.match(line)
+  ]
+  return hashlib.sha256("\n".join(lines).encode()).hexdigest()
+
+
+class ResultMemo:
+  """Measurements of the first configuration lowering to each module.
+
+  Entries are keyed by the canonical module hash and whatever else the
+  measurement depends on (e.g., the runtime problem sizes), and record the
+  name of the configuration that was measured.
+  """
+
+  def __init__(self):
+    self.results = dict()
+    self.hits = 0
+
+  @staticmethod
+  def from_env() -> Optional['ResultMemo']:
+    """Return a memo or None if disabled by the environment."""
+    if os.getenv(_DISABLE_RESULT_MEMO_ENV, "0") not in ("", "0"):
+      return None
+    return ResultMemo()
+
+  def lookup(self, key: Hashable) -> Optional[Tuple[str, Any]]:
+    """Return the name of the measured configuration and its results, None if
+    `key` was not measured yet."""
+    entry = self.results.get(key)
+    if entry is not None:
+      self.hits += 1
+    return entry
+
+  def insert(self, key: Hashable, name: str, results: Any):
+    """Record the `results` of configuration `name`, first one wins."""
+    self.results.setdefault(key, (name, results))
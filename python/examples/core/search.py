@@ -0,0 +1,384 @@
+"""Deterministic search over the variables of experts.
+
+Complements the nevergrad tuner with reproducible sweeps of small search
+spaces. The space of an expert is built from the `Variable` types of its
+transforms, and constraints are propagated while generating configurations
+rather than checked afterwards:
+  * tile sizes divide (or are bounded by) the loop sizes, and the tile sizes of
+    a transform divide (or are bounded by) the nonzero tile sizes of the
+    enclosing tiling transform,
+  * interchanges are permutations of the loops,
+  * peeling only applies to tiled loops and is exclusive with padding,
+  * padding options only vary when padding is enabled.
+
+The number of valid configurations is counted exactly, which allows unranking
+configurations for grid and random strategies, and reporting how many
+configurations of the unconstrained space were pruned before compilation.
+"""
+
+import math
+import random
+import time
+
+from typing import Any, Callable, Dict, List, Mapping, Optional, Sequence, \
+    Tuple
+
+import numpy as np
+
+from .harness import test_harness
+from .transform import get_name_remapping
+from .variables import *
+
+# Domain of a variable as a function of the values of the variables it
+# depends on, in order.
+DomainFunction = Callable[..., List]
+
+# Evaluation of a batch of configurations, returns one cost per configuration,
+# lower is better, or None if the configuration failed.
+Evaluator = Callable[[Sequence[Dict[str, Any]]], Sequence[Optional[float]]]
+
+
+def _freeze(value):
+  """Return a hashable version of a variable value."""
+  if isinstance(value, (list, tuple)):
+    return tuple(_freeze(v) for v in value)
+  return value
+
+
+class SearchSpace:
+  """Ordered variables whose domains depend on the values of previous ones.
+
+  Each variable has a domain function of the values of its dependencies and the
+  size of its unconstrained domain, which is used to report pruning.
+  """
+
+  def __init__(self, fixed_values: Mapping[str, Any] = {}):
+    self.names = []
+    self.dependencies = dict()
+    self.domain_functions = dict()
+    self.unconstrained_sizes = dict()
+    self.fixed_values = dict(fixed_values)
+    self._domains = dict()
+    self._counts = dict()
+
+  def add(self,
+          name: str,
+          domain_function: DomainFunction,
+          unconstrained_size: int,
+          dependencies: Sequence[str] = ()):
+    """Append a variable, its dependencies must have been added before."""
+    assert all(d in self.names for d in dependencies), \
+        f'Dependencies of {name} must be added first'
+    self.names.append(name)
+    self.dependencies[name] = tuple(dependencies)
+    self.domain_functions[name] = domain_function
+    self.unconstrained_sizes[name] = unconstrained_size
+    self._counts.clear()
+
+  def domain(self, name: str, assignment: Mapping[str, Any]) -> List:
+    """Return the values of `name` given the values of its dependencies."""
+    values = tuple(assignment[d] for d in self.dependencies[name])
+    key = (name, _freeze(values))
+    if key not in self._domains:
+      self._domains[key] = self.domain_functions[name](*values)
+    return self._domains[key]
+
+  def unconstrained_cardinality(self) -> int:
+    return math.prod(self.unconstrained_sizes.values())
+
+  def _live_names(self, index: int) -> List[str]:
+    """Return the names assigned before `index` that later domains use."""
+    live = set()
+    for name in self.names[index:]:
+      live.update(self.dependencies[name])
+    return [n for n in self.names[:index] if n in live]
+
+  def _count(self, index: int, assignment: Dict[str, Any]) -> int:
+    """Return the number of valid completions of `assignment`."""
+    if index == len(self.names):
+      return 1
+    key = (index, _freeze([assignment[n] for n in self._live_names(index)]))
+    if key not in self._counts:
+      name = self.names[index]
+      count = 0
+      for value in self.domain(name, assignment):
+        assignment[name] = value
+        count += self._count(index + 1, assignment)
+      # Empty domains leave `name` unassigned.
+      assignment.pop(name, None)
+      self._counts[key] = count
+    return self._counts[key]
+
+  def cardinality(self) -> int:
+    """Return the number of valid configurations."""
+    return self._count(0, dict())
+
+  def unrank(self, rank: int) -> Dict[str, Any]:
+    """Return the valid configuration of index `rank` in grid order."""
+    assert 0 <= rank < self.cardinality(), f'Rank {rank} out of bounds'
+    assignment = dict()
+    for index, name in enumerate(self.names):
+      for value in self.domain(name, assignment):
+        assignment[name] = value
+        count = self._count(index + 1, assignment)
+        if rank < count:
+          break
+        rank -= count
+    return assignment
+
+  def configuration(self, assignment: Mapping[str, Any]) -> Dict[str, Any]:
+    """Return the keyword arguments of an expert for an assignment."""
+    kwargs = dict(assignment)
+    kwargs.update(self.fixed_values)
+    return kwargs
+
+  def grid(self, budget: int) -> List[Dict[str, Any]]:
+    """Return all valid configurations, or `budget` evenly spaced ones."""
+    cardinality = self.cardinality()
+    num_samples = min(budget, cardinality)
+    return [
+        self.unrank(i * cardinality // num_samples) for i in range(num_samples)
+    ]
+
+  def random_sample(self, budget: int,
+                    rng: random.Random) -> List[Dict[str, Any]]:
+    """Return `budget` distinct valid configurations drawn uniformly."""
+    cardinality = self.cardinality()
+    ranks = rng.sample(range(cardinality), min(budget, cardinality))
+    return [self.unrank(rank) for rank in ranks]
+
+  def latin_hypercube(self, budget: int,
+                      rng: random.Random) -> List[Dict[str, Any]]:
+    """Return up to `budget` distinct configurations stratified per variable.
+
+    Every variable splits the positions in its domain into `budget` strata,
+    each sample takes a different stratum of every variable. Domains that
+    depend on previous variables are stratified as their relative positions.
+    """
+    strata = {name: rng.sample(range(budget), budget) for name in self.names}
+    samples, seen = [], set()
+    for i in range(budget):
+      assignment = dict()
+      for name in self.names:
+        domain = self.domain(name, assignment)
+        position = (strata[name][i] + rng.random()) / budget
+        assignment[name] = domain[int(position * len(domain))]
+      key = _freeze([assignment[n] for n in self.names])
+      if key not in seen:
+        seen.add(key)
+        samples.append(assignment)
+    return samples
+
+  @staticmethod
+  def from_expert(expert_class: type,
+                  problem_sizes: Sequence[int],
+                  fixed_values: Mapping[str, Any] = {},
+                  value_ranges: Mapping[str, Sequence] = {},
+                  max_tile_size: Optional[int] = None,
+                  divisors_only: bool = True,
+                  num_operands: Optional[int] = None) -> 'SearchSpace':
+    """Return the search space of an expert class created with
+    `TransformListMetaclass` (e.g. DoubleTilingExpert) for the given loop sizes.
+
+    The variables in `fixed_values` take a single value, `value_ranges` overrides
+    the domains of variables by name. Untuned variables, variables without
+    natural bounds (e.g. IntVariable) and padding options of operands when
+    `num_operands` is unknown keep their default values.
+    """
+    space = SearchSpace({
+        k: v for k, v in fixed_values.items() if k not in expert_class.variables
+    })
+    num_loops = len(problem_sizes)
+    if max_tile_size is None:
+      max_tile_size = max(problem_sizes)
+    tile_sizes = TilingSizesVariable('tile_sizes', {'default': [num_loops]},
+                                     {'default': range(max_tile_size + 1)})
+
+    def tile_sizes_domain(*enclosing_tile_sizes):
+      bounds = list(problem_sizes)
+      for sizes in enclosing_tile_sizes:
+        bounds = [b if s == 0 else s for b, s in zip(bounds, sizes)]
+      return tile_sizes.enumerate(bounds, divisors_only)
+
+    def add_constant(name, value):
+      space.add(name, lambda: [value], 1)
+
+    def add_values(name, values):
+      space.add(name, lambda: values, len(values))
+
+    # Name in the expert of the tile sizes of the innermost enclosing tiling.
+    enclosing_tile_sizes = None
+    for transform, remapping in zip(
+        expert_class._transform_classes,
+        get_name_remapping(expert_class._transform_classes)):
+      # Names in the expert of the variables of the transform.
+      names = {local: name for name, local in remapping.items()}
+      tiled = 'tile_sizes' in names
+      pad = names.get('pad')
+      for name, local_name in remapping.items():
+        variable = transform.variables[local_name]
+        variable_type, default = variable if isinstance(variable, tuple) \
+            else (variable, None)
+        if name in fixed_values:
+          add_constant(name, fixed_values[name])
+          if local_name == 'tile_sizes':
+            enclosing_tile_sizes = name
+          continue
+        if name in value_ranges:
+          add_values(name, list(value_ranges[name]))
+          continue
+        if local_name in untuned_variable_names or \
+            not isinstance(variable_type, type) or \
+            not issubclass(variable_type, Variable):
+          if not isinstance(variable, tuple):
+            raise ValueError(f'Variable {name} of {expert_class.__name__} has '
+                             f'no default value, it must be given a fixed '
+                             f'value or a value range')
+          add_constant(name, default)
+        elif local_name == 'tile_sizes' and \
+            issubclass(variable_type, TilingSizesVariable):
+          space.add(name, tile_sizes_domain, tile_sizes.cardinality(),
+                    [enclosing_tile_sizes] if enclosing_tile_sizes else [])
+          enclosing_tile_sizes = name
+        elif local_name == 'pad' and tiled:
+          # Padding without tiling does nothing.
+          space.add(name, lambda sizes: [False, True]
+                    if any(sizes) else [False], 2, [names['tile_sizes']])
+        elif issubclass(variable_type, PeelingVariable) and tiled:
+          # Only the tiled loops can be peeled, not along with padding.
+          def peel_domain(sizes, pad=False):
+            if pad:
+              return [[]]
+            return PeelingVariable('peel', {
+                'default': [np.count_nonzero(sizes)]
+            }).enumerate()
+
+          space.add(
+              name, peel_domain,
+              PeelingVariable(name, {
+                  'default': [num_loops]
+              }).cardinality(), [names['tile_sizes']] + ([pad] if pad else []))
+        elif issubclass(variable_type,
+                        (PackPaddingVariable, HoistPaddingVariable)) and \
+            pad is not None and num_operands is not None:
+          # Padding options only matter when padding.
+          if issubclass(variable_type, PackPaddingVariable):
+            padding = variable_type(name, {'default': [num_operands]})
+          else:
+            padding = variable_type(name, {'default': [num_operands]},
+                                    {'default': range(num_loops + 1)})
+          values = padding.enumerate(problem_sizes)
+          space.add(name,
+                    lambda pad, default=default, values=values: values
+                    if pad else [default],
+                    len(values), [pad])
+        elif issubclass(variable_type, (BoolVariable, ChoiceVariableBase)):
+          add_values(name, variable_type(name).enumerate())
+        elif issubclass(variable_type, (InterchangeVariable, PeelingVariable)) \
+            and not issubclass(variable_type, TransposePaddingVariable):
+          add_values(
+              name,
+              variable_type(name, {
+                  'default': [num_loops]
+              }).enumerate(problem_sizes))
+        else:
+          # No natural bounds, e.g. IntVariable.
+          add_constant(name, default)
+    return space
+
+
+def search(space: SearchSpace,
+           evaluate: Evaluator,
+           strategy: str = 'grid',
+           budget: int = 100,
+           batch_size: int = 8,
+           seed: int = 42) -> List[Tuple[Dict[str, Any], Optional[float]]]:
+  """Evaluate `budget` configurations of `space` in batches.
+
+  Arguments:
+  space: The search space.
+  evaluate: Evaluates a batch of expert keyword arguments, see `Evaluator`.
+  strategy: 'grid', 'random' or 'lhs' (Latin hypercube).
+  budget: Maximal number of configurations to evaluate.
+  batch_size: Number of configurations per call to `evaluate`.
+  seed: Seed of the random strategies.
+
+  Returns: The configurations and their costs, best first, failures last.
+  """
+  rng = random.Random(seed)
+  unconstrained = space.unconstrained_cardinality()
+  valid = space.cardinality()
+  print(f'Search space: {unconstrained} configurations, {valid} valid, '
+        f'{unconstrained - valid} pruned before compilation')
+  if strategy == 'grid':
+    assignments = space.grid(budget)
+  elif strategy == 'random':
+    assignments = space.random_sample(budget, rng)
+  elif strategy == 'lhs':
+    assignments = space.latin_hypercube(budget, rng)
+  else:
+    raise ValueError(f'Unknown search strategy {strategy}')
+
+  results = []
+  best = None
+  start = time.time()
+  for begin in range(0, len(assignments), batch_size):
+    batch = [
+        space.configuration(a) for a in assignments[begin:begin + batch_size]
+    ]
+    for configuration, cost in zip(batch, evaluate(batch)):
+      results.append((configuration, cost))
+      if cost is not None and (best is None or cost < best[1]):
+        best = (configuration, cost)
+    print(f'{strategy} search: {len(results)}/{len(assignments)} evaluated in '
+          f'{time.time() - start:.1f}s, best cost '
+          f'{best[1] if best is not None else None}')
+  return sorted(results,
+                key=lambda r: (r[1] is None, r[1] if r[1] is not None else 0))
+
+
+def harness_evaluator(expert_class: type,
+                      problem_factory: Callable,
+                      np_types: Sequence[np.dtype],
+                      problem_sizes_dict: Mapping[str, int],
+                      function_name: str,
+                      op_name: str,
+                      n_iters: int = 10,
+                      metric: str = 'gflop_per_s_per_iter',
+                      **harness_kwargs) -> Evaluator:
+  """Return an evaluator running the harness on a batch of configurations.
+
+  The cost of a configuration is the negated median of `metric`. A batch runs
+  in one harness invocation, e.g. to compile ahead of time with
+  `num_compile_workers`; if it fails, its configurations run one at a time to
+  isolate the failures.
+  """
+
+  def run(configurations: Sequence[Dict[str, Any]]):
+    experts = {
+        f'candidate{i}': expert_class(function_name, op_name, **c)
+        for i, c in enumerate(configurations)
+    }
+    measurements = test_harness(problem_factory, [np_types],
+                                [problem_sizes_dict],
+                                experts,
+                                n_iters=n_iters,
+                                function_name=function_name,
+                                **harness_kwargs)
+    data = measurements.data
+    data = data[data['cache_mode'] == 'hot']
+    return [
+        -float(np.median(data[data['expert'] == name][metric]))
+        for name in experts
+    ]
+
+  def evaluate(configurations: Sequence[Dict[str, Any]]):
+    try:
+      return run(configurations)
+    except Exception as e:
+      if len(configurations) == 1:
+        print(f'Configuration {configurations[0]} failed: {e}')
+        return [None]
+    return [evaluate([c])[0] for c in configurations]
+
+  return evaluate
@@ -0,0 +1,106 @@
+# RUN: %PYTHON %s 2>&1 | FileCheck %s
+
+# This file contains tests of the search driver over expert variables.
+
+import random
+
+from ..core.experts import *
+from ..core.harness import *
+from ..core.search import *
+
+from ..contraction.definitions import *
+
+
+def check_equal(actual, expected):
+  if actual != expected:
+    print(f'Expected {expected} but got {actual} -> FAILURE')
+
+
+def test_counting():
+  space = SearchSpace()
+  space.add('a', lambda: [1, 2, 3], 3)
+  space.add('b', lambda a: list(range(a)), 3, ['a'])
+  check_equal(space.cardinality(), 6)
+  check_equal(space.unconstrained_cardinality(), 9)
+  check_equal([space.unrank(i) for i in range(6)], [{
+      'a': 1,
+      'b': 0
+  }, {
+      'a': 2,
+      'b': 0
+  }, {
+      'a': 2,
+      'b': 1
+  }, {
+      'a': 3,
+      'b': 0
+  }, {
+      'a': 3,
+      'b': 1
+  }, {
+      'a': 3,
+      'b': 2
+  }])
+
+  # Values of `a` without valid `b` have no completion.
+  space.add('c', lambda a, b: [] if a == 3 else [b], 2, ['a', 'b'])
+  check_equal(space.cardinality(), 3)
+  space.add('d', lambda: [], 1)
+  check_equal(space.cardinality(), 0)
+
+
+# Fix the vector lowering options to keep the space small.
+fixed_values = {
+    'contraction_lowering': 'outerproduct',
+    'multi_reduction_lowering': 'innerparallel',
+    'split_transfers': 'linalg-copy',
+    'transpose_lowering': 'eltwise',
+    'transpose_avx2_lowering': False,
+    'unroll_vector_transfers': True,
+    'vectorize_paddings': True,
+    'vectorize_only_tiled': False,
+}
+
+
+def test_constraints(problem_sizes):
+  space = SearchSpace.from_expert(DoubleTilingExpert,
+                                  problem_sizes,
+                                  fixed_values=fixed_values,
+                                  num_operands=3)
+  rng = random.Random(0)
+  for configuration in space.random_sample(100, rng) + \
+      space.latin_hypercube(100, rng):
+    for size, outer, inner in zip(problem_sizes, configuration['tile_sizes1'],
+                                  configuration['tile_sizes2']):
+      bound = outer if outer != 0 else size
+      if size % (outer or size) != 0 or bound % (inner or bound) != 0:
+        print(f'Invalid tile sizes {configuration} -> FAILURE')
+    for level in ['1', '2']:
+      if configuration['pad' + level] and configuration['peel' + level]:
+        print(f'Padding and peeling {configuration} -> FAILURE')
+
+
+# CHECK-NOT: FAILURE
+def main():
+  test_counting()
+  test_constraints([16, 32, 8])
+
+  # Search tile sizes and interchanges of a small matmul.
+  problem_sizes_dict = {'m': 8, 'n': 8, 'k': 8}
+  space = SearchSpace.from_expert(DoubleTilingExpert,
+                                  list(problem_sizes_dict.values()),
+                                  fixed_values={
+                                      **fixed_values, 'pad1': False,
+                                      'pad2': False
+                                  })
+  evaluate = harness_evaluator(
+      DoubleTilingExpert, lambda sizes, types: EinsumProblem('mk,kn', 'mnk', 2),
+      [np.float32] * 3, problem_sizes_dict, 'matmul', 'linalg.generic')
+  for strategy in ['grid', 'random', 'lhs']:
+    results = search(space, evaluate, strategy, budget=4, batch_size=2)
+    if results[0][1] is None:
+      print(f'No successful {strategy} configuration -> FAILURE')
+
+
+if __name__ == '__main__':
+  main()
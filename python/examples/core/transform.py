@@ -1,14 +1,171 @@
 from __future__ import annotations
+import contextlib
 import functools
+import os
+import time
+from collections import OrderedDict
 
 from mlir.ir import Module
 from mlir.passmanager import PassManager
 import typing as tp
 from copy import deepcopy
 
+from .compilation_trie import CompilationTrie, active_compilation_trie
 from .variables import Variable
 
 
+class CompileTimeProfile:
+  """Wall times spent in the steps of a compilation, in seconds.
+
+  Steps are the transforms applied by transformation lists, named after their
+  class, the stages of LowerVectors, the parsing and running of pass pipelines
+  and the creation of the execution engine. The times of repeated steps, e.g.,
+  of several Tile transforms, are accumulated.
+  """
+
+  def __init__(self):
+    self.seconds = OrderedDict()
+    # (step, pipeline, parse seconds, run seconds) for every pipeline run.
+    self.pipelines = []
+
+  def add(self, step: str, seconds: float):
+    self.seconds[step] = self.seconds.get(step, 0.0) + seconds
+
+  def columns(self) -> tp.Mapping[str, float]:
+    """Return the step times keyed by Measurements column name."""
+    return {'compile_s_' + step: s for step, s in self.seconds.items()}
+
+  def slowest_pipelines(self, limit: int = 3) -> str:
+    """Describe the `limit` pipelines with the longest parse and run times."""
+    slowest = sorted(self.pipelines, key=lambda p: p[2] + p[3],
+                     reverse=True)[:limit]
+    return ', '.join(f'{step or "?"} {parse_s + run_s:.3f}s ({pipeline})'
+                     for step, pipeline, parse_s, run_s in slowest)
+
+  def __str__(self) -> str:
+    return ', '.join(f'{step} {s:.3f}s' for step, s in self.seconds.items())
+
+
+# Stack of the profiles being recorded, innermost last.
+_active_profiles: tp.List[CompileTimeProfile] = []
+
+
+@contextlib.contextmanager
+def profile_compile_time():
+  """Context manager recording the compilation steps run in its scope into the
+  CompileTimeProfile it returns."""
+  profile = CompileTimeProfile()
+  _active_profiles.append(profile)
+  try:
+    yield profile
+  finally:
+    _active_profiles.pop()
+
+
+@contextlib.contextmanager
+def timed_compile_step(step: str):
+  """Context manager recording the wall time of its scope as `step` in the
+  active profile, if any."""
+  if not _active_profiles:
+    yield
+    return
+  start = time.perf_counter()
+  try:
+    yield
+  finally:
+    _active_profiles[-1].add(step, time.perf_counter() - start)
+
+
+def run_pipeline(pipeline: str, module: Module, step: str = ''):
+  """Parse and run a pass pipeline on `module`.
+
+  The parse and run times are recorded in the active profile, if any, both in
+  aggregate and for the pipeline of `step`.
+  """
+  start = time.perf_counter()
+  pass_manager = PassManager.parse(pipeline)
+  parsed = time.perf_counter()
+  pass_manager.run(module)
+  if _active_profiles:
+    end = time.perf_counter()
+    profile = _active_profiles[-1]
+    profile.add('pass_manager_parse', parsed - start)
+    profile.add('pass_manager_run', end - parsed)
+    profile.pipelines.append((step, pipeline, parsed - start, end - parsed))
+
+
+def split_pipeline(pipeline: str) -> tp.List[str]:
+  """Split a textual pipeline into its top-level elements, ignoring the commas
+  nested in parentheses, braces and quotes."""
+  elements, depth, quoted, begin = [], 0, False, 0
+  for i, char in enumerate(pipeline):
+    if char == '"':
+      quoted = not quoted
+    elif quoted:
+      continue
+    elif char in '({':
+      depth += 1
+    elif char in ')}':
+      depth -= 1
+    elif char == ',' and depth == 0:
+      elements.append(pipeline[begin:i].strip())
+      begin = i + 1
+  elements.append(pipeline[begin:].strip())
+  return [e for e in elements if e]
+
+
+_FUNC_NEST_PREFIX = 'builtin.func('
+_CLEANUP = ['canonicalize', 'cse']
+
+
+def _func_nest_elements(element: str) -> tp.Optional[tp.List[str]]:
+  """Return the elements of a `builtin.func(...)` nest, None for other
+  elements."""
+  if not element.startswith(_FUNC_NEST_PREFIX) or not element.endswith(')'):
+    return None
+  return split_pipeline(element[len(_FUNC_NEST_PREFIX):-1])
+
+
+def _drop_repeated_cleanups(elements: tp.Sequence[str]) -> tp.List[str]:
+  """Drop the `canonicalize,cse` pairs that immediately follow another one."""
+  result = []
+  i = 0
+  while i < len(elements):
+    if (list(elements[i:i + 2]) == _CLEANUP and
+        result[-len(_CLEANUP):] == _CLEANUP):
+      i += len(_CLEANUP)
+      continue
+    result.append(elements[i])
+    i += 1
+  return result
+
+
+def fuse_pipelines(pipelines: tp.Sequence[str]) -> str:
+  """Merge textual pipelines meant to run in sequence into a single one.
+
+  Consecutive `builtin.func` nests are merged into one nest and repeated
+  back-to-back `canonicalize,cse` pairs are dropped, including a function-level
+  pair right after a module-level one.
+  """
+  fused = []
+  for pipeline in pipelines:
+    for element in split_pipeline(pipeline):
+      nested = _func_nest_elements(element)
+      previous = _func_nest_elements(fused[-1]) if fused else None
+      if nested is not None and previous is not None:
+        fused[-1] = (_FUNC_NEST_PREFIX +
+                     ','.join(_drop_repeated_cleanups(previous + nested)) + ')')
+        continue
+      if nested is not None and fused[-len(_CLEANUP):] == _CLEANUP:
+        # Module-level cleanups already processed all functions.
+        nested = _drop_repeated_cleanups(_CLEANUP + nested)[len(_CLEANUP):]
+        if not nested:
+          continue
+        element = _FUNC_NEST_PREFIX + ','.join(nested) + ')'
+      fused.append(element)
+  return ','.join(_drop_repeated_cleanups(fused))
+
+
 class _TransformThenDescriptor:
   """Python descriptor dispatching `then` on the `Transform` class as either
   class or instance method."""
@@ -79,9 +236,22 @@ class Transform:
   def __call__(self, module: Module, fun_name: str):
     self.module = module
     self.fun_name = fun_name
-    PassManager.parse(self.pipeline).run(module)
+    run_pipeline(self.pipeline, module, type(self).__name__)
     return module
 
+  def fusible_pipelines(self) -> tp.Optional[tp.Sequence[str]]:
+    """Return the pipelines that are equivalent to calling the transform, or
+    None if the transform has Python-side effects and cannot be fused with
+    other pipelines."""
+    if type(self).__call__ is Transform.__call__ and hasattr(self, 'pipeline'):
+      return [self.pipeline]
+    return None
+
+  def has_python_side_effects(self) -> bool:
+    """Return True if calling the transform has effects other than transforming
+    the module, e.g., printing, in which case its result cannot be reused."""
+    return False
+
   def _parse_variables_in_kwargs(self, kwargs: tp.Mapping[str, tp.Any]):
     """Set up instance fields that correspond to known variables from kwargs.
 
@@ -133,6 +303,9 @@ class PrintIR(Transform):
     module.dump()
     return module
 
+  def has_python_side_effects(self) -> bool:
+    return True
+
 
 class PrintPipeline(Transform):
   """Print the pipeline of the transform.
@@ -150,6 +323,9 @@ class PrintPipeline(Transform):
             "'\n   ]]]")
     return module
 
+  def has_python_side_effects(self) -> bool:
+    return True
+
 
 class _TransformListThenDescriptor:
   """Python descriptor dispatching `then` on the `TransformationList` class as
@@ -177,13 +353,66 @@ class TransformationList:
   transforms: tp.Sequence[Transform]
   _transform_classes: tp.Optional[tp.Sequence[tp.Type[Transform]]] = None
   variables: tp.Mapping[str, tp.Type[Variable]] = dict()
+  # Run consecutive pipelines with a single PassManager, see `fuse_pipelines`.
+  # Transforms with Python-side effects act as barriers. None defers to the
+  # SANDBOX_FUSE_PIPELINES environment variable at each call.
+  fuse_pipelines_enabled: tp.Optional[bool] = None
 
   def __init__(self, transforms: tp.Sequence[Transform]):
     self.transforms = transforms
 
   def __call__(self, entry_point_name: str, module: Module):
+    if self._fuses_pipelines():
+      return self._call_fused(entry_point_name, module)
+    trie = active_compilation_trie()
+    if trie is not None:
+      return self._call_with_trie(entry_point_name, module, trie)
+    for transform in self.transforms:
+      with timed_compile_step(type(transform).__name__):
+        module = transform(module, entry_point_name)
+    return module
+
+  def _fuses_pipelines(self) -> bool:
+    if self.fuse_pipelines_enabled is not None:
+      return self.fuse_pipelines_enabled
+    return os.getenv('SANDBOX_FUSE_PIPELINES', '0') not in ('', '0')
+
+  def _call_with_trie(self, entry_point_name: str, module: Module,
+                      trie: CompilationTrie):
+    """Resume from the deepest snapshot of a prefix of the transforms and
+    snapshot the module after the following ones, except the last."""
+    keys = trie.prefix_keys(str(module), entry_point_name, self.transforms)
+    depth, snapshot = trie.longest_prefix(keys)
+    if snapshot is not None:
+      with timed_compile_step('compilation_trie_resume'):
+        module = Module.parse(snapshot)
+    for index in range(depth, len(self.transforms)):
+      transform = self.transforms[index]
+      with timed_compile_step(type(transform).__name__):
+        module = transform(module, entry_point_name)
+      if index < min(len(keys), len(self.transforms) - 1):
+        with timed_compile_step('compilation_trie_snapshot'):
+          trie.insert(keys[index], str(module))
+    return module
+
+  def _call_fused(self, entry_point_name: str, module: Module):
+    pending = []
+
+    def flush():
+      if pending:
+        with timed_compile_step('FusedPipeline'):
+          run_pipeline(fuse_pipelines(pending), module, 'FusedPipeline')
+        pending.clear()
+
     for transform in self.transforms:
-      module = transform(module, entry_point_name)
+      pipelines = transform.fusible_pipelines()
+      if pipelines is not None:
+        pending.extend(pipelines)
+        continue
+      flush()
+      with timed_compile_step(type(transform).__name__):
+        module = transform(module, entry_point_name)
+    flush()
     return module
 
   def __add__(
@@ -224,7 +453,7 @@ class TransformationList:
   then = _TransformListThenDescriptor()
 
 
-def _get_name_remapping(transform_classes: tp.Sequence[tp.Type[Transform]]):
+def get_name_remapping(transform_classes: tp.Sequence[tp.Type[Transform]]):
   """Given a list of Transform classes, create a list of mappings from unique
   suffixed names back to per-transformation variable names."""
   seen_names = dict()
@@ -271,7 +500,7 @@ class TransformListMetaclass(type):
       raise ValueError(
           "TransformList metaclass would override the list of variables.")
 
-    remappings = _get_name_remapping(transforms)
+    remappings = get_name_remapping(transforms)
     variables = dict()
     for transform, remapping in zip(transforms, remappings):
       variables.update(
@@ -0,0 +1,89 @@
+# RUN: %PYTHON %s 2>&1 | FileCheck %s
+
+# This file contains tests of the pipeline fusion of transformation lists.
+
+import os
+
+from ..core.experts import *
+from ..core.harness import *
+from ..core.transform import fuse_pipelines, split_pipeline
+from ..core.transforms import *
+
+from ..contraction.definitions import *
+
+
+def check_equal(actual, expected):
+  if actual != expected:
+    print(f'Expected {expected} but got {actual} -> FAILURE')
+
+
+def test_fuse_pipelines():
+  check_equal(split_pipeline('builtin.func(a{x=1,2},b),c{y="d,e"}, f'),
+              ['builtin.func(a{x=1,2},b)', 'c{y="d,e"}', 'f'])
+
+  # Consecutive function nests are merged.
+  check_equal(
+      fuse_pipelines(
+          ['builtin.func(tile,canonicalize,cse)', 'builtin.func(vectorize)']),
+      'builtin.func(tile,canonicalize,cse,vectorize)')
+
+  # Back-to-back cleanups are dropped.
+  check_equal(
+      fuse_pipelines([
+          'builtin.func(tile,canonicalize,cse)',
+          'builtin.func(canonicalize,cse,vectorize)'
+      ]), 'builtin.func(tile,canonicalize,cse,vectorize)')
+  check_equal(
+      fuse_pipelines(
+          ['bufferize,canonicalize,cse', 'builtin.func(canonicalize,cse)']),
+      'bufferize,canonicalize,cse')
+
+  # Module-level passes are barriers for function nests.
+  check_equal(
+      fuse_pipelines([
+          'builtin.func(tile)', 'bufferize,canonicalize,cse',
+          'builtin.func(lower)'
+      ]), 'builtin.func(tile),bufferize,canonicalize,cse,builtin.func(lower)')
+
+
+def test_fuse_pipelines_enabled():
+  fuse = os.environ.pop('SANDBOX_FUSE_PIPELINES', None)
+  expert = TransformationList(transforms=[Bufferize()])
+  check_equal(expert._fuses_pipelines(), False)
+  # The environment is read at each call, not when the module is imported.
+  os.environ['SANDBOX_FUSE_PIPELINES'] = '1'
+  check_equal(expert._fuses_pipelines(), True)
+  expert.fuse_pipelines_enabled = False
+  check_equal(expert._fuses_pipelines(), False)
+  if fuse is None:
+    del os.environ['SANDBOX_FUSE_PIPELINES']
+  else:
+    os.environ['SANDBOX_FUSE_PIPELINES'] = fuse
+
+
+# CHECK-NOT: FAILURE
+def main():
+  test_fuse_pipelines()
+  test_fuse_pipelines_enabled()
+
+  # Fused experts must compile and compute the same results.
+  for expert in [
+      LoweringOnlyExpert('matmul', 'linalg.generic'),
+      DoubleTilingExpert('matmul',
+                         'linalg.generic',
+                         tile_sizes1=[16, 16, 16],
+                         tile_sizes2=[4, 4, 4])
+  ]:
+    expert.fuse_pipelines_enabled = True
+    test_harness(lambda sizes, types: EinsumProblem('mk,kn', 'mnk', 2),
+                 [[np.float32] * 3], [{
+                     'm': 32,
+                     'n': 32,
+                     'k': 32
+                 }], [expert],
+                 n_iters=1,
+                 function_name='matmul')
+
+
+if __name__ == '__main__':
+  main()
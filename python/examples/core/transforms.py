@@ -2,7 +2,8 @@ from mlir.ir import *
 from mlir.passmanager import PassManager
 
 from .variables import *
-from .transform import Transform, TransformationList
+from .transform import Transform, TransformationList, run_pipeline, \
+    timed_compile_step
 
 import mlir.all_passes_registration
 
@@ -419,6 +420,7 @@ class LowerVectors(Transform):
 
     self._parse_variables_in_kwargs(kwargs)
 
+    self.stages = list(stages)
     pipelines = [
         (f'linalg-vector-lowering{{'
          f'    lower-vector-stage={stage}'
@@ -435,12 +437,20 @@ class LowerVectors(Transform):
     self.pipelines = [f'builtin.func({pipeline})' for pipeline in pipelines]
 
   def __call__(self, module: Module, fun_name: str):
-    for pipeline in self.pipelines:
-      PassManager.parse(pipeline).run(module)
+    for stage, pipeline in zip(self.stages, self.pipelines):
+      step = f'LowerVectors_stage{stage}'
+      with timed_compile_step(step):
+        run_pipeline(pipeline, module, step)
       if self.print_after_all:
         print(module)
     return module
 
+  def fusible_pipelines(self) -> tp.Optional[tp.Sequence[str]]:
+    return None if self.print_after_all else self.pipelines
+
+  def has_python_side_effects(self) -> bool:
+    return self.print_after_all
+
 
 class LowerToLLVM(Transform):
 
@@ -545,7 +555,7 @@ class ApplySchedule(Transform):
     pass
 
   def __call__(self, module: Module, **kwargs):
-    PassManager.parse('linalg-interp-transforms').run(module)
+    run_pipeline('linalg-interp-transforms', module, type(self).__name__)
     self.drop_schedule_from_module(module)
     return module
 
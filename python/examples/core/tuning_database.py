@@ -0,0 +1,209 @@
+"""Persistent SQLite database of tuning results.
+
+Tuning runs record every evaluated configuration along with the hardware it
+was measured on, so that later runs do not start from scratch: they are seeded
+with the best known configurations of the same problem for the same or the
+nearest problem sizes, and interrupted searches resume from the last
+checkpointed optimizer state.
+
+The database is configured with the following environment variables:
+  * SANDBOX_TUNING_DB: database file (default:
+    ~/.cache/iree-llvm-sandbox/tuning.db).
+  * SANDBOX_DISABLE_TUNING_DB: disable the database if set to a non-empty value
+    other than '0'.
+"""
+
+import hashlib
+import json
+import math
+import os
+import pickle
+import platform
+import sqlite3
+import time
+
+from typing import Any, List, Optional, Sequence, Tuple
+
+from .compilation_cache import get_llvm_version
+
+_DISABLE_TUNING_DB_ENV = "SANDBOX_DISABLE_TUNING_DB"
+_TUNING_DB_ENV = "SANDBOX_TUNING_DB"
+_TUNING_DB_DEFAULT = os.path.join("~", ".cache", "iree-llvm-sandbox",
+                                  "tuning.db")
+
+_CPUINFO_FILE = "/proc/cpuinfo"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+  id INTEGER PRIMARY KEY,
+  hardware TEXT NOT NULL,
+  problem TEXT NOT NULL,
+  sizes TEXT NOT NULL,
+  types TEXT NOT NULL,
+  configuration TEXT NOT NULL,
+  compile_time_s REAL,
+  quantiles TEXT,
+  throughput REAL,
+  failure TEXT,
+  timestamp REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS results_by_problem
+  ON results (hardware, problem, types);
+CREATE TABLE IF NOT EXISTS checkpoints (
+  run TEXT PRIMARY KEY,
+  optimizer BLOB NOT NULL,
+  timestamp REAL NOT NULL
+);
+"""
+
+
+def get_hardware_fingerprint() -> str:
+  """Return a description of the host the measurements depend on: the
+  architecture, the CPU model and features, the number of CPUs and the LLVM
+  version the kernels are compiled with."""
+  model, flags = platform.processor(), ""
+  try:
+    with open(_CPUINFO_FILE, "r") as f:
+      for line in f:
+        key, _, value = line.partition(":")
+        key = key.strip()
+        if key in ("model name", "Model", "CPU part") and not model:
+          model = value.strip()
+        elif key in ("flags", "Features") and not flags:
+          flags = " ".join(sorted(value.split()))
+  except OSError:
+    pass
+  # The feature list is long, it is only compared by hash.
+  flags_hash = hashlib.sha256(flags.encode()).hexdigest()[:16]
+  return (f"{platform.machine()}|{model}|{os.cpu_count()} cpus|"
+          f"features {flags_hash}|llvm {get_llvm_version()}")
+
+
+def size_distance(sizes: Sequence[int], other: Sequence[int]) -> float:
+  """Distance between problem sizes in log space, infinite if the number of
+  dimensions differ."""
+  if len(sizes) != len(other):
+    return math.inf
+  return math.sqrt(
+      sum((math.log2(max(a, 1)) - math.log2(max(b, 1)))**2
+          for a, b in zip(sizes, other)))
+
+
+class TuningDatabase:
+  """SQLite tables of the evaluated configurations and optimizer checkpoints.
+
+  Problems and types are identified by strings, sizes and configurations are
+  stored as JSON.
+  """
+
+  def __init__(self, path: str, hardware: Optional[str] = None):
+    self.path = os.path.expanduser(path)
+    if os.path.dirname(self.path):
+      os.makedirs(os.path.dirname(self.path), exist_ok=True)
+    self.hardware = hardware if hardware is not None else \
+        get_hardware_fingerprint()
+    self.connection = sqlite3.connect(self.path)
+    self.connection.executescript(_SCHEMA)
+
+  @staticmethod
+  def from_env() -> Optional['TuningDatabase']:
+    """Return the database configured by the environment or None if
+    disabled."""
+    if os.getenv(_DISABLE_TUNING_DB_ENV, "0") not in ("", "0"):
+      return None
+    return TuningDatabase(os.getenv(_TUNING_DB_ENV, _TUNING_DB_DEFAULT))
+
+  def record(self,
+             problem: str,
+             sizes: Sequence[int],
+             types: str,
+             configuration: Any,
+             compile_time_s: Optional[float] = None,
+             quantiles: Optional[Sequence[float]] = None,
+             throughput: Optional[float] = None,
+             failure: Optional[str] = None):
+    """Record the evaluation of `configuration`, `failure` describes why it
+    could not be measured."""
+    if quantiles is not None:
+      quantiles = json.dumps([float(q) for q in quantiles])
+    if throughput is not None:
+      throughput = float(throughput)
+    row = (self.hardware, problem, json.dumps(list(sizes)), types,
+           json.dumps(configuration), compile_time_s, quantiles, throughput,
+           failure, time.time())
+    with self.connection:
+      self.connection.execute(
+          "INSERT INTO results (hardware, problem, sizes, types, "
+          "configuration, compile_time_s, quantiles, throughput, failure, "
+          "timestamp) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+
+  def best_configurations(self, problem: str, sizes: Sequence[int], types: str,
+                          limit: int) -> List[Tuple[Any, float]]:
+    """Return up to `limit` distinct configurations with the best throughput
+    measured on this hardware for the same or the nearest problem sizes, with
+    their throughput, best first."""
+    rows = self.connection.execute(
+        "SELECT sizes, configuration, MAX(throughput) FROM results "
+        "WHERE hardware = ? AND problem = ? AND types = ? "
+        "AND throughput IS NOT NULL GROUP BY sizes, configuration",
+        (self.hardware, problem, types)).fetchall()
+    candidates = sorted((size_distance(sizes, json.loads(row_sizes)),
+                         -throughput, configuration)
+                        for row_sizes, configuration, throughput in rows)
+    best, seen = [], set()
+    for distance, negated_throughput, configuration in candidates:
+      if distance == math.inf or len(best) == limit:
+        break
+      if configuration in seen:
+        continue
+      seen.add(configuration)
+      best.append((json.loads(configuration), -negated_throughput))
+    return best
+
+  def measurements(self, problem: str,
+                   types: str) -> List[Tuple[List[int], Any, float]]:
+    """Return the sizes, configuration and throughput of every successful
+    evaluation of `problem` on this hardware."""
+    rows = self.connection.execute(
+        "SELECT sizes, configuration, throughput FROM results "
+        "WHERE hardware = ? AND problem = ? AND types = ? "
+        "AND throughput IS NOT NULL", (self.hardware, problem, types))
+    return [(json.loads(sizes), json.loads(configuration), throughput)
+            for sizes, configuration, throughput in rows]
+
+  def save_checkpoint(self, run: str, optimizer: Any):
+    """Checkpoint the state of the `optimizer` of `run`, see
+    `nevergrad.optimizers.base.Optimizer.dump`."""
+    with self.connection:
+      self.connection.execute(
+          "INSERT OR REPLACE INTO checkpoints (run, optimizer, timestamp) "
+          "VALUES (?, ?, ?)", (run, pickle.dumps(optimizer), time.time()))
+
+  def load_checkpoint(self, run: str) -> Optional[Any]:
+    """Return the last checkpointed optimizer of `run`, None if there is none
+    or it cannot be loaded."""
+    row = self.connection.execute(
+        "SELECT optimizer FROM checkpoints WHERE run = ?", (run,)).fetchone()
+    if row is None:
+      return None
+    try:
+      return pickle.loads(row[0])
+    except Exception as e:
+      print(f"Ignoring unreadable tuning checkpoint {run}: {e}")
+      return None
+
+  def delete_checkpoint(self, run: str):
+    """Delete the checkpoint of a completed `run`."""
+    with self.connection:
+      self.connection.execute("DELETE FROM checkpoints WHERE run = ?", (run,))
+
+  def run_key(self, problem: str, sizes: Sequence[int], types: str,
+              search_strategy: str, budget: int, seed: int) -> str:
+    """Return the identifier of the checkpoints of a tuning run."""
+    return json.dumps([
+        self.hardware, problem,
+        list(sizes), types, search_strategy, budget, seed
+    ])
+
+  def close(self):
+    self.connection.close()
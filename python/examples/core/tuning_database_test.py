@@ -0,0 +1,82 @@
+# RUN: %PYTHON %s 2>&1 | FileCheck %s
+
+# This file contains tests of the tuning database.
+
+import os
+import tempfile
+
+import nevergrad as ng
+
+from ..core.tuning_database import *
+
+problem, types = 'EinsumProblem.matmul', 'float32,float32,float32'
+
+
+def check_equal(actual, expected):
+  if actual != expected:
+    print(f'Expected {expected} but got {actual} -> FAILURE')
+
+
+def test_best_configurations(path: str):
+  database = TuningDatabase(path, hardware='host')
+  database.record(problem, [16, 16, 16], types, [4, 4, 1], throughput=10.0)
+  database.record(problem, [16, 16, 16], types, [8, 8, 1], throughput=30.0)
+  # Only the best measurement of a configuration counts.
+  database.record(problem, [16, 16, 16], types, [4, 4, 1], throughput=20.0)
+  database.record(problem, [16, 16, 16], types, [2, 2, 2], failure='timeout')
+  database.record(problem, [64, 64, 64], types, [16, 8, 1], throughput=50.0)
+  database.record(problem, [128, 128, 128], types, [32, 8, 1], throughput=90.0)
+  # Other problems, types, ranks and hardware are never seeds.
+  database.record('other', [16, 16, 16], types, [1, 1, 1], throughput=99.0)
+  database.record(problem, [16, 16, 16], 'float64', [1, 1, 1], throughput=99.0)
+  database.record(problem, [16, 16], types, [1, 1], throughput=99.0)
+  TuningDatabase(path, hardware='other').record(problem, [16, 16, 16],
+                                                types, [1, 1, 1],
+                                                throughput=99.0)
+
+  # The same size first, best first, then the nearest sizes.
+  check_equal(database.best_configurations(problem, [16, 16, 16], types, 10),
+              [([8, 8, 1], 30.0), ([4, 4, 1], 20.0), ([16, 8, 1], 50.0),
+               ([32, 8, 1], 90.0)])
+  check_equal(database.best_configurations(problem, [100, 100, 100], types, 2),
+              [([32, 8, 1], 90.0), ([16, 8, 1], 50.0)])
+  check_equal(
+      database.best_configurations(problem, [16, 16, 16, 16], types, 10), [])
+  check_equal(len(database.measurements(problem, types)), 6)
+  database.close()
+
+
+def test_checkpoints(path: str):
+  database = TuningDatabase(path, hardware='host')
+  run = database.run_key(problem, [16, 16, 16], types, 'RandomSearch', 10, 42)
+  check_equal(database.load_checkpoint(run), None)
+  optimizer = ng.optimizers.registry['RandomSearch'](
+      parametrization=ng.p.Instrumentation(
+          search_sizes=ng.p.Choice(list(range(33)), repetitions=3)),
+      budget=10)
+  for _ in range(3):
+    optimizer.tell(optimizer.ask(), 1.0)
+  database.save_checkpoint(run, optimizer)
+  database.close()
+
+  # A new connection resumes from the checkpoint.
+  database = TuningDatabase(path, hardware='host')
+  resumed = database.load_checkpoint(run)
+  if resumed is None or resumed.num_tell != 3:
+    print(f'Checkpoint of {run} not resumed -> FAILURE')
+  else:
+    resumed.tell(resumed.ask(), 1.0)
+  database.delete_checkpoint(run)
+  check_equal(database.load_checkpoint(run), None)
+  database.close()
+
+
+# CHECK-NOT: FAILURE
+def main():
+  with tempfile.TemporaryDirectory() as directory:
+    test_best_configurations(os.path.join(directory, 'tuning.db'))
+    test_checkpoints(os.path.join(directory, 'checkpoints.db'))
+
+
+if __name__ == '__main__':
+  main()
@@ -1,4 +1,7 @@
-from typing import Any, Callable, List, Mapping, Optional, Sequence, Type
+import hashlib
+import os
+from collections import OrderedDict
+from typing import Any, Callable, List, Mapping, Optional, Sequence, Tuple, Type
 
 import numpy as np
 
@@ -85,6 +88,46 @@ def register_2d_divisible_tile_sizes(problem_sizes: List[int]):
   ]
 
 
+################################################################################
+# Hardware utils.
+################################################################################
+
+CPU_CACHE_DIR = '/sys/devices/system/cpu/cpu0/cache'
+_DEFAULT_LAST_LEVEL_CACHE_BYTES = 32 * 1024 * 1024
+
+
+def parse_cache_size(size: str) -> int:
+  """Parse a sysfs cache size such as `32768K` into bytes."""
+  units = {'K': 1024, 'M': 1024 * 1024, 'G': 1024 * 1024 * 1024}
+  size = size.strip()
+  if size and size[-1] in units:
+    return int(size[:-1]) * units[size[-1]]
+  return int(size)
+
+
+def get_last_level_cache_bytes() -> int:
+  """Return the size of the highest-level data cache of the first CPU, or a
+  conservative default if sysfs does not describe the caches."""
+  best_level, best_bytes = 0, _DEFAULT_LAST_LEVEL_CACHE_BYTES
+  try:
+    for index in os.listdir(CPU_CACHE_DIR):
+      directory = os.path.join(CPU_CACHE_DIR, index)
+      if not index.startswith('index'):
+        continue
+      with open(os.path.join(directory, 'type')) as f:
+        if f.read().strip() == 'Instruction':
+          continue
+      with open(os.path.join(directory, 'level')) as f:
+        level = int(f.read())
+      with open(os.path.join(directory, 'size')) as f:
+        size = parse_cache_size(f.read())
+      if level > best_level:
+        best_level, best_bytes = level, size
+  except (OSError, ValueError):
+    pass
+  return best_bytes
+
+
 ################################################################################
 # NumPy utils.
 ################################################################################
@@ -120,6 +163,222 @@ def realign(allocated_unaligned: np.ndarray, byte_alignment: int = 64):
   return allocated_aligned
 
 
+def aligned_empty(shape: Sequence[int],
+                  dtype: np.dtype,
+                  byte_alignment: int = 64) -> np.ndarray:
+  """Allocate an uninitialized array whose data is aligned to
+  `byte_alignment`."""
+  effective_size_in_bytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+  buf = np.empty(effective_size_in_bytes + byte_alignment, dtype=np.byte)
+  off = (-buf.ctypes.data % byte_alignment)
+  allocated_aligned = buf[off:off +
+                          effective_size_in_bytes].view(dtype).reshape(shape)
+  assert allocated_aligned.ctypes.data % byte_alignment == 0
+  return allocated_aligned
+
+
+_RANDOM_FILL_CHUNK_SIZE = 1 << 20
+
+
+def fill_random(array: np.ndarray, rng: np.random.Generator):
+  """Fill `array` with uniform random values in [0, 1) cast to its elemental
+  type, without materializing intermediate float64 arrays."""
+  flat = array.reshape(-1)
+  if array.dtype in (np.float32, np.float64):
+    rng.random(dtype=array.dtype, out=flat)
+    return
+  # Other types are generated in bounded float32 chunks and cast.
+  for begin in range(0, flat.size, _RANDOM_FILL_CHUNK_SIZE):
+    end = min(begin + _RANDOM_FILL_CHUNK_SIZE, flat.size)
+    flat[begin:end] = rng.random(end - begin, dtype=np.float32)
+
+
+_TENSOR_POOL_MAX_BYTES_ENV = 'SANDBOX_TENSOR_POOL_MAX_BYTES'
+_TENSOR_POOL_MAX_BYTES_DEFAULT = 2 * 1024 * 1024 * 1024
+
+
+class TensorPool:
+  """Pool of aligned random input tensors.
+
+  Inputs are keyed by (shape, dtype, alignment, seed) and generated once, so
+  all experts and the NumPy/PyTorch baselines of a problem size run on the same
+  inputs. Pooled inputs are read-only, so that no expert or baseline changes the
+  inputs of the next one. Outputs, including operands that are both read and
+  written, are freshly allocated zero-filled tensors. The least recently used
+  inputs are released once the pool exceeds `max_bytes`.
+  """
+
+  def __init__(self, max_bytes: int = _TENSOR_POOL_MAX_BYTES_DEFAULT):
+    self.max_bytes = max_bytes
+    self.total_bytes = 0
+    self.inputs = OrderedDict()
+    # Keys of the pooled inputs by object id, used to identify the inputs a
+    # reference result was computed from.
+    self.keys_by_id = {}
+
+  def get_input(self,
+                shape: Sequence[int],
+                dtype: np.dtype,
+                byte_alignment: int = 64,
+                seed: int = 0) -> np.ndarray:
+    """Return the read-only random input tensor for the given key."""
+    key = (tuple(shape), np.dtype(dtype).str, byte_alignment, seed)
+    if key in self.inputs:
+      self.inputs.move_to_end(key)
+      return self.inputs[key]
+    tensor = aligned_empty(shape, dtype, byte_alignment)
+    fill_random(tensor, np.random.default_rng(seed))
+    tensor.flags.writeable = False
+    if tensor.nbytes <= self.max_bytes:
+      self.inputs[key] = tensor
+      self.keys_by_id[id(tensor)] = key
+      self.total_bytes += tensor.nbytes
+      while self.total_bytes > self.max_bytes:
+        _, evicted = self.inputs.popitem(last=False)
+        del self.keys_by_id[id(evicted)]
+        self.total_bytes -= evicted.nbytes
+    return tensor
+
+  def key_of(self, tensor: np.ndarray) -> Optional[tuple]:
+    """Return the key of a pooled input tensor, None if it is not pooled."""
+    key = self.keys_by_id.get(id(tensor))
+    if key is None or self.inputs.get(key) is not tensor:
+      return None
+    return key
+
+  def get_output(self,
+                 shape: Sequence[int],
+                 dtype: np.dtype,
+                 byte_alignment: int = 64) -> np.ndarray:
+    """Return a new zero-filled output tensor."""
+    tensor = aligned_empty(shape, dtype, byte_alignment)
+    tensor.fill(0)
+    return tensor
+
+  def build(self,
+            shapes: Sequence[Sequence[int]],
+            types: Sequence[np.dtype],
+            num_outputs: int = 1,
+            byte_alignment: int = 64) -> List[np.ndarray]:
+    """Return the tensors of a problem, the trailing `num_outputs` ones are
+    writable outputs and the others are read-only random inputs seeded by their
+    position."""
+    num_inputs = len(shapes) - num_outputs
+    return [
+        self.get_input(s, t, byte_alignment, seed=i)
+        if i < num_inputs else self.get_output(s, t, byte_alignment)
+        for i, (s, t) in enumerate(zip(shapes, types))
+    ]
+
+
+# Tensor pool shared by all problem definitions in the process.
+tensor_pool = TensorPool(
+    int(os.getenv(_TENSOR_POOL_MAX_BYTES_ENV, _TENSOR_POOL_MAX_BYTES_DEFAULT)))
+
+
+def sliding_windows(array: np.ndarray, window_dims: Sequence[int],
+                    window_sizes: Sequence[int], strides: Sequence[int],
+                    dilations: Sequence[int]) -> np.ndarray:
+  """Return a read-only im2col view of the sliding windows of `array`.
+
+  Each dimension in `window_dims` is replaced by the number of windows along
+  it, stepping by the stride, and one trailing dimension per window dimension
+  iterates within the window, stepping by the dilation. Contracting the view
+  with a kernel computes a convolution without copying the input.
+  """
+  shape, view_strides = list(array.shape), list(array.strides)
+  window_shape, window_strides = [], []
+  for dim, size, stride, dilation in zip(window_dims, window_sizes, strides,
+                                         dilations):
+    shape[dim] = (array.shape[dim] - (size - 1) * dilation - 1) // stride + 1
+    view_strides[dim] = array.strides[dim] * stride
+    window_shape.append(size)
+    window_strides.append(array.strides[dim] * dilation)
+  return np.lib.stride_tricks.as_strided(array,
+                                         shape=shape + window_shape,
+                                         strides=view_strides + window_strides,
+                                         writeable=False)
+
+
+_REFERENCE_CACHE_MAX_BYTES_ENV = 'SANDBOX_REFERENCE_CACHE_MAX_BYTES'
+_REFERENCE_CACHE_MAX_BYTES_DEFAULT = 1024 * 1024 * 1024
+_REFERENCE_CACHE_DIR_ENV = 'SANDBOX_REFERENCE_CACHE_DIR'
+
+
+class ReferenceCache:
+  """Cache of the reference results used to check the kernel outputs.
+
+  All experts of a problem size run on the same pooled inputs, so the reference
+  result only needs to be computed once. Results are keyed by a description of
+  the problem definition and by the pool keys (shape, type, alignment, seed) of
+  the inputs, kept in memory up to `max_bytes` and, if `directory` is set,
+  saved there as `.npy` files shared across runs.
+  """
+
+  def __init__(self,
+               max_bytes: int = _REFERENCE_CACHE_MAX_BYTES_DEFAULT,
+               directory: Optional[str] = None):
+    self.max_bytes = max_bytes
+    self.directory = os.path.expanduser(directory) if directory else None
+    self.total_bytes = 0
+    self.results = OrderedDict()
+    self.hits = 0
+    self.misses = 0
+
+  def key(self, problem_key: Any,
+          inputs: Sequence[np.ndarray]) -> Optional[str]:
+    """Return the cache key of a reference result, None if some input is not
+    pooled and the result is therefore not cacheable."""
+    input_keys = [tensor_pool.key_of(tensor) for tensor in inputs]
+    if any(k is None for k in input_keys):
+      return None
+    # The inputs are regenerated from their seeds by NumPy's generator.
+    description = repr((np.__version__, problem_key, input_keys))
+    return hashlib.sha256(description.encode()).hexdigest()
+
+  def get(self, problem_key: Any, inputs: Sequence[np.ndarray],
+          compute: Callable[[], np.ndarray]) -> np.ndarray:
+    """Return the reference result of the problem described by `problem_key`
+    on `inputs`, calling `compute` on a miss."""
+    key = self.key(problem_key, inputs)
+    if key is None:
+      return compute()
+    if key in self.results:
+      self.results.move_to_end(key)
+      self.hits += 1
+      return self.results[key]
+    file_name = os.path.join(self.directory, key +
+                             '.npy') if self.directory else None
+    if file_name and os.path.exists(file_name):
+      result = np.load(file_name)
+      self.hits += 1
+    else:
+      result = compute()
+      self.misses += 1
+      if file_name:
+        os.makedirs(self.directory, exist_ok=True)
+        # Publish atomically, a concurrent process may write the same result.
+        temp_file_name = f'{file_name}.{os.getpid()}.tmp.npy'
+        np.save(temp_file_name, result)
+        os.replace(temp_file_name, file_name)
+    result.flags.writeable = False
+    if result.nbytes <= self.max_bytes:
+      self.results[key] = result
+      self.total_bytes += result.nbytes
+      while self.total_bytes > self.max_bytes:
+        _, evicted = self.results.popitem(last=False)
+        self.total_bytes -= evicted.nbytes
+    return result
+
+
+# Reference cache shared by all problem definitions in the process.
+reference_cache = ReferenceCache(
+    int(
+        os.getenv(_REFERENCE_CACHE_MAX_BYTES_ENV,
+                  _REFERENCE_CACHE_MAX_BYTES_DEFAULT)),
+    os.getenv(_REFERENCE_CACHE_DIR_ENV))
+
+
 def compute_quantiles(measurements: Sequence[float]) -> Sequence[float]:
   n_iters = len(measurements)
   return [ \
@@ -133,3 +392,29 @@ def compute_quantiles(measurements: Sequence[float]) -> Sequence[float]:
       measurements[((n_iters * 99) // 100)],
       measurements[-1]
          ]
+
+
+_BOOTSTRAP_CHUNK_SIZE = 1 << 22
+
+
+def bootstrap_quantile_ci(samples: Sequence[float],
+                          quantile: float = 0.5,
+                          confidence: float = 0.95,
+                          n_resamples: int = 1000,
+                          seed: int = 0) -> Tuple[float, float]:
+  """Return the bootstrap confidence interval of the `quantile` of `samples`.
+
+  Resamples are drawn in bounded chunks so that large sample counts do not
+  materialize `n_resamples` copies of the samples at once.
+  """
+  samples = np.asarray(samples)
+  rng = np.random.default_rng(seed)
+  chunk_size = max(1, _BOOTSTRAP_CHUNK_SIZE // len(samples))
+  estimates = []
+  for begin in range(0, n_resamples, chunk_size):
+    num_resamples = min(chunk_size, n_resamples - begin)
+    indices = rng.integers(0, len(samples), [num_resamples, len(samples)])
+    estimates.append(np.quantile(samples[indices], quantile, axis=1))
+  alpha = (1.0 - confidence) / 2
+  low, high = np.quantile(np.concatenate(estimates), [alpha, 1.0 - alpha])
+  return low, high
@@ -1,9 +1,23 @@
 """Utilities for search space exploration over linalg operations."""
 
+import abc
+import itertools
+import random
 import typing as tp
 
+# Variables that are debugging options or only valid in specific
+# configurations. Search keeps them at their default values.
+untuned_variable_names = ('print_after_all', 'scalarize_dyn_dims')
 
-class Variable:
+
+def _lengths(variable, problem_sizes: tp.Optional[tp.Sequence[int]]):
+  'Returns the vector lengths of a variable with one element per loop.'
+  if problem_sizes is not None:
+    return [len(problem_sizes)]
+  return list(variable.length_range)
+
+
+class Variable(abc.ABC):
   'Abstract class used as a base for all search variables.'
 
   def __init__(self, name):
@@ -14,6 +28,22 @@ class Variable:
 
     assignments[self.name] = value
 
+  @abc.abstractmethod
+  def enumerate(self,
+                problem_sizes: tp.Optional[tp.Sequence[int]] = None) -> tp.List:
+    'Returns all values of the variable, bounded by the loop sizes if given.'
+
+  def cardinality(self,
+                  problem_sizes: tp.Optional[tp.Sequence[int]] = None) -> int:
+    'Returns the number of values of the variable.'
+    return len(self.enumerate(problem_sizes))
+
+  def sample(self,
+             rng: random.Random,
+             problem_sizes: tp.Optional[tp.Sequence[int]] = None):
+    'Returns a value of the variable drawn uniformly at random.'
+    return rng.choice(self.enumerate(problem_sizes))
+
 
 class TypeVariable(Variable):
   'Linalg operation-specific type variable that defines a scalar component.'
@@ -22,6 +52,9 @@ class TypeVariable(Variable):
     Variable.__init__(self, name)
     self.scalar_types = scalar_types
 
+  def enumerate(self, problem_sizes=None):
+    return list(self.scalar_types)
+
   def __repr__(self):
     return f'TypeVariable({self.name})'
 
@@ -33,6 +66,9 @@ class IntVariable(Variable):
     Variable.__init__(self, name)
     self.value_range = value_range
 
+  def enumerate(self, problem_sizes=None):
+    return list(self.value_range)
+
   def __repr__(self):
     return f'IntVariable({self.name}, {self.value_range})'
 
@@ -40,6 +76,9 @@ class IntVariable(Variable):
 class BoolVariable(Variable):
   'Boolean flag variable.'
 
+  def enumerate(self, problem_sizes=None):
+    return [False, True]
+
   def __repr__(self):
     return f'BoolVariable({self.name})'
 
@@ -68,6 +107,53 @@ class TilingSizesVariable(Variable):
     else:
       self.value_range = value_ranges['default']
 
+  def element_values(self,
+                     size: tp.Optional[int] = None,
+                     divisors_only: bool = False) -> tp.List[int]:
+    """Returns the tile sizes of a loop of the given size, 0 meaning untiled.
+
+    Tile sizes are bounded by the loop size, and divide it if `divisors_only`.
+    """
+    return [
+        v for v in self.value_range
+        if size is None or v == 0 or (v <= size and
+                                      (not divisors_only or size % v == 0))
+    ]
+
+  def _element_values_per_length(self, problem_sizes, divisors_only):
+    return [[
+        self.element_values(
+            problem_sizes[i] if problem_sizes is not None else None,
+            divisors_only) for i in range(length)
+    ] for length in _lengths(self, problem_sizes)]
+
+  def enumerate(self, problem_sizes=None, divisors_only=False):
+    return [
+        list(sizes)
+        for values in self._element_values_per_length(problem_sizes,
+                                                      divisors_only)
+        for sizes in itertools.product(*values)
+    ]
+
+  def cardinality(self, problem_sizes=None, divisors_only=False):
+    count = 0
+    for values in self._element_values_per_length(problem_sizes, divisors_only):
+      length_count = 1
+      for element_values in values:
+        length_count *= len(element_values)
+      count += length_count
+    return count
+
+  def sample(self, rng, problem_sizes=None, divisors_only=False):
+    # Every vector is equally likely, without enumerating them.
+    values = self._element_values_per_length(problem_sizes, divisors_only)
+    counts = [1] * len(values)
+    for i, length_values in enumerate(values):
+      for element_values in length_values:
+        counts[i] *= len(element_values)
+    length_values = rng.choices(values, weights=counts)[0]
+    return [rng.choice(element_values) for element_values in length_values]
+
   def __repr__(self):
     return f'TilingSizesVariable({self.name}, {self.length_range}, {self.value_range})'
 
@@ -82,6 +168,13 @@ class InterchangeVariable(Variable):
     else:
       self.length_range = length_ranges['default']
 
+  def enumerate(self, problem_sizes=None):
+    return [
+        list(permutation)
+        for length in _lengths(self, problem_sizes)
+        for permutation in itertools.permutations(range(length))
+    ]
+
   def __repr__(self):
     return f'InterchangeVariable({self.name}, {self.length_range})'
 
@@ -96,6 +189,15 @@ class PeelingVariable(Variable):
     else:
       self.length_range = length_ranges['default']
 
+  def enumerate(self, problem_sizes=None):
+    'Returns the subsets of the loops.'
+    return [
+        list(loops)
+        for length in _lengths(self, problem_sizes)
+        for n in range(length + 1)
+        for loops in itertools.combinations(range(length), n)
+    ]
+
   def __repr__(self):
     return f'PeelingVariable({self.name}, {self.length_range})'
 
@@ -110,6 +212,14 @@ class PackPaddingVariable(Variable):
     else:
       self.length_range = length_ranges['default']
 
+  def enumerate(self, problem_sizes=None):
+    'Returns the packing flags of the operands, the lengths are operand counts.'
+    return [
+        list(flags)
+        for length in self.length_range
+        for flags in itertools.product([0, 1], repeat=length)
+    ]
+
   def __repr__(self):
     return f'PackPaddingVariable({self.name}, {self.length_range})'
 
@@ -128,6 +238,18 @@ class HoistPaddingVariable(IntVariable):
     else:
       self.value_range = value_ranges['default']
 
+  def enumerate(self, problem_sizes=None):
+    'Returns the hoisting depths of the operands, bounded by the loop count.'
+    depths = [
+        v for v in self.value_range
+        if problem_sizes is None or v <= len(problem_sizes)
+    ]
+    return [
+        list(d)
+        for length in self.length_range
+        for d in itertools.product(depths, repeat=length)
+    ]
+
   def __repr__(self):
     return f'HoistPaddingVariable({self.name}, {self.length_range}, {self.value_range})'
 
@@ -146,6 +268,14 @@ class TransposePaddingVariable(InterchangeVariable):
     else:
       self.value_range = value_ranges['default']
 
+  def enumerate(self, problem_sizes=None):
+    'Returns the operand permutations, the values are the operand ranks.'
+    ranks = list(self.value_range)
+    return [[
+        list(p) for p in permutations
+    ] for length in self.length_range for permutations in itertools.product(
+        *[itertools.permutations(range(rank)) for rank in ranks[:length]])]
+
   def __repr__(self):
     return f'TransposePaddingVariable({self.name}, {self.length_range}, {self.value_range})'
 
@@ -158,5 +288,8 @@ class ChoiceVariableBase(Variable):
   """
   options: tp.Sequence
 
+  def enumerate(self, problem_sizes=None):
+    return list(self.options)
+
   def __repr__(self):
     return f'{self.__class__.__name__}({self.name}, {self.options})'
@@ -1,4 +1,4 @@
-import os, itertools
+import os
 
 from typing import Any, List, Mapping, Optional, Sequence, Tuple, Union
 
@@ -264,98 +264,63 @@ class DepthwiseConvolutionProblem(ProblemDefinition):
                          types: Sequence[np.dtype]) -> List[np.dtype]:
     """Returns random NumPy suitable for calling the kernel."""
     shapes = self.shapes_builder(sizes)
-    tensors = [
-        realign(np.random.rand(*s).astype(t), byte_alignment=64)
-        for s, t in zip(shapes, types)
-    ]
+    tensors = tensor_pool.build(shapes, types, byte_alignment=64)
     # Uncomment to simplify debugging.
     # tensors = [
     #     realign(np.arange(1, np.prod(s) + 1).reshape(s).astype(t), \
     #             byte_alignment=64) \
     #     for s, t in zip(shapes, types)
     # ]
-    tensors[-1].fill(0.)
     return tensors
 
-  def reference_np(self, I: np.dtype, K: np.dtype, O: np.dtype):
-    """Reference numpy implementation, used for checking and benchmarking 
-    against.
-
-    Given the list of NumPy arrays, computes the expected result and compares it
-    with the actual result. Raises ValueError on mismatch.
+  def __output_format(self) -> str:
+    """Returns the output format, following the rules of the output shape."""
+    input_rank_dims_start, input_rank_dims_end = find_contiguous_rank_dims(
+        self.__input_format)
+    kernel_rank_dims_start, kernel_rank_dims_end = find_contiguous_rank_dims(
+        self.__kernel_format)
+    return (self.__input_format[:input_rank_dims_start] +
+            self.__kernel_format[:kernel_rank_dims_start].replace("C", "") +
+            self.__input_format[input_rank_dims_start:input_rank_dims_end] +
+            self.__input_format[input_rank_dims_end:] +
+            self.__kernel_format[kernel_rank_dims_end:].replace("C", ""))
+
+  def __reference(self, I: np.dtype, K: np.dtype) -> np.dtype:
+    """Computes the convolution of I and K.
+
+    Takes an im2col view of the input, with one extra dimension per kernel
+    rank-related dimension, and contracts it with the kernel in a single einsum.
+    There is no BLAS-friendly contraction, so the einsum is not optimized.
+    For example, for the NHWC, HWC convolution, the computation is
+      O[n, h, w, c] = sum(I[n, h * SH + kh * DH, w * SW + kw * DW, c] *
+                          K[kh, kw, c]) over kh, kw.
     """
-
     input_rank_dims_start, input_rank_dims_end = find_contiguous_rank_dims(
         self.__input_format)
     kernel_rank_dims_start, kernel_rank_dims_end = find_contiguous_rank_dims(
         self.__kernel_format)
+    windows = sliding_windows(
+        I, range(input_rank_dims_start, input_rank_dims_end),
+        K.shape[kernel_rank_dims_start:kernel_rank_dims_end], self.__strides,
+        self.__dilations)
+
+    # Output rank-related dimensions are named by the uppercase characters of
+    # the formats and kernel ones by their lowercase counterparts.
+    input_rank_format = self.__input_format[
+        input_rank_dims_start:input_rank_dims_end]
+    windows_format = self.__input_format + input_rank_format.lower()
+    kernel_format = "".join(char.lower() if char in RANK_RELATED_DIMS else char
+                            for char in self.__kernel_format)
+    equation = f"{windows_format},{kernel_format}->{self.__output_format()}"
+    return np.einsum(equation, windows, K)
 
-    # Compute the output rank-related dimensions by doing the computation
-    # inverse to that of shape_builder. An alternative would be to extract them
-    # from the shape of O but that requires knowing their position in the list.
-    input_rank_dims = I.shape[input_rank_dims_start:input_rank_dims_end]
-    kernel_rank_dims = K.shape[kernel_rank_dims_start:kernel_rank_dims_end]
-    # Shape relations on rank-related dimensions:
-    #      iw = [(ow - 1) * sw + 1] + [(kw - 1) * dw + 1] - 1
-    #   => iw = [(ow - 1) * sw] + [(kw - 1) * dw] + 1
-    #    => ow = [iw - (kw - 1) * dw - 1] / sw + 1
-    iw = np.array(input_rank_dims)
-    kw = np.array(kernel_rank_dims)
-    dw = np.array(self.__dilations)
-    sw = np.array(self.__strides)
-    ones = np.ones(iw.shape, dtype=int)
-    output_rank_dims = tuple((iw - (kw - ones) * dw - ones) // sw + 1)
-    input_parallel_dim = self.__input_format[::-1].index("N")
-    kernel_parallel_dim = self.__kernel_format[::-1].index("C")
-
-    # Compute the convolution by taking (overlapping) output-sized slices of the
-    # input that start at 0,1,...,KH, 0,1,...KW offsets, computing their
-    # tensordot-product with the corresponding slices of the kernel, and
-    # accumulating the result by addition. For example, for the NHWC, HWC
-    # convolution, the computation is
-    #   O += I[:, kh:kh+H, kw:kw+W, :] . K[kh, kw, :] for kh in 0..KH,
-    #                                                 for kw in 0..KW.
-    # with H and W dimensions being reduced by tensordot and N, C remaining.
-    for ks in itertools.product(*map(range, kernel_rank_dims)):
-      input_slices = []
-      ranked_pos = 0
-      for char in self.__input_format:
-        if char in RANK_RELATED_DIMS:
-          # slice(a,b) is just a flexible form of a:b.
-          input_slices.append(
-              slice(
-                  self.__dilations[ranked_pos] * ks[ranked_pos],
-                  self.__dilations[ranked_pos] * ks[ranked_pos] +
-                  output_rank_dims[ranked_pos]))
-          ranked_pos += 1
-        else:
-          input_slices.append(slice(None))
-      slice_input = I[tuple(input_slices)]
-
-      input_strides = []
-      ranked_pos = 0
-      for i, char in enumerate(self.__input_format):
-        if char in RANK_RELATED_DIMS:
-          input_strides.append( \
-              slice_input.strides[i] * self.__strides[ranked_pos])
-          ranked_pos += 1
-        else:
-          input_strides.append(slice_input.strides[i])
-      slice_input.strides = input_strides
-
-      kernel_slices = []
-      ranked_pos = 0
-      for char in self.__kernel_format:
-        if char in RANK_RELATED_DIMS:
-          kernel_slices.append(ks[ranked_pos])
-          ranked_pos += 1
-        else:
-          kernel_slices.append(slice(None))
-      slice_kernel = K[tuple(kernel_slices)]
+  def reference_np(self, I: np.dtype, K: np.dtype, O: np.dtype):
+    """Reference numpy implementation, used for checking and benchmarking 
+    against.
 
-      # Starting from: O(n, w, c) += I(n, w + kw, c) * K(kw, c)
-      # Unrolling on KW just gives O(n, w, c) += I(n, w, c) * K(c)
-      O += slice_input * slice_kernel
+    Accumulates the convolution of I and K into O.
+    """
+    O += self.__reference(I, K)
 
   # TODO: Here we have "I(N, H, W, C), K(H, W, C) O(N, H, W, C)" layout but
   # Pytorch wants "I(N, C, H, W), K(C, 1, H, W) O(N, C, H, W)".
@@ -394,8 +359,10 @@ class DepthwiseConvolutionProblem(ProblemDefinition):
     with the actual result. Raises ValueError on mismatch.
     """
 
-    reference_O = np.zeros(O.shape)
-    self.reference_np(I, K, reference_O)
+    reference_O = reference_cache.get(
+        ("depthwise_conv", self.__input_format, self.__kernel_format,
+         tuple(self.__strides), tuple(self.__dilations)), [I, K],
+        lambda: self.__reference(I, K))
 
     if not np.allclose(O, reference_O):
       delta = O - reference_O
@@ -68,17 +68,13 @@ class MatmulProblem(ProblemDefinition):
     shapes given by `shape_builder` and specified elemental types.
     """
     shapes = self.shapes_builder(sizes)
-    tensors = [
-        realign(np.random.rand(*s).astype(t), byte_alignment=64)
-        for s, t in zip(shapes, types)
-    ]
+    tensors = tensor_pool.build(shapes, types, byte_alignment=64)
     # Uncomment to simplify debugging.
     # tensors = [
     #     realign(np.arange(1, np.prod(s) + 1).reshape(s).astype(t), \
     #             byte_alignment=64) \
     #     for s, t in zip(shapes, np_types)
     # ]
-    tensors[len(tensors) - 1].fill(0.)
     return tensors
 
   def check_np(self, A: np.dtype, B: np.dtype, C: np.dtype) -> None:
@@ -87,8 +83,9 @@ class MatmulProblem(ProblemDefinition):
     Given a list of NumPy values, check the precomputed results matches those of
     the expected reference implementation.
     """
-    if not np.allclose(C, np.dot(A, B)):
-      delta = C - np.dot(A, B)
+    reference_C = reference_cache.get(("dot",), [A, B], lambda: np.dot(A, B))
+    if not np.allclose(C, reference_C):
+      delta = C - reference_C
       max_abs_delta = max(delta.max(), delta.min(), key=abs)
       raise Exception(f"max_abs_delta: {max_abs_delta} -> FAILURE ")
 
@@ -94,9 +94,7 @@ class Padded_Conv1d_NWC_WCF_Problem(ProblemDefinition):
     stride, dilation = sizes["stride"], sizes["dilation"]
     self.ensure_stride_and_dilation(stride, dilation)
     shapes = self.shapes_builder(sizes)
-    tensors = [np.random.rand(*s).astype(t) for s, t in zip(shapes, types)]
-    tensors[len(tensors) - 1].fill(0.)
-    return tensors
+    return tensor_pool.build(shapes, types)
 
   def check_np(self, I: np.dtype, K: np.dtype, O: np.dtype) -> None:
     """NumPy checking function.
@@ -104,30 +102,16 @@ class Padded_Conv1d_NWC_WCF_Problem(ProblemDefinition):
     Given a list of NumPy values, check the precomputed results matches those of
     the expected reference implementation.
     """
-    # TODO: lift to __init__.
-    N, W, F = np.shape(O)[0], np.shape(O)[1], np.shape(O)[2]
-    KW, C = np.shape(K)[0], np.shape(K)[1]
-    I2 = np.pad(I, ((0, 0), (self.WpadL, self.WpadR), (0, 0)), 'constant')
-
-    O2 = np.copy(O)
-    O2.fill(0.)
-
-    for kw in range(KW):
-      # N, in(W), C => N, in(W), C red
-      # Only take a W slice, we'll scale the stride separately.
-      slice_input = I2[ \
-          :, \
-          self.dilation * kw : self.dilation * kw + W, \
-          :  \
-      ]
-      slice_input.strides = [ \
-        slice_input.strides[0], \
-        slice_input.strides[1] * self.stride, \
-        slice_input.strides[2] \
-      ]
-      # KW, C, F -> C red, F
-      slice_filter = K[kw, :, :]
-      O2 = O2 + np.tensordot(slice_input, slice_filter, axes=([2], [0]))
+
+    def reference():
+      I2 = np.pad(I, ((0, 0), (self.WpadL, self.WpadR), (0, 0)), 'constant')
+      # N, in(W), C => N, W, C, KW windows, reduced with KW, C, F over KW, C.
+      windows = sliding_windows(I2, [1], [np.shape(K)[0]], [self.stride],
+                                [self.dilation])[:, :np.shape(O)[1]]
+      return np.einsum('nwck,kcf->nwf', windows, K, optimize=True)
+
+    O2 = reference_cache.get(('padded_conv1d_nwc_wcf', self.WpadL, self.WpadR,
+                              self.stride, self.dilation), [I, K], reference)
 
     if not np.allclose(O, O2):
       delta = O - O2
@@ -1,17 +1,26 @@
-from argparse import ArgumentParser
-import multiprocessing as mp
+from argparse import ArgumentParser, Namespace
+from collections import defaultdict
+import functools
+import math
 import nevergrad as ng
 import numpy as np
+import os
+import time
 
 import mlir.iree_sandbox as sandbox
 import mlir.ir as ir
 import mlir.dialects.pdl as pdl
 import mlir.dialects.linalg_transform as transform
 
+from ..core.analytical_model import double_tiling_seeds, register_tile_seeds
+from ..core.compilation_cache import CompilationCache
+from ..core.cost_model import *
 from ..core.experts import *
 from ..core.harness import *
 from ..core.nevergrad_tuner_utils import *
+from ..core.result_memo import ResultMemo
 from ..core.transforms import *
+from ..core.tuning_database import TuningDatabase
 from ..core.utils import *
 
 from ..contraction.definitions import EinsumProblem
@@ -21,6 +30,7 @@ from ..contraction.definitions import EinsumProblem
 ################################################################################
 
 keys = ['m', 'n', 'k']
+np_types = [np.float32] * 3
 
 # CHECK-NOT: FAILURE
 
@@ -36,6 +46,10 @@ class NGScheduler:
 
     self.problem_definition = problem_definition
     self.problem_sizes = problem_sizes
+    # Identifiers of the problem in the tuning database.
+    self.problem_name = \
+        f'{type(problem_definition).__name__}.{self.fun_to_benchmark_name}'
+    self.types_name = ','.join(np.dtype(t).name for t in np_types)
 
     # Init nevergrad's instrumentation.
     # TODO: better parametrization, for now this is enough to get a prototype.
@@ -46,21 +60,76 @@ class NGScheduler:
         search_sizes=self.register_tile_sizes)
     self.optimizer = None
 
-  def set_optimizer(self, search_strategy: str, budget: int):
-
-    def constraints_fun(proposal):
-      return dispatch_size_constraints_conjunction_satisfied( \
-        self.problem_sizes, proposal, self.search_keyword)
+  def set_optimizer(self,
+                    search_strategy: str,
+                    budget: int,
+                    num_workers: int = 1):
+    # The constraint must pickle for the optimizer to be checkpointed.
+    constraints_fun = functools.partial(
+        dispatch_size_constraints_conjunction_satisfied,
+        self.problem_sizes,
+        keyword=self.search_keyword)
 
     self.search_strategy = search_strategy
     self.optimizer = ng.optimizers.registry[self.search_strategy](
-        parametrization=self.instrumentation, budget=budget)
+        parametrization=self.instrumentation,
+        budget=budget,
+        num_workers=num_workers)
     self.optimizer.parametrization.register_cheap_constraint(constraints_fun)
+    # Number of evaluations told at the last checkpoint.
+    self.num_tell_at_checkpoint = 0
+    # Number of suggested configurations that were not asked yet.
+    self.num_pending_suggestions = 0
 
   # Unwrap the np.array from NG's ask() kwargs.
   def extract_search_sizes_from_proposal(self, proposal):
     return [x for x in proposal.kwargs[self.search_keyword]]
 
+  # Return the configuration of a proposal as plain Python values, which are
+  # sent to the workers and recorded in the tuning database.
+  def configuration(self, proposal):
+    return [int(x) for x in self.extract_search_sizes_from_proposal(proposal)]
+
+  # Suggest `configuration` as the next candidate of the optimizer. Return False
+  # if it violates our constraints or is out of the search space of this run.
+  def suggest(self, configuration) -> bool:
+    if not size_constraints_conjunction_satisfied(self.problem_sizes,
+                                                  configuration):
+      return False
+    try:
+      self.optimizer.suggest(**{self.search_keyword: configuration})
+    except ValueError:
+      return False
+    self.num_pending_suggestions += 1
+    return True
+
+  # Return the configurations derived from the analytical model of the host.
+  def analytical_seeds(self) -> List:
+    element_bytes = np.dtype(np_types[0]).itemsize
+    return register_tile_seeds(self.problem_sizes, element_bytes=element_bytes)
+
+  # Compile the schedule of `search_sizes` into `problem`.
+  def compile(self,
+              problem: ProblemInstance,
+              search_sizes: Sequence[int],
+              dump_ir_to_file: str = ''):
+
+    # Construct the schedule and save the module in case we need to replay
+    # later.
+    def schedule_and_save(module):
+      self.schedule_search_sizes(module, search_sizes)
+      # TODO: save and report on error.
+
+    problem.compile_with_schedule_builder(
+        entry_point_name=self.entry_point_name,
+        fun_to_benchmark_name=self.fun_to_benchmark_name,
+        compile_time_problem_sizes_dict={
+            k: v for k, v in zip(keys, self.problem_sizes)
+        },
+        schedule_builder=schedule_and_save,
+        dump_ir_to_file=dump_ir_to_file,
+        context=worker_context)
+
   # Optimizer may want to override our constraints set.
   def validate_proposal(self, proposal):
     if not size_constraints_conjunction_satisfied(
@@ -86,16 +155,17 @@ class NGScheduler:
 
   # TODO: more advanced schedules, atm we just TileAndVectorize.
   def schedule(self, module, proposal, benefit: int = 1):
-    search_sizes = self.extract_search_sizes_from_proposal(proposal)
+    self.schedule_search_sizes(
+        module, self.extract_search_sizes_from_proposal(proposal), benefit)
 
+  def schedule_search_sizes(self,
+                            module,
+                            search_sizes: Sequence[int],
+                            benefit: int = 1):
     print(f'Problem sizes: {self.problem_sizes}')
     print(f'Register tile sizes: {search_sizes}')
 
-    # TODO: this is necessary to force-load the dialect, otherwise op creation
-    # complains about "unregistered dialect" despite the registration called.
-    register_sandbox_passes_and_dialects(module.context)
-    module.context.dialects["linalg_transform"]
-
+    # The context of `module` is registered by `sandbox_context`.
     nnz = np.count_nonzero(search_sizes)
     peel = [x for x in range(nnz)]
     peel = []  # TODO: enable peeling once handles are fixed.
@@ -120,47 +190,445 @@ class NGScheduler:
                               proposal,
                               module_save_filename,
                               benefit: int = 1):
-    with ir.Context() as ctx, ir.Location.unknown() as loc:
+    with sandbox_context() as ctx, ir.Location.unknown() as loc:
       module = Module.create()
       self.schedule(module, proposal, benefit)
       self.save_module(module, module_save_filename)
 
 
-# Entry point to try compile and run while catching and reporting exceptions.
-# This can run in interruptible multiprocess mode.
-# ipc_dict must be provided, and it is used to return information across the
-# root/children process boundary:
-#   - 'throughputs': the measured throughputs.
-#   - 'success': the return status.
-def compile_and_run_checked_mp(problem: ProblemInstance, scheduler: NGScheduler,
-                               proposal, n_iters: int, ipc_dict: dict):
-  try:
-    # Construct the schedule and save the module in case we need to replay later.
-    def schedule_and_save(module):
-      scheduler.schedule(module, proposal)
-      # TODO: save and report on error.
+# Experts whose variables `--expert` tunes.
+tunable_experts = {
+    'SingleTilingExpert': SingleTilingExpert,
+    'DoubleTilingExpert': DoubleTilingExpert,
+    'TripleTilingExpert': TripleTilingExpert,
+}
 
-    problem.compile_with_schedule_builder(
-        entry_point_name=scheduler.entry_point_name,
-        fun_to_benchmark_name=scheduler.fun_to_benchmark_name,
-        compile_time_problem_sizes_dict={
-            k: v for k, v in zip(keys, scheduler.problem_sizes)
-        },
-        schedule_builder=schedule_and_save)
 
-    throughputs = problem.run(
-        n_iters=n_iters,
-        entry_point_name=scheduler.entry_point_name,
-        runtime_problem_sizes_dict=problem.compile_time_problem_sizes_dict)
+# Scheduler searching the variables of an expert rather than register tile
+# sizes, see `ExpertSearchSpace`. Configurations are the keyword arguments of
+# the expert, which compiles the problem instead of a transform dialect
+# schedule.
+class ExpertScheduler(NGScheduler):
 
-    ipc_dict['result'] = IPCState(success=True, throughputs=throughputs)
-  except Exception as e:
-    # TODO: save to replay errors.
-    print(e)
-    ipc_dict['result'] = IPCState(success=False, throughputs=None)
+  def __init__(self, problem_definition: ProblemDefinition,
+               problem_sizes: Sequence[int], expert_name: str):
+    NGScheduler.__init__(self, problem_definition, problem_sizes)
+    self.op_name = 'linalg.generic'
+    self.expert_name = expert_name
+    # The configurations of different experts are not comparable.
+    self.problem_name += f'.{expert_name}'
+    self.search_space = ExpertSearchSpace(tunable_experts[expert_name],
+                                          problem_sizes,
+                                          num_operands=len(np_types))
+    self.search_keyword = None
+    self.instrumentation = self.search_space.instrumentation
+
+  def set_optimizer(self,
+                    search_strategy: str,
+                    budget: int,
+                    num_workers: int = 1):
+    # The constraints are registered on the instrumentation.
+    self.search_strategy = search_strategy
+    self.optimizer = ng.optimizers.registry[self.search_strategy](
+        parametrization=self.instrumentation,
+        budget=budget,
+        num_workers=num_workers)
+    self.num_tell_at_checkpoint = 0
+    self.num_pending_suggestions = 0
 
+  def configuration(self, proposal):
+    return self.search_space.expert_kwargs(proposal)
 
-def bulk_synchronous_optim_loop(parsed_args):
+  def validate_proposal(self, proposal):
+    return self.search_space.is_valid(self.configuration(proposal))
+
+  def suggest(self, configuration) -> bool:
+    if not self.search_space.suggest(self.optimizer, configuration):
+      return False
+    self.num_pending_suggestions += 1
+    return True
+
+  def analytical_seeds(self) -> List:
+    # Only the double tiling maps to the BLIS cache and register blocking.
+    if self.expert_name != 'DoubleTilingExpert':
+      return []
+    element_bytes = np.dtype(np_types[0]).itemsize
+    return double_tiling_seeds(self.problem_sizes, element_bytes=element_bytes)
+
+  def compile(self,
+              problem: ProblemInstance,
+              configuration: Mapping[str, Any],
+              dump_ir_to_file: str = ''):
+    print(f'Problem sizes: {self.problem_sizes}')
+    print(f'{self.expert_name}: {configuration}')
+    problem.compile(entry_point_name=self.entry_point_name,
+                    fun_to_benchmark_name=self.fun_to_benchmark_name,
+                    compile_time_problem_sizes_dict={
+                        k: v for k, v in zip(keys, self.problem_sizes)
+                    },
+                    transform=tunable_experts[self.expert_name](
+                        self.fun_to_benchmark_name, self.op_name,
+                        **configuration),
+                    dump_ir_to_file=dump_ir_to_file,
+                    context=worker_context)
+
+  def save_proposal_as_module(self,
+                              proposal,
+                              module_save_filename,
+                              benefit: int = 1):
+    problem = ProblemInstance(self.problem_definition, np_types)
+    self.compile(problem, self.configuration(proposal), module_save_filename)
+    print(f'Module saved in {module_save_filename}')
+
+
+# Return the scheduler of a problem size, searching the variables of
+# `--expert` if given and register tile sizes otherwise.
+def make_scheduler(problem_definition: ProblemDefinition,
+                   problem_sizes: Sequence[int], parsed_args) -> NGScheduler:
+  if parsed_args.expert is not None:
+    return ExpertScheduler(problem_definition, problem_sizes,
+                           parsed_args.expert)
+  return NGScheduler(problem_definition=problem_definition,
+                     problem_sizes=problem_sizes)
+
+
+# Compile the `configuration` of `scheduler` into `problem` and return the
+# canonical hash of the lowered module. With the compilation cache enabled, the
+# object code is stored and later compilations of the same schedule load it.
+def compile_schedule(problem: ProblemInstance, scheduler: NGScheduler,
+                     configuration) -> str:
+  scheduler.compile(problem, configuration)
+  return problem.lowered_module_hash()
+
+
+# Run the compiled `problem` for `n_iters` and return its throughputs.
+def run_compiled(problem: ProblemInstance, scheduler: NGScheduler,
+                 n_iters: int):
+  return problem.run(
+      n_iters=n_iters,
+      entry_point_name=scheduler.entry_point_name,
+      runtime_problem_sizes_dict=problem.compile_time_problem_sizes_dict)
+
+
+# Compile and run the schedule of `search_sizes` and return an IPCState with:
+#   - 'throughputs': the measured throughputs.
+#   - 'module_hash': the canonical hash of the lowered module.
+# Modules whose hash is in `measured_module_hashes` are not run again.
+def compile_and_run(problem: ProblemInstance, scheduler: NGScheduler,
+                    search_sizes: Sequence[int], n_iters: int,
+                    measured_module_hashes: AbstractSet[str]) -> IPCState:
+  module_hash = compile_schedule(problem, scheduler, search_sizes)
+  if module_hash in measured_module_hashes:
+    return IPCState(success=True, throughputs=None, module_hash=module_hash)
+
+  return IPCState(success=True,
+                  throughputs=run_compiled(problem, scheduler, n_iters),
+                  module_hash=module_hash)
+
+
+# Context of the evaluation workers, in which their tasks compile. None in the
+# root process, whose compilations create their own context.
+worker_context = None
+
+
+# Initializer of the evaluation workers: register the sandbox dialects and
+# passes once per worker rather than for every candidate it evaluates. The MLIR
+# modules are already imported by the root process the workers fork from. The
+# context outlives the compiled modules, the workers are recycled according to
+# `--worker-max-tasks` and `--worker-max-rss-mb` to bound its growth.
+def warm_up_worker():
+  global worker_context
+  worker_context = sandbox_context()
+
+
+# Return the keyword arguments of the WorkerPools evaluating candidates: warm
+# workers recycled according to `--worker-max-tasks` and `--worker-max-rss-mb`.
+def worker_pool_options(parsed_args) -> dict:
+  return dict(initializer=warm_up_worker,
+              max_tasks_per_worker=parsed_args.worker_max_tasks or None,
+              max_rss_mb=parsed_args.worker_max_rss_mb or None)
+
+
+# Return the throughput of a measurement that is told to the optimizer: the
+# throughput @75% (i.e. 5th computed quantile) of the measured metric.
+def throughput_of(measured_throughputs, parsed_args) -> float:
+  return compute_quantiles(
+      measured_throughputs[parsed_args.metric_to_measure])[5]
+
+
+# Tell the optimizer the cost of `proposal` given the IPCState of its
+# evaluation, and return the measured throughput or None on failure.
+# Proposals lowering to an already measured module reuse its measurements.
+# The evaluation is recorded in `database`, if any, with its compile time and
+# the reason of its `failure`.
+def tell_result(scheduler: NGScheduler,
+                result_memo: ResultMemo,
+                proposal,
+                ipc_state: IPCState,
+                parsed_args,
+                database: Optional[TuningDatabase] = None,
+                compile_time_s: Optional[float] = None,
+                failure: str = 'failed') -> Optional[float]:
+  configuration = scheduler.configuration(proposal)
+  if not ipc_state.success:
+    scheduler.optimizer.tell(proposal, 1e9)
+    if database is not None:
+      database.record(scheduler.problem_name,
+                      scheduler.problem_sizes,
+                      scheduler.types_name,
+                      configuration,
+                      compile_time_s=compile_time_s,
+                      failure=failure)
+    return None
+
+  memoized = result_memo.lookup(ipc_state.module_hash)
+  if memoized is not None:
+    duplicate_of, measured_throughputs = memoized
+    print(f'Configuration {configuration} duplicate of '
+          f'{duplicate_of}: same lowered module, reusing its '
+          f'measurements')
+  else:
+    measured_throughputs = ipc_state.throughputs
+    result_memo.insert(ipc_state.module_hash, str(configuration),
+                       measured_throughputs)
+  process_throughputs = measured_throughputs[parsed_args.metric_to_measure]
+  # Calculate the relative distance to peak: invert the throughput @75%
+  # (i.e. 5th computed quantile).
+  # Lower is better.
+  quantiles = compute_quantiles(process_throughputs)
+  throughput = quantiles[5]
+  relative_error = \
+    (parsed_args.machine_peak - throughput) / parsed_args.machine_peak
+  scheduler.optimizer.tell(proposal, relative_error)
+  if database is not None:
+    database.record(scheduler.problem_name,
+                    scheduler.problem_sizes,
+                    scheduler.types_name,
+                    configuration,
+                    compile_time_s=compile_time_s,
+                    quantiles=quantiles,
+                    throughput=throughput)
+  return throughput
+
+
+# Set the optimizer of `search_strategy`. With a `database`, the optimizer
+# resumes from the checkpoint of an interrupted run with the same arguments or,
+# without checkpoint, is seeded with the best known configurations of the same
+# or the nearest problem sizes. The optimizer may be asked `num_candidates`
+# proposals per evaluation, see `ProposalRanker`. Return the key of the
+# checkpoints of the run, None without database.
+def init_optimizer(scheduler: NGScheduler,
+                   database: Optional[TuningDatabase],
+                   search_strategy: str,
+                   parsed_args,
+                   num_workers: int = 1,
+                   seeds: Sequence[Sequence[int]] = (),
+                   num_candidates: int = 1) -> Optional[str]:
+  budget = parsed_args.search_budget * num_candidates
+  scheduler.set_optimizer(search_strategy, budget, num_workers)
+  if database is None:
+    if parsed_args.analytical_seeding:
+      suggest_analytical_seeds(scheduler)
+    suggest_transferred_seeds(scheduler, seeds)
+    return None
+  run = database.run_key(scheduler.problem_name, scheduler.problem_sizes,
+                         scheduler.types_name, search_strategy, budget,
+                         parsed_args.random_seed)
+  optimizer = database.load_checkpoint(run)
+  if optimizer is not None:
+    scheduler.optimizer = optimizer
+    scheduler.num_tell_at_checkpoint = optimizer.num_tell
+    print(f'Resuming {search_strategy} from its checkpoint after '
+          f'{optimizer.num_tell} evaluations')
+    return run
+  num_seeds = 0
+  for configuration, throughput in database.best_configurations(
+      scheduler.problem_name, scheduler.problem_sizes, scheduler.types_name,
+      parsed_args.warm_start):
+    if not scheduler.suggest(configuration):
+      continue
+    print(f'Warm start with {configuration}: {throughput} GUnits/s')
+    num_seeds += 1
+  if num_seeds > 0:
+    print(f'Warm start with {num_seeds} known configurations')
+  # Suggested last to be asked first.
+  if parsed_args.analytical_seeding:
+    suggest_analytical_seeds(scheduler)
+  suggest_transferred_seeds(scheduler, seeds)
+  return run
+
+
+# Suggest the configurations derived from the analytical model of the host as
+# the first candidates of a new run.
+def suggest_analytical_seeds(scheduler: NGScheduler):
+  for configuration in scheduler.analytical_seeds():
+    if scheduler.suggest(configuration):
+      print(f'Analytical seed {configuration}')
+
+
+# Suggest the register tile sizes transferred from other problem sizes, the
+# first `seeds` are asked first.
+def suggest_transferred_seeds(scheduler: NGScheduler,
+                              seeds: Sequence[Sequence[int]]):
+  for search_sizes in reversed(seeds):
+    if scheduler.suggest(search_sizes):
+      print(f'Transferred register tile sizes {search_sizes}')
+
+
+# Return the distinct configurations of `measured` (configuration, throughput)
+# pairs with their last measured throughput, best first. Later measurements of
+# successive halving run more iterations than earlier ones.
+def best_measurements(
+    measured: Sequence[Tuple[Any, float]]) -> List[Tuple[Any, float]]:
+  last = {
+      str(configuration): (configuration, throughput)
+      for configuration, throughput in measured
+  }
+  return sorted(last.values(), key=lambda result: -result[1])
+
+
+# Checkpoint the optimizer of `run` every `checkpoint_every` evaluations.
+def maybe_checkpoint(scheduler: NGScheduler, database: Optional[TuningDatabase],
+                     run: Optional[str], parsed_args):
+  if database is None or parsed_args.checkpoint_every <= 0:
+    return
+  num_tell = scheduler.optimizer.num_tell
+  if num_tell - scheduler.num_tell_at_checkpoint >= \
+      parsed_args.checkpoint_every:
+    database.save_checkpoint(run, scheduler.optimizer)
+    scheduler.num_tell_at_checkpoint = num_tell
+
+
+def save_recommendation(scheduler: NGScheduler, throughputs: Sequence[float],
+                        parsed_args):
+  # TODO: better handling of result saving, aggregation etc etc.
+  final_module_filename = None
+  if parsed_args.output_dir is not None:
+    final_module_filename = f'{parsed_args.output_dir}/module.mlir'
+  else:
+    final_module_filename = '/tmp/module.mlir'
+
+  recommendation = scheduler.optimizer.recommend()
+  # TODO: extract info from final recommendation instead of an auxiliary `throughputs` list
+  throughputs = sorted(throughputs)
+  best = int(throughputs[-1])
+  print(f'Best solution: {best} GUnits/s')
+  scheduler.save_proposal_as_module(proposal=recommendation,
+                                    module_save_filename=final_module_filename,
+                                    benefit=best)
+
+
+# Tune the single size of `parsed_args.problem_sizes_list`, the `seeds` search
+# sizes are asked first. Return the measured search sizes and their throughput,
+# best first.
+def bulk_synchronous_optim_loop(parsed_args,
+                                seeds: Sequence[Sequence[int]] = ()):
+  # Init random seed for reproducibility.
+  np.random.seed(parsed_args.random_seed)
+
+  assert len(
+      parsed_args.problem_sizes_list) == 1, 'Single problem size supported atm'
+
+  problem_definition = EinsumProblem('mk,kn', 'mnk', 2)
+  # Create a schedule builder for fixed sizes.
+  scheduler = make_scheduler(problem_definition,
+                             parsed_args.problem_sizes_list[0], parsed_args)
+
+  # Workers are forked with the scheduler, tasks only carry the search sizes
+  # and the hashes of the measured modules.
+  def evaluate_task(search_sizes: Sequence[int],
+                    measured_module_hashes: AbstractSet[str]) -> IPCState:
+    problem = ProblemInstance(problem_definition, np_types)
+    return compile_and_run(problem, scheduler, search_sizes,
+                           parsed_args.n_iters, measured_module_hashes)
+
+  # Proposals lowering to the same module are measured once.
+  result_memo = ResultMemo()
+  database = TuningDatabase.from_env()
+  measured = []
+  with WorkerPool(parsed_args.num_compilation_processes, evaluate_task,
+                  parsed_args.timeout_per_compilation,
+                  **worker_pool_options(parsed_args)) as pool:
+    for search_strategy in parsed_args.search_strategy:
+      run = init_optimizer(scheduler, database, search_strategy, parsed_args, 1,
+                           seeds)
+
+      # TODO: extract info from final recommendation instead of an auxiliary `throughputs` list
+      throughputs = []
+      for _ in range(scheduler.optimizer.num_tell, parsed_args.search_budget,
+                     parsed_args.num_compilation_processes):
+        print(f'\n***********************************************')
+        print(
+            f'{search_strategy} optimization iter {_}/{parsed_args.search_budget}'
+        )
+
+        # 1. Submit `num_compilation_processes` compile and "first-run" tasks to
+        # the warm workers. Proposals are paired with their task id, None if not
+        # evaluated.
+        round_tasks = []
+        measured_module_hashes = frozenset(result_memo.results.keys())
+        for _ in range(parsed_args.num_compilation_processes):
+          proposal = scheduler.optimizer.ask()
+
+          # The optimizer may chose to ignore our constraints.
+          # Override this, do not evaluate and give it max cost.
+          if not scheduler.validate_proposal(proposal):
+            round_tasks.append((proposal, None))
+            continue
+
+          search_sizes = scheduler.configuration(proposal)
+          round_tasks.append(
+              (proposal, pool.submit(search_sizes, measured_module_hashes)))
+
+        # 2. Wait for all the tasks of the round. Crashed and timed out tasks
+        # replace their worker.
+        results = dict()
+        while pool.num_running() > 0:
+          for result in pool.wait():
+            results[result.task_id] = result
+
+        # 3. Inspect the IPCStates.
+        # This is the result of a noisy run but it is cheap to evaluate.
+        for proposal, task_id in round_tasks:
+          ipc_state = IPCState(success=False, throughputs=None)
+          failure = 'invalid'
+          if task_id is not None:
+            result = results[task_id]
+            if result.status == 'success':
+              ipc_state = result.value
+            else:
+              # TODO: save to replay errors.
+              failure = f'{result.status}: {result.value}'
+              print(f'{failure}: {proposal.kwargs}')
+          throughput = tell_result(scheduler, result_memo, proposal, ipc_state,
+                                   parsed_args, database, None, failure)
+          # TODO: extract info from final recommendation instead of an auxiliary `throughputs` list
+          if throughput is not None:
+            throughputs.append(throughput)
+            measured.append((scheduler.configuration(proposal), throughput))
+        maybe_checkpoint(scheduler, database, run, parsed_args)
+
+      print(f'{search_strategy}: replaced workers {pool.stats()}')
+      if database is not None:
+        database.delete_checkpoint(run)
+      if throughputs:
+        save_recommendation(scheduler, throughputs, parsed_args)
+  return best_measurements(measured)
+
+
+# Asynchronous optimization loop pipelining compilation and measurement:
+#   - a persistent pool of `num_compilation_processes` workers compiles the
+#     proposals into the compilation cache, a new proposal is asked as soon as
+#     a worker is idle,
+#   - a single measurement worker pinned to `benchmark_cpu` loads the compiled
+#     kernels from the cache and times them one at a time.
+# Kernels are never timed concurrently with each other nor on the cores running
+# the compilations, the measurement quality does not depend on the compilation
+# parallelism. Proposals lowering to an already measured module are told
+# without being measured again.
+# Like `bulk_synchronous_optim_loop`, tune a single size and return the measured
+# search sizes and their throughput, best first.
+def async_optim_loop(parsed_args, seeds: Sequence[Sequence[int]] = ()):
   # Init random seed for reproducibility.
   np.random.seed(parsed_args.random_seed)
 
@@ -169,100 +637,271 @@ def bulk_synchronous_optim_loop(parsed_args):
 
   problem_definition = EinsumProblem('mk,kn', 'mnk', 2)
   # Create a schedule builder for fixed sizes.
-  scheduler = NGScheduler(\
-    problem_definition = problem_definition,
-    problem_sizes = parsed_args.problem_sizes_list[0])
-
-  manager = mp.Manager()
-  for search_strategy in parsed_args.search_strategy:
-    scheduler.set_optimizer(search_strategy, parsed_args.search_budget)
-
-    # TODO: extract info from final recommendation instead of an auxiliary `throughputs` list
-    throughputs = []
-    for _ in range(0, parsed_args.search_budget,
-                   parsed_args.num_compilation_processes):
-      print(f'\n***********************************************')
-      print(
-          f'{search_strategy} optimization iter {_}/{parsed_args.search_budget}'
-      )
-
-      # 1. Launch `num_compilation_processes` compilation and "first-run" processes.
-      ng_executions = []
-
-      for _ in range(parsed_args.num_compilation_processes):
-        proposal = scheduler.optimizer.ask()
-
-        # Create problem instance, which holds the compiled module and the
-        # ExecutionEngine.
-        problem_instance = ProblemInstance(problem_definition, [np.float32] * 3)
-
-        # The optimizer may chose to ignore our constraints.
-        # Override this, do not evaluate and give it max cost.
-        if not scheduler.validate_proposal(proposal):
-          ng_executions.append(
-              NGMPExecution(proposal=proposal,
-                            problem_instances=None,
-                            process=None,
-                            ipc_state=None))
-          continue
-
-        # Start process that compiles and runs.
-        ipc_dict = manager.dict()
-        p = mp.Process(target=compile_and_run_checked_mp,
-                       args=[
-                           problem_instance, scheduler, proposal,
-                           parsed_args.n_iters, ipc_dict
-                       ])
-        p.start()
-        # Append NGMPExecution. After synchronization results will be available
-        # in ipc_dict['result'].
-        ng_executions.append(
-            NGMPExecution(proposal=proposal,
-                          problem_instance=problem_instance,
-                          process=p,
-                          ipc_dict=ipc_dict))
-
-      # 2. Join all processes.
-      join_bulk_synchronous_processes(ng_executions,
-                                      parsed_args.timeout_per_compilation)
-
-      # 3. Inspect the ipc_state.
-      # This is the result of a noisy run but it is cheap to evaluate.
-      for ng_mp_execution in ng_executions:
-        ipc_state = ng_mp_execution.future_ipc_state()
-
-        if not ipc_state.success:
-          scheduler.optimizer.tell(ng_mp_execution.proposal, 1e9)
-          continue
-
-        process_throughputs = ipc_state.throughputs[
-            parsed_args.metric_to_measure]
-        # Calculate the relative distance to peak: invert the throughput @75%
-        # (i.e. 5th computed quantile).
-        # Lower is better.
-        throughput = compute_quantiles(process_throughputs)[5]
-        relative_error = \
-          (parsed_args.machine_peak - throughput) / parsed_args.machine_peak
-        scheduler.optimizer.tell(ng_mp_execution.proposal, relative_error)
-        # TODO: extract info from final recommendation instead of an auxiliary `throughputs` list
-        throughputs.append(throughput)
-
-    # TODO: better handling of result saving, aggregation etc etc.
-    final_module_filename = None
-    if parsed_args.output_dir is not None:
-      final_module_filename = f'{parsed_args.output_dir}/module.mlir'
-    else:
-      final_module_filename = '/tmp/module.mlir'
-
-    recommendation = scheduler.optimizer.recommend()
-    # TODO: extract info from final recommendation instead of an auxiliary `throughputs` list
-    throughputs.sort()
-    best = int(throughputs[-1])
-    print(f'Best solution: {best} GUnits/s')
-    scheduler.save_proposal_as_module(
-        proposal=recommendation,
-        module_save_filename=final_module_filename,
-        benefit=best)
+  scheduler = make_scheduler(problem_definition,
+                             parsed_args.problem_sizes_list[0], parsed_args)
+
+  cpus = os.sched_getaffinity(0)
+  benchmark_cpu = parsed_args.benchmark_cpu
+  if benchmark_cpu is None:
+    benchmark_cpu = max(cpus)
+  compile_cpus = cpus - {benchmark_cpu}
+  if CompilationCache.from_env() is None:
+    print('Pipelined tuning loads the compiled kernels from the compilation '
+          'cache, which is disabled: the measurement worker compiles again')
+  # Keep the root process, which asks and tells, off the benchmarking core.
+  if compile_cpus:
+    os.sched_setaffinity(0, compile_cpus)
+  try:
+
+    # Workers are forked with the scheduler, tasks only carry the search sizes.
+    def compile_task(search_sizes: Sequence[int]) -> str:
+      problem = ProblemInstance(problem_definition, np_types)
+      return compile_schedule(problem, scheduler, search_sizes)
+
+    # Measure `n_iters` iterations and return the status of the measurement, the
+    # throughputs and the number of iterations run. A probe of `probe_iters`
+    # iterations first abandons candidates whose fastest iteration cannot beat
+    # the `incumbent` throughput, see `SuccessiveHalving.probe`.
+    def measure_task(search_sizes: Sequence[int], n_iters: int,
+                     probe_iters: int, incumbent: Optional[float]):
+      problem = ProblemInstance(problem_definition, np_types)
+      # Loads the object code stored by the compilation worker.
+      compile_schedule(problem, scheduler, search_sizes)
+      num_iters = 0
+      if probe_iters > 0:
+        probe = run_compiled(problem, scheduler, probe_iters)
+        num_iters += probe_iters
+        if abandon_after_probe(probe[parsed_args.metric_to_measure], incumbent):
+          return 'abandoned', probe, num_iters
+      return 'measured', run_compiled(problem, scheduler,
+                                      n_iters), num_iters + n_iters
+
+    # Proposals lowering to the same module are measured once.
+    result_memo = ResultMemo()
+    database = TuningDatabase.from_env()
+    cost_model = cost_model_from_name(parsed_args.cost_model)
+    num_workers = parsed_args.num_compilation_processes
+    measured = []
+    with WorkerPool(num_workers, compile_task,
+                    parsed_args.timeout_per_compilation, compile_cpus,
+                    **worker_pool_options(parsed_args)) as compile_pool, \
+        WorkerPool(1, measure_task, parsed_args.timeout_per_evaluation,
+                   {benchmark_cpu},
+                   **worker_pool_options(parsed_args)) as measure_pool:
+      for search_strategy in parsed_args.search_strategy:
+        # Proposals are compiling, waiting for or under measurement.
+        # Only the best predicted of `cost_model_candidates` proposals compiles.
+        num_candidates = 1 if cost_model is None else \
+            parsed_args.cost_model_candidates
+        run = init_optimizer(scheduler, database, search_strategy, parsed_args,
+                             2 * num_workers + 1, seeds, num_candidates)
+        ranker = ProposalRanker(scheduler, cost_model, database)
+        # Without successive halving, all measurements run `n_iters` iterations.
+        halving = None
+        rung_iters = [parsed_args.n_iters]
+        if parsed_args.min_iters is not None:
+          halving = SuccessiveHalving(parsed_args.min_iters,
+                                      parsed_args.n_iters,
+                                      parsed_args.halving_rate)
+          rung_iters = halving.rung_iters
+          print(f'Successive halving over rungs of {rung_iters} iterations')
+        # Measured candidates that may be promoted, by proposal uid.
+        candidates = dict()
+        benchmark_iters, benchmark_s = 0, 0.0
+        num_promotions, num_abandoned = 0, 0
+        throughputs = []
+        # Proposals and search sizes of the running compilation tasks.
+        compiling = dict()
+        # Proposals, search sizes, module hashes and compile times of the
+        # compiled proposals waiting for the measurement worker.
+        compiled = []
+        # Compiled proposals of the running measurement tasks and their rung.
+        measuring = dict()
+        # Proposals compiled or invalid. A resumed run only compiles its
+        # remaining budget.
+        num_proposed, num_completed = scheduler.optimizer.num_tell, 0
+        failures = defaultdict(int)
+        start = time.time()
+
+        def complete(proposal,
+                     ipc_state: IPCState,
+                     compile_time_s: Optional[float] = None,
+                     failure: str = 'failed'):
+          nonlocal num_completed
+          num_completed += 1
+          throughput = tell_result(scheduler, result_memo, proposal, ipc_state,
+                                   parsed_args, database, compile_time_s,
+                                   failure)
+          if throughput is not None:
+            throughputs.append(throughput)
+            measured.append((scheduler.configuration(proposal), throughput))
+            ranker.add_measurement(proposal, throughput)
+          maybe_checkpoint(scheduler, database, run, parsed_args)
+          elapsed_min = max(time.time() - start, 1e-6) / 60
+          print(f'{search_strategy} evaluation {num_completed}/'
+                f'{parsed_args.search_budget}: '
+                f'{num_completed / elapsed_min:.1f} evaluations/min')
+          return throughput
+
+        def measure(entry: tuple, rung: int):
+          nonlocal num_promotions
+          if rung > 0:
+            num_promotions += 1
+          probe_iters, incumbent = halving.probe(rung) \
+              if halving is not None else (0, None)
+          task_id = measure_pool.submit(entry[1], rung_iters[rung], probe_iters,
+                                        incumbent)
+          measuring[task_id] = (entry, rung)
+
+        while True:
+          # 1. Keep all compilation workers busy, unless the measurement worker
+          # lags behind.
+          while compile_pool.num_idle() > 0 and len(compiled) < num_workers and \
+              num_proposed < parsed_args.search_budget and \
+              not ranker.is_exhausted():
+            proposal = ranker.ask(num_candidates)
+            num_proposed += 1
+            if proposal is None:
+              failures['invalid'] += 1
+              continue
+            search_sizes = scheduler.configuration(proposal)
+            compiling[compile_pool.submit(search_sizes)] = (proposal,
+                                                            search_sizes)
+
+          # 2. Promote the best candidates of a rung to longer measurements, tell
+          # the compiled proposals lowering to an already measured module and
+          # measure the first one whose module is not under measurement.
+          if halving is not None and measure_pool.num_idle() > 0:
+            promotion = halving.promotion()
+            if promotion is not None:
+              uid, rung = promotion
+              measure(candidates[uid], rung)
+          measuring_hashes = {entry[2] for entry, _ in measuring.values()}
+          for entry in list(compiled):
+            proposal, search_sizes, module_hash, compile_time_s = entry
+            if module_hash in result_memo.results:
+              compiled.remove(entry)
+              complete(
+                  proposal,
+                  IPCState(success=True,
+                           throughputs=None,
+                           module_hash=module_hash), compile_time_s)
+            elif measure_pool.num_idle() > 0 and \
+                module_hash not in measuring_hashes:
+              compiled.remove(entry)
+              measure(entry, 0)
+              measuring_hashes.add(module_hash)
+          if not compiling and not measuring:
+            if (num_proposed >= parsed_args.search_budget or
+                ranker.is_exhausted()) and not compiled:
+              break
+            continue
+
+          # 3. Collect the results as soon as they arrive.
+          compile_results, measure_results = wait_any(
+              [compile_pool, measure_pool])
+          for result in compile_results:
+            proposal, search_sizes = compiling.pop(result.task_id)
+            if result.status == 'success':
+              compiled.append(
+                  (proposal, search_sizes, result.value, result.elapsed_s))
+              continue
+            failures['compilation ' + result.status] += 1
+            failure = f'compilation {result.status}: {result.value}'
+            print(f'{failure}: {proposal.kwargs}')
+            complete(proposal, IPCState(success=False, throughputs=None),
+                     result.elapsed_s, failure)
+          for result in measure_results:
+            entry, rung = measuring.pop(result.task_id)
+            proposal, search_sizes, module_hash, compile_time_s = entry
+            if result.status != 'success':
+              failures['measurement ' + result.status] += 1
+              failure = f'measurement {result.status}: {result.value}'
+              print(f'{failure}: {proposal.kwargs}')
+              # Only the first measurement of a proposal is told.
+              if rung == 0:
+                complete(proposal, IPCState(success=False, throughputs=None),
+                         compile_time_s, failure)
+              continue
+            status, measured_throughputs, num_iters = result.value
+            benchmark_iters += num_iters
+            benchmark_s += result.elapsed_s
+            if rung == 0:
+              throughput = complete(
+                  proposal,
+                  IPCState(success=True,
+                           throughputs=measured_throughputs,
+                           module_hash=module_hash), compile_time_s)
+            else:
+              throughput = throughput_of(measured_throughputs, parsed_args)
+              throughputs.append(throughput)
+              measured.append((search_sizes, throughput))
+              print(f'Rung {rung} with {rung_iters[rung]} iterations: register '
+                    f'tile sizes {search_sizes}: {throughput} GUnits/s')
+            if status == 'abandoned':
+              num_abandoned += 1
+              print(f'Abandoned register tile sizes {search_sizes} after '
+                    f'{num_iters} iterations: slower than the incumbent')
+            if halving is not None:
+              halving.report(proposal.uid, rung, throughput,
+                             status == 'measured')
+              candidates[proposal.uid] = entry
+
+        elapsed_min = max(time.time() - start, 1e-6) / 60
+        print(f'\n{search_strategy}: {num_completed} evaluations in '
+              f'{60 * elapsed_min:.1f}s with {num_workers} compilation workers '
+              f'and measurements pinned to CPU {benchmark_cpu}, '
+              f'{dict(failures)} failures')
+        print(f'Throughput: {num_completed / elapsed_min:.1f} evaluations/min')
+        print(f'Replaced compilation workers {compile_pool.stats()}, '
+              f'measurement workers {measure_pool.stats()}')
+        print(f'Benchmarking: {benchmark_iters} iterations in '
+              f'{benchmark_s:.1f}s, {num_promotions} promotions, '
+              f'{num_abandoned} abandoned')
+        if halving is not None and halving.best() is not None:
+          uid, throughput = halving.best()
+          print(f'Best of the highest rung: register tile sizes '
+                f'{candidates[uid][1]}: {throughput} GUnits/s')
+        ranker.report()
+        if database is not None:
+          database.delete_checkpoint(run)
+        if throughputs:
+          save_recommendation(scheduler, throughputs, parsed_args)
+    return best_measurements(measured)
+  finally:
+    # Multi-size tuning runs this loop once per size.
+    os.sched_setaffinity(0, cpus)
+
+
+# Tune every size of `parsed_args.problem_sizes_list` with a budget growing with
+# the square root of the number of sizes, see `multi_size_budgets`. Sizes are
+# tuned in order of proximity, each one starting from the best configurations of
+# the nearest tuned sizes. Print the best configuration of every size.
+def multi_size_optim_loop(parsed_args):
+  problem_sizes_list = multi_size_order(parsed_args.problem_sizes_list)
+  budgets = multi_size_budgets(parsed_args.search_budget,
+                               len(problem_sizes_list))
+  print(f'Tuning {len(problem_sizes_list)} problem sizes with {sum(budgets)} '
+        f'evaluations, {parsed_args.search_budget} per size when tuned alone')
+  optim_loop = bulk_synchronous_optim_loop \
+      if parsed_args.tuning_loop == 'bulk_synchronous' else async_optim_loop
+  tuned = dict()
+  for problem_sizes, budget in zip(problem_sizes_list, budgets):
+    print(f'\n###############################################')
+    print(f'Problem sizes {problem_sizes}: {budget} evaluations')
+    size_args = Namespace(**vars(parsed_args))
+    size_args.problem_sizes_list = [problem_sizes]
+    size_args.search_budget = budget
+    seeds = transfer_configurations(problem_sizes, tuned, parsed_args.transfer)
+    tuned[tuple(problem_sizes)] = optim_loop(size_args, seeds)
+
+  print(f'\n{"problem sizes":>20} {"register tile sizes":>20} '
+        f'{"GUnits/s":>10}')
+  for problem_sizes in parsed_args.problem_sizes_list:
+    results = tuned[tuple(problem_sizes)]
+    search_sizes, throughput = results[0] if results else ('-', math.nan)
+    print(f'{str(problem_sizes):>20} {str(search_sizes):>20} '
+          f'{throughput:>10.2f}')
 
 
 def main():
@@ -271,7 +910,25 @@ def main():
   add_argparser_arguments(argparser, default_problem_sizes_list=[[16, 16, 16]])
   add_argparser_tuning_arguments(argparser)
   parsed_args = argparser.parse_args()
-  bulk_synchronous_optim_loop(parsed_args=parsed_args)
+  # The bulk synchronous loop measures every candidate with `n_iters`
+  # iterations and compiles every proposal.
+  if parsed_args.tuning_loop == 'bulk_synchronous' and \
+      (parsed_args.min_iters is not None or parsed_args.cost_model != 'none'):
+    argparser.error('--min-iters and --cost-model require the async tuning '
+                    'loop')
+  if parsed_args.expert is not None:
+    if parsed_args.expert not in tunable_experts:
+      argparser.error(f'--expert must be one of {sorted(tunable_experts)}')
+    # The cost model and the transfer across sizes only know register tiles.
+    if parsed_args.cost_model != 'none' or \
+        len(parsed_args.problem_sizes_list) > 1:
+      argparser.error('--expert tunes a single problem size without cost model')
+  if len(parsed_args.problem_sizes_list) > 1:
+    multi_size_optim_loop(parsed_args=parsed_args)
+  elif parsed_args.tuning_loop == 'bulk_synchronous':
+    bulk_synchronous_optim_loop(parsed_args=parsed_args)
+  else:
+    async_optim_loop(parsed_args=parsed_args)
 
 
 if __name__ == '__main__':
@@ -27,6 +27,8 @@ def _configure_env():
       build_dir, "lib/libmlir_c_runner_utils.so")
   env["MLIR_RUNNER_EXTRA_LIBS"] = os.path.join(
       build_dir, "lib/libmlir_async_runtime_copy.so")
+  # Tests must not depend on the state of the compilation cache.
+  env.pop("SANDBOX_COMPILATION_CACHE", None)
   return env
 
 
@@ -0,0 +1,89 @@
+"""Readers for the benchmark data dumped by the harness.
+
+Supports both the JSON files written by `Measurements.dump_raw_to_file` and the
+JSON Lines files appended to by `Measurements.dump_jsonl_to_file`. JSON Lines
+files are streamed and filtered record by record, so only the selected
+benchmarks and problem sizes are ever materialized.
+
+By default, only the hot cache measurements are read and the rows of experts
+reusing the measurements of a duplicate expert are skipped, so that cold and hot
+measurements are not mixed and reused measurements are not counted twice. Data
+dumped before these columns existed only holds hot, distinct measurements.
+"""
+
+import json, pandas
+
+from typing import Iterator, Optional, Sequence
+
+function_name_column_name = 'function_name'
+problem_size_column_name = 'runtime_problem_sizes_dict'
+cache_mode_column_name = 'cache_mode'
+duplicate_of_column_name = 'duplicate_of'
+
+
+def iter_jsonl_records(file_name: str,
+                       function_names: Optional[Sequence[str]] = None,
+                       problem_sizes: Optional[Sequence[str]] = None,
+                       cache_mode: Optional[str] = 'hot',
+                       include_duplicates: bool = False) -> Iterator[dict]:
+  """Yield the records of a JSON Lines file matching the filters.
+
+  Arguments:
+  file_name: JSON Lines file name.
+  function_names: function names to keep, all if None.
+  problem_sizes: runtime problem sizes to keep (e.g., "m=32,n=48"), all if None.
+  cache_mode: cache mode of the measurements to keep ('hot' or 'cold'), all if
+    None.
+  include_duplicates: keep the rows reusing the measurements of a duplicate
+    expert.
+  """
+  function_names = set(function_names) if function_names else None
+  problem_sizes = set(problem_sizes) if problem_sizes else None
+  with open(file_name, 'r') as f:
+    for line in f:
+      line = line.strip()
+      if not line:
+        continue
+      record = json.loads(line)
+      if function_names is not None and \
+          record[function_name_column_name] not in function_names:
+        continue
+      if problem_sizes is not None and \
+          record[problem_size_column_name] not in problem_sizes:
+        continue
+      if cache_mode is not None and \
+          record.get(cache_mode_column_name, 'hot') != cache_mode:
+        continue
+      if not include_duplicates and record.get(duplicate_of_column_name):
+        continue
+      yield record
+
+
+def read_benchmark_data(file_name: str,
+                        function_names: Optional[Sequence[str]] = None,
+                        problem_sizes: Optional[Sequence[str]] = None,
+                        cache_mode: Optional[str] = 'hot',
+                        include_duplicates: bool = False) -> pandas.DataFrame:
+  """Read the benchmark data matching the filters into a data frame, see
+  `iter_jsonl_records`.
+
+  The function name and the problem sizes are the leading columns.
+  """
+  if file_name.endswith('.jsonl'):
+    data = pandas.DataFrame.from_records(
+        iter_jsonl_records(file_name, function_names, problem_sizes, cache_mode,
+                           include_duplicates))
+    if data.empty:
+      return pandas.DataFrame(
+          columns=[function_name_column_name, problem_size_column_name])
+    return data
+  data = pandas.read_json(file_name)
+  if function_names:
+    data = data[data[function_name_column_name].isin(function_names)]
+  if problem_sizes:
+    data = data[data[problem_size_column_name].isin(problem_sizes)]
+  if cache_mode is not None and cache_mode_column_name in data:
+    data = data[data[cache_mode_column_name] == cache_mode]
+  if not include_duplicates and duplicate_of_column_name in data:
+    data = data[data[duplicate_of_column_name].fillna('') == '']
+  return data
@@ -1,8 +1,11 @@
-import argparse, pandas, sys
+import argparse, pandas, re, sys
 import numpy as np
 
 from ast import literal_eval
 
+from benchmark_data import iter_jsonl_records, problem_size_column_name as \
+    problem_size_key
+
 
 def _parse_arguments() -> argparse.Namespace:
   """Plot argument parser.
@@ -11,7 +14,32 @@ def _parse_arguments() -> argparse.Namespace:
   parser.add_argument("--input",
                       type=str,
                       required=True,
-                      help="input data filename (e.g., --input input)")
+                      help="input data filename (e.g., --input input), either "
+                      "a harness log or a .jsonl data dump")
+  parser.add_argument("--function_names",
+                      type=str,
+                      required=False,
+                      help="comma-separated function names to consider in a "
+                      ".jsonl data dump (e.g., --function_names matmul_mkkn)",
+                      default='')
+  parser.add_argument("--sizes",
+                      type=str,
+                      required=False,
+                      help="semicolon-separated list of problem sizes to "
+                      "consider in a .jsonl data dump "
+                      "(e.g., --sizes=\"m=32,n=48;m=90,n=32\")",
+                      default='')
+  parser.add_argument("--cache_mode",
+                      type=str,
+                      required=False,
+                      choices=["hot", "cold"],
+                      help="cache mode of the measurements to consider in a "
+                      ".jsonl data dump",
+                      default="hot")
+  parser.add_argument("--include_duplicates",
+                      action="store_true",
+                      help="consider the rows of a .jsonl data dump reusing "
+                      "the measurements of a duplicate expert")
 
   return parser.parse_args(sys.argv[1:])
 
@@ -100,22 +128,54 @@ class ParserState(object):
     self.reset()
 
 
+def problem_sizes_dict_to_list(problem_sizes: str) -> str:
+  """Convert a problem size string of a data dump to a command line list.
+
+  Example:
+  "m=32,n=48,strides=[1, 2]" -> "32,48,[1,2]"
+  """
+  groups = re.findall(r"""([a-zA-Z]+)=(\d+|\[[0-9, ]+\])""", problem_sizes)
+  return ','.join(v.replace(' ', '') for _, v in groups)
+
+
+def parse_jsonl(args) -> pandas.DataFrame:
+  """Compute the p50 bandwidth per problem size and expert of a data dump."""
+  function_names = args.function_names.split(',') \
+    if args.function_names else None
+  sizes = args.sizes.split(';') if args.sizes else None
+  records = [
+      (problem_sizes_dict_to_list(r[problem_size_key]), r[expert_column_name],
+       r['gbyte_per_s_per_iter'])
+      for r in iter_jsonl_records(args.input, function_names, sizes,
+                                  args.cache_mode, args.include_duplicates)
+  ]
+  data = pandas.DataFrame.from_records(
+      records,
+      columns=[problem_size_column_name, expert_column_name, p50_column_name])
+  # Keep the first appearance order of the problem sizes and experts.
+  return data.groupby([problem_size_column_name, expert_column_name],
+                      sort=False).median().reset_index()
+
+
 def main():
   args = _parse_arguments()
 
-  parser = ParserState()
-  with open(args.input, "r") as f:
-    line_num = 0
-    for line in f:
-      line_num = line_num + 1
-      stripped = line.strip()
-      parser.parse_next(line, line_num)
-    # Concat data one last time to account for lack of '#########' at the end.
-    parser.concat_new_data()
+  if args.input.endswith('.jsonl'):
+    data = parse_jsonl(args)
+  else:
+    parser = ParserState()
+    with open(args.input, "r") as f:
+      line_num = 0
+      for line in f:
+        line_num = line_num + 1
+        stripped = line.strip()
+        parser.parse_next(line, line_num)
+      # Concat data one last time to account for lack of '#########' at the end.
+      parser.concat_new_data()
+    data = parser.data
 
   # Group by problem size, take the p50-max idx.
-  best_experts = parser.data.loc[parser.data.groupby(
-      problem_size_column_name).p50.idxmax()]
+  best_experts = data.loc[data.groupby(problem_size_column_name).p50.idxmax()]
   # Sort_index puts us back into original file order (i.e. experiment run order)
   best_experts = best_experts.sort_index()
   print(best_experts)
@@ -5,6 +5,8 @@ from numpy import median
 
 import matplotlib.pyplot as plt
 
+from benchmark_data import read_benchmark_data
+
 names_to_translate = {
     'gflop_per_s_per_iter': 'Throughput [Gflop/s]',
     'gbyte_per_s_per_iter': 'Bandwidth [GB/s]',
@@ -46,7 +48,8 @@ def _parse_arguments() -> argparse.Namespace:
       required=True,
       help=
       "comma-separated list of input data filenames (e.g., --input input1,input2)\n"
-      + "The data for multiple files is concatenated into a single graph.")
+      + "The data for multiple files is concatenated into a single graph.\n"
+      "Files with the .jsonl extension are streamed and filtered lazily.")
   parser.add_argument("--output",
                       type=str,
                       required=True,
@@ -79,6 +82,17 @@ def _parse_arguments() -> argparse.Namespace:
                       type=str,
                       required=True,
                       choices=["gflop_per_s_per_iter", "gbyte_per_s_per_iter"])
+  parser.add_argument("--cache_mode",
+                      type=str,
+                      required=False,
+                      choices=["hot", "cold"],
+                      help="cache mode of the measurements to consider in a "
+                      ".jsonl data dump",
+                      default="hot")
+  parser.add_argument("--include_duplicates",
+                      action="store_true",
+                      help="consider the rows of a .jsonl data dump reusing "
+                      "the measurements of a duplicate expert")
   parser.add_argument("--group_by_strides_and_dilations",
                       type=bool,
                       required=False,
@@ -243,13 +257,22 @@ def get_sizes_to_plot(data, args):
 def main():
   args = _parse_arguments()
 
+  # Filter while reading, unless names and sizes are rewritten below.
+  function_names, problem_sizes = None, None
+  if not args.group_by_strides_and_dilations:
+    if args.benchmarks_to_plot != 'all':
+      function_names = args.benchmarks_to_plot.split(',')
+    if args.sizes_to_plot != 'all':
+      problem_sizes = args.sizes_to_plot.split(';')
+
   data = None
   for file in args.inputs.split(','):
     print(f'Processing {file}')
     if not os.path.exists(file):
       print(f'{file} does not exist')
       return
-    read_data = pandas.read_json(file)
+    read_data = read_benchmark_data(file, function_names, problem_sizes,
+                                    args.cache_mode, args.include_duplicates)
     print(read_data)
     data = read_data if data is None else pandas.concat([data, read_data])
 